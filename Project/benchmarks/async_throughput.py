@@ -0,0 +1,141 @@
+"""
+Throughput of the async RAG path (``AbstractRAG.arag_results``) against local stub
+servers for Elasticsearch and the OpenAI chat completions API, compared with the
+synchronous ``rag_results`` in a thread pool of the same size.
+
+The stubs answer after a configurable delay, so the benchmark measures how many
+statements one process keeps in flight, not the speed of the real services.
+
+Usage:
+
+    python benchmarks/async_throughput.py --statements 500 --concurrency 200
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+from aiohttp import web
+
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import elastic_search_engine  # noqa: E402
+import rag  # noqa: E402
+
+
+PROMPT_TEMPLATE = "VAGUE STATEMENT: {vague}\n\nCONTEXT: {context}\n\nCLEAR STATEMENT:"
+ES_HEADERS = {"X-Elastic-Product": "Elasticsearch"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def stub_app(delay: float) -> web.Application:
+    async def es_search(request: web.Request) -> web.Response:
+        await asyncio.sleep(delay)
+        hits = [
+            {"_source": {"vague": f"vague {i}", "actual": f"actual {i}", "id": str(i)}}
+            for i in range(5)
+        ]
+        return web.json_response({"hits": {"hits": hits}}, headers=ES_HEADERS)
+
+    async def chat_completion(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "clear statement"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/{index}/_search", es_search)
+    app.router.add_post("/v1/chat/completions", chat_completion)
+    return app
+
+
+def serve_in_background(app: web.Application, port: int) -> None:
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+async def run_async(rag_instance, statements, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(statement):
+        async with semaphore:
+            return await rag_instance.arag_results(statement)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(statement) for statement in statements])
+    elapsed = time.perf_counter() - start
+    await rag_instance.elastic_searcher.aclose()
+    return elapsed
+
+
+def run_threads(rag_instance, statements, concurrency: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(rag_instance.rag_results, statements))
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--statements", default=500)
+@click.option("--concurrency", default=200)
+@click.option("--delay", default=0.2, help="Stub response delay in seconds")
+def main(statements, concurrency, delay):
+    port = free_port()
+    serve_in_background(stub_app(delay), port)
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+
+    # the keyword searcher needs no encoder, so only the I/O path is measured
+    rag_instance = rag.ChatGPTRAG(
+        elastic_searcher=elastic_search_engine.ElasticKeywordSearcher(
+            index_name="stub", elastic_search_client_uri=f"http://127.0.0.1:{port}"
+        ),
+        prompt_template=PROMPT_TEMPLATE,
+        sentence_transformer_name=None,
+        llm_model="stub-model",
+    )
+    vagues = [f"Let us circle back on item {i}" for i in range(statements)]
+
+    elapsed_async = asyncio.run(run_async(rag_instance, vagues, concurrency))
+    elapsed_threads = run_threads(rag_instance, vagues, concurrency)
+    ideal = 2 * delay * statements / concurrency
+    print(f"{statements} statements, concurrency {concurrency}, stub delay {delay}s")
+    print(f"ideal:   {ideal:.2f}s")
+    for name, elapsed in [("async", elapsed_async), ("threads", elapsed_threads)]:
+        print(f"{name + ':':8} {elapsed:.2f}s  {statements / elapsed:.1f} statements/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Per-call overhead of creating an engine (and a new connection) for every database
+operation, as ``get_db_session`` used to do, compared with the process-wide pooled
+engine.
+
+Usage (PostgreSQL from docker compose has to be running, the connection settings are
+read from ``.env``):
+
+    python benchmarks/db_engine.py --calls 200
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "src"))
+# base_db_operations picks the local host when ../.env exists, relative to src/
+os.chdir(PROJECT_DIR / "src")
+
+from database_operations.base_db_operations import create_db_engine  # noqa: E402
+from database_operations.db import get_db_session  # noqa: E402
+
+
+def engine_per_call() -> None:
+    engine = create_db_engine()
+    session = sessionmaker(bind=engine)()
+    try:
+        session.execute(text("SELECT 1"))
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def pooled() -> None:
+    session = get_db_session()
+    try:
+        session.execute(text("SELECT 1"))
+    finally:
+        session.close()
+
+
+@click.command()
+@click.option("--calls", default=200)
+def main(calls):
+    load_dotenv(PROJECT_DIR / ".env")
+    pooled()  # opens the first pooled connection
+    for name, call in [("engine per call", engine_per_call), ("pooled", pooled)]:
+        latencies = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        print(
+            f"{name:>16}: mean={latencies.mean():.2f}ms "
+            f"p50={np.percentile(latencies, 50):.2f}ms "
+            f"p95={np.percentile(latencies, 95):.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Server-side execution time of the dashboard queries on synthetic data, without
+secondary indexes, with the indexes of ``table_definitions`` and with monthly
+partitioning of ``conversations``.
+
+The data is generated by PostgreSQL itself in a separate ``schema_benchmark`` schema,
+the tables of the application are not touched.
+
+Usage (PostgreSQL from docker compose has to be running, the connection settings are
+read from ``.env``):
+
+    python benchmarks/db_schema.py --rows 10000000
+"""
+import os
+import sys
+from pathlib import Path
+
+import click
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "src"))
+# base_db_operations picks the local host when ../.env exists, relative to src/
+os.chdir(PROJECT_DIR / "src")
+
+from database_operations import migrations  # noqa: E402
+from database_operations.base_db_operations import get_db_engine  # noqa: E402
+from database_operations.table_definitions import Base  # noqa: E402
+
+
+SCHEMA = "schema_benchmark"
+
+QUERIES = {
+    "response time panel": (
+        "SELECT timestamp AS time, response_time FROM conversations ORDER BY timestamp"
+    ),
+    "response time, last 6h": (
+        "SELECT timestamp AS time, response_time FROM conversations "
+        "WHERE timestamp > now() - interval '6 hours' ORDER BY timestamp"
+    ),
+    "clarity by model": (
+        "SELECT avg(clarity), model_used FROM conversations GROUP BY model_used"
+    ),
+    "one model, last day": (
+        "SELECT count(*) FROM conversations "
+        "WHERE model_used = 'T5' AND timestamp > now() - interval '1 day'"
+    ),
+    "feedback join, last day": (
+        "SELECT c.model_used, sum(f.feedback) FROM conversations c "
+        "JOIN feedback f ON f.conversation_id = c.id "
+        "WHERE c.timestamp > now() - interval '1 day' GROUP BY c.model_used"
+    ),
+}
+
+
+def generate(connection, rows: int) -> None:
+    connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    connection.execute(text(f"SET search_path TO {SCHEMA}"))
+    Base.metadata.create_all(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(text(f"DROP INDEX {index.name}"))
+    # one conversation per second back from now, feedback for every other one
+    connection.execute(
+        text(
+            "INSERT INTO conversations (id, question, answer, model_used, "
+            "response_time, clarity, relevance, accuracy, completeness, "
+            "overall_score, timestamp) "
+            "SELECT md5(i::text), 'question', 'answer', "
+            "(ARRAY['GPT-3', 'GPT-4', 'BERT', 'T5'])[1 + i % 4], random() * 5, "
+            "i % 6, i % 6, i % 6, i % 6, random() * 5, "
+            "now() - i * interval '1 second' "
+            "FROM generate_series(1, :rows) AS i"
+        ),
+        {"rows": rows},
+    )
+    connection.execute(
+        text(
+            "INSERT INTO feedback (conversation_id, feedback, timestamp) "
+            "SELECT md5(i::text), CASE WHEN i % 3 = 0 THEN -1 ELSE 1 END, "
+            "now() - i * interval '1 second' "
+            "FROM generate_series(1, :rows, 2) AS i"
+        ),
+        {"rows": rows},
+    )
+
+
+def measure(connection, repeats: int) -> dict:
+    connection.execute(text("ANALYZE"))
+    timings = {}
+    for name, query in QUERIES.items():
+        executions = [
+            connection.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}"))
+            .scalar()[0]["Execution Time"]
+            for _ in range(repeats)
+        ]
+        timings[name] = float(np.median(executions))
+    return timings
+
+
+@click.command()
+@click.option("--rows", default=10_000_000)
+@click.option("--repeats", default=5)
+@click.option("--keep", is_flag=True, help="Keep the benchmark schema")
+def main(rows, repeats, keep):
+    load_dotenv(PROJECT_DIR / ".env")
+    results = {}
+    with get_db_engine().connect() as connection:
+        generate(connection, rows)
+        connection.commit()
+        results["no indexes"] = measure(connection, repeats)
+
+        migrations.create_missing_indexes(connection)
+        connection.commit()
+        results["indexes"] = measure(connection, repeats)
+
+        migrations.partition_conversations_by_month(connection)
+        connection.commit()
+        results["partitioned"] = measure(connection, repeats)
+
+        if not keep:
+            connection.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+            connection.commit()
+
+    print(f"{rows} conversations, median execution time in ms")
+    print(f"{'query':<26}" + "".join(f"{variant:>14}" for variant in results))
+    for name in QUERIES:
+        print(
+            f"{name:<26}"
+            + "".join(f"{timings[name]:>14.1f}" for timings in results.values())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares per-document encoding (the former ingestion behaviour) with length-sorted
+batched encoding and multi-process encoding on ``data/initial_data.json``.
+
+Usage:
+
+    python benchmarks/ingestion_encoding.py --batch_size 64 --processes 4
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import click
+from sentence_transformers import SentenceTransformer
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "src"))
+
+from data_ingestion import encode_in_length_sorted_batches  # noqa: E402
+
+
+@click.command()
+@click.option("--model_name", default="all-mpnet-base-v2")
+@click.option("--batch_size", default=64)
+@click.option("--processes", default=os.cpu_count(), help="Encode worker processes")
+def main(model_name, batch_size, processes):
+    with open(PROJECT_DIR / "data" / "initial_data.json", "r") as f:
+        texts = [doc["vague"] for doc in json.load(f)]
+    model = SentenceTransformer(model_name, device="cpu")
+    model.encode(texts[:8])  # warm up
+
+    timings = {}
+    start = time.perf_counter()
+    for text in texts:
+        model.encode(text).tolist()
+    timings["per document"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encode_in_length_sorted_batches(model, texts, batch_size=batch_size)
+    timings[f"batched ({batch_size})"] = time.perf_counter() - start
+
+    pool = model.start_multi_process_pool(target_devices=["cpu"] * processes)
+    try:
+        start = time.perf_counter()
+        encode_in_length_sorted_batches(model, texts, batch_size=batch_size, pool=pool)
+        timings[f"{processes} processes"] = time.perf_counter() - start
+    finally:
+        model.stop_multi_process_pool(pool)
+
+    print(f"Encoded {len(texts)} documents with {model_name}")
+    for name, seconds in timings.items():
+        print(f"{name:>16}: {seconds:7.2f}s  {len(texts) / seconds:8.1f} docs/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Runs the requests of the data generation scripts against a local stub of the OpenAI
+chat completions API that enforces requests and tokens per minute, answers with 429
+(``retry-after-ms`` and ``x-ratelimit-*`` headers like the API) and, with
+``--error_rate``, rejects random requests with 429 as well.
+
+Compares the former throttling of ``generating_ground_truth_asyncio.py`` (a
+semaphore plus a sleep after every call, the client's own retries) with the
+``AdaptiveRateLimiter`` of ``data_utils/rate_limiter.py``.
+
+Usage:
+
+    python benchmarks/llm_rate_limits.py --requests 300 --rpm 1200 --tpm 120000
+"""
+import asyncio
+import random
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import click
+from aiohttp import web
+from openai import AsyncOpenAI
+
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "data_utils"))
+
+from rate_limiter import AdaptiveRateLimiter  # noqa: E402
+from rate_limiter import TokenBucket  # noqa: E402
+from rate_limiter import chat_completion  # noqa: E402
+
+
+PROMPT = "Provide 5 variations of: Lets put our ducks in a row. " * 20
+MESSAGES = [{"role": "user", "content": PROMPT}]
+COMPLETION_TOKENS = 100
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def stub_app(rpm: int, tpm: int, delay: float, error_rate: float) -> web.Application:
+    # one second of burst, the API enforces its limits at a fine granularity too
+    buckets = {
+        "requests": (TokenBucket(rpm, burst_seconds=1), rpm),
+        "tokens": (TokenBucket(tpm, burst_seconds=1), tpm),
+    }
+    counts = {"ok": 0, "429": 0}
+
+    def rate_limit_headers():
+        headers = {}
+        for kind, (bucket, limit) in buckets.items():
+            bucket.refill()
+            headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+            headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(bucket.level)))
+            reset = (bucket.capacity - bucket.level) / bucket.rate
+            headers[f"x-ratelimit-reset-{kind}"] = f"{reset:.3f}s"
+        return headers
+
+    async def chat_completion_handler(request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        tokens = prompt_tokens + COMPLETION_TOKENS
+        requests_bucket, tokens_bucket = buckets["requests"][0], buckets["tokens"][0]
+        wait = max(requests_bucket.wait_time(1), tokens_bucket.wait_time(tokens))
+        if wait > 0 or random.random() < error_rate:
+            counts["429"] += 1
+            headers = rate_limit_headers()
+            headers["retry-after-ms"] = str(int(wait * 1000))
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status=429,
+                headers=headers,
+            )
+        requests_bucket.take(1)
+        tokens_bucket.take(tokens)
+        counts["ok"] += 1
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "[]"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": COMPLETION_TOKENS,
+                    "total_tokens": tokens,
+                },
+            },
+            headers=rate_limit_headers(),
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completion_handler)
+    app["counts"] = counts
+    return app
+
+
+def serve_in_background(app: web.Application, port: int) -> None:
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+async def run_fixed(base_url: str, requests: int) -> int:
+    """The former throttling: Semaphore(5), a 0.5s sleep, the client's retries."""
+    client = AsyncOpenAI(base_url=base_url, api_key="stub")
+    semaphore = asyncio.Semaphore(5)
+    failed = 0
+
+    async def one():
+        nonlocal failed
+        async with semaphore:
+            try:
+                await client.chat.completions.create(model="stub", messages=MESSAGES)
+            except Exception:
+                failed += 1
+            await asyncio.sleep(0.5)
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+    await client.close()
+    return failed
+
+
+async def run_adaptive(base_url: str, requests: int, limiter) -> int:
+    client = AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    failed = 0
+
+    async def one():
+        nonlocal failed
+        try:
+            await chat_completion(limiter, client, model="stub", messages=MESSAGES)
+        except Exception:
+            failed += 1
+
+    await asyncio.gather(*[one() for _ in range(requests)])
+    await client.close()
+    return failed
+
+
+@click.command()
+@click.option("--requests", default=300)
+@click.option("--rpm", default=1200, help="Requests per minute of the stub")
+@click.option("--tpm", default=120_000, help="Tokens per minute of the stub")
+@click.option("--delay", default=0.2, help="Stub response delay in seconds")
+@click.option("--error_rate", default=0.02, help="Share of random 429s")
+def main(requests, rpm, tpm, delay, error_rate):
+    results = {}
+    for name in ["fixed", "adaptive"]:
+        # a fresh stub per run, so both start with full budgets
+        app = stub_app(rpm, tpm, delay, error_rate)
+        port = free_port()
+        serve_in_background(app, port)
+        base_url = f"http://127.0.0.1:{port}/v1"
+        # the limiter starts from conservative budgets, the headers correct them
+        limiter = AdaptiveRateLimiter(
+            requests_per_minute=rpm / 2, tokens_per_minute=tpm / 2, base_backoff=0.2
+        )
+        start = time.perf_counter()
+        if name == "fixed":
+            failed = asyncio.run(run_fixed(base_url, requests))
+        else:
+            failed = asyncio.run(run_adaptive(base_url, requests, limiter))
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed, failed, dict(app["counts"]))
+        if name == "adaptive":
+            print(f"final concurrency limit: {limiter.concurrency:.1f}")
+
+    ideal = requests / min(rpm / 60, tpm / 60 / (len(PROMPT) // 4 + COMPLETION_TOKENS))
+    print(f"{requests} requests, stub limits {rpm} RPM / {tpm} TPM")
+    print(f"ideal:     {ideal:.1f}s")
+    for name, (elapsed, failed, counts) in results.items():
+        print(
+            f"{name + ':':10} {elapsed:.1f}s  {requests / elapsed:.1f} requests/s  "
+            f"429s={counts['429']}  failed={failed}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Checks the vectorized metrics of ``retrieval_metrics`` against the list based
+``text_retrieval_metrics`` and against direct per-query definitions of precision,
+recall and nDCG, then times them on synthetic relevance judgments.
+
+Usage:
+
+    python benchmarks/metrics_engine.py --queries 2000000 --k 10
+"""
+import math
+import sys
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "utils"))
+
+import retrieval_metrics  # noqa: E402
+import text_retrieval_metrics  # noqa: E402
+
+
+def reference_metrics(relevance_total: list, k: int) -> dict:
+    """Per-query definitions of the metrics at cutoff ``k``."""
+    precision, recall, ndcg = [], [], []
+    for line in relevance_total:
+        top = line[:k]
+        n_relevant = sum(line)
+        found = sum(top)
+        precision.append(found / k)
+        recall.append(found / n_relevant if n_relevant else 0.0)
+        dcg = sum(1 / math.log2(rank + 2) for rank, rel in enumerate(top) if rel)
+        idcg = sum(1 / math.log2(rank + 2) for rank in range(min(k, n_relevant)))
+        ndcg.append(dcg / idcg if idcg else 0.0)
+    return {
+        "hit_rate": text_retrieval_metrics.hit_rate(top_k(relevance_total, k)),
+        "mrr": text_retrieval_metrics.mrr(top_k(relevance_total, k)),
+        "precision": np.mean(precision),
+        "recall": np.mean(recall),
+        "ndcg": np.mean(ndcg),
+    }
+
+
+def top_k(relevance_total: list, k: int) -> list:
+    return [line[:k] for line in relevance_total]
+
+
+def random_relevance(queries: int, k: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.random((queries, k)) < 0.15
+
+
+def check_equivalence(queries: int, k: int, rng: np.random.Generator) -> None:
+    relevance = random_relevance(queries, k, rng)
+    # ragged lists of python booleans, as built by the evaluation notebook
+    relevance_total = [
+        [bool(rel) for rel in row[: rng.integers(0, k + 1)]] for row in relevance
+    ]
+    vectorized = retrieval_metrics.metrics_at_k(relevance_total, k)
+    for cutoff in range(1, k + 1):
+        expected = reference_metrics(relevance_total, cutoff)
+        for name, value in expected.items():
+            assert np.isclose(vectorized[name][cutoff - 1], value), (
+                name,
+                cutoff,
+                vectorized[name][cutoff - 1],
+                value,
+            )
+
+    # one relevant document per query: the first hit ranks give the same metrics
+    single = np.zeros((queries, k), dtype=bool)
+    ranks = rng.integers(0, k + 1, queries)
+    single[np.flatnonzero(ranks), ranks[ranks > 0] - 1] = True
+    from_matrix = retrieval_metrics.metrics_at_k(single, n_relevant=1)
+    from_ranks = retrieval_metrics.metrics_at_k(ranks, k)
+    for name in from_matrix:
+        assert np.allclose(from_matrix[name], from_ranks[name]), name
+    print(f"equivalence checked on {queries} queries for k = 1..{k}")
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option("--queries", default=2_000_000)
+@click.option("--k", default=10)
+@click.option("--check_queries", default=2000, help="Queries of the equivalence check")
+@click.option("--seed", default=42)
+def main(queries, k, check_queries, seed):
+    rng = np.random.default_rng(seed)
+    check_equivalence(check_queries, k, rng)
+
+    relevance = random_relevance(queries, k, rng)
+    ranks = retrieval_metrics.first_hit_ranks(relevance)
+    relevance_total = relevance[: min(queries, 200_000)].tolist()
+
+    _, seconds = timed(text_retrieval_metrics.hit_rate, relevance_total)
+    _, mrr_seconds = timed(text_retrieval_metrics.mrr, relevance_total)
+    per_query = (seconds + mrr_seconds) / len(relevance_total)
+    print(
+        f"text_retrieval_metrics hit_rate + mrr@{k}: "
+        f"{per_query * queries:.2f}s for {queries} queries "
+        f"(extrapolated from {len(relevance_total)})"
+    )
+    _, seconds = timed(retrieval_metrics.metrics_at_k, relevance)
+    print(f"metrics_at_k, matrix, all metrics@1..{k}: {seconds:.3f}s")
+    _, seconds = timed(retrieval_metrics.metrics_at_k, ranks, k)
+    print(f"metrics_at_k, first hit ranks, all metrics@1..{k}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares latency and recall of the Elasticsearch kNN searcher with the in-process
+numpy searcher on the ground truth queries.
+
+Usage (Elasticsearch with the ``vague-actual-mpnet`` index has to be running and the
+numpy index has to be built via ``python src/numpy_search_engine.py``):
+
+    python benchmarks/search_backends.py --sample 1000
+"""
+import sys
+import time
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "src"))
+sys.path.append(str(PROJECT_DIR / "utils"))
+
+import text_retrieval_metrics  # noqa: E402
+
+import elastic_search_engine  # noqa: E402
+import numpy_search_engine  # noqa: E402
+
+
+def timed_search(searcher, query_vectors):
+    latencies, results = [], []
+    for query_vector in query_vectors:
+        start = time.perf_counter()
+        results.append(searcher.search(input_argument=query_vector))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+@click.command()
+@click.option("--elastic_url", default="http://localhost:9200")
+@click.option("--index_name", default="vague-actual-mpnet")
+@click.option("--model_name", default="all-mpnet-base-v2")
+@click.option("--sample", default=1000, help="Number of ground truth queries")
+def main(elastic_url, index_name, model_name, sample):
+    ground_truth = pd.read_csv(PROJECT_DIR / "data" / "ground_truth_data.csv")
+    ground_truth = ground_truth.sample(min(sample, len(ground_truth)), random_state=42)
+    model = SentenceTransformer(model_name)
+    query_vectors = model.encode(ground_truth["vague"].tolist())
+
+    searchers = {
+        "elastic": elastic_search_engine.ElasticSemanticSearcher(
+            index_name=index_name, elastic_search_client_uri=elastic_url
+        ),
+        "numpy": numpy_search_engine.NumpySemanticSearcher(),
+    }
+    results = {}
+    for name, searcher in searchers.items():
+        searcher.search(input_argument=query_vectors[0])  # warm up
+        results[name], latencies = timed_search(searcher, query_vectors)
+        relevance = [
+            [doc["id"] == doc_id for doc in docs]
+            for docs, doc_id in zip(results[name], ground_truth["doc_id"])
+        ]
+        print(
+            f"{name:>8}: p50={np.percentile(latencies, 50):.2f}ms "
+            f"p95={np.percentile(latencies, 95):.2f}ms "
+            f"hit_rate={text_retrieval_metrics.hit_rate(relevance):.3f} "
+            f"mrr={text_retrieval_metrics.mrr(relevance):.3f}"
+        )
+
+    # recall of the exact numpy top-k against the approximate ES kNN top-k
+    overlap = [
+        len({d["id"] for d in es} & {d["id"] for d in np_}) / max(len(es), 1)
+        for es, np_ in zip(results["elastic"], results["numpy"])
+    ]
+    print(f"numpy vs elastic top-k overlap: {np.mean(overlap):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Startup benchmark: measures the cold import time of the application entry points with
+``python -X importtime`` and fails if it exceeds the budget.
+
+Usage:
+
+    python benchmarks/startup_importtime.py --budget_ms 2500
+"""
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import click
+
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def measure_imports(modules: List[str]) -> List[Tuple[str, int, int, int]]:
+    """
+    Imports the modules in a fresh interpreter.
+    :return: (module, self time [us], cumulative time [us], nesting level) per import.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{completed.stderr[-2000:]}")
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+@click.command()
+@click.option("--modules", default="app,cli_rag", help="Comma separated entry points")
+@click.option("--budget_ms", default=2500.0, help="Maximal cold import time")
+@click.option("--top", default=15, help="Number of slowest imports shown")
+def main(modules, budget_ms, top):
+    modules = modules.split(",")
+    imports = measure_imports(modules)
+
+    # top level imports of the entry points have the smallest nesting level
+    entry_points: Dict[str, int] = {
+        module: cumulative
+        for module, _, cumulative, level in imports
+        if module in modules and level == 0
+    }
+    total_ms = sum(entry_points.values()) / 1000
+
+    print(f"Slowest {top} imports (cumulative):")
+    for module, _, cumulative, _ in sorted(imports, key=lambda i: -i[2])[:top]:
+        print(f"{cumulative / 1000:10.1f}ms  {module}")
+    for module, cumulative in entry_points.items():
+        print(f"import {module}: {cumulative / 1000:.1f}ms")
+    print(f"Cold start: {total_ms:.1f}ms (budget {budget_ms:.1f}ms)")
+
+    if total_ms > budget_ms:
+        sys.exit(f"Cold start regressed: {total_ms:.1f}ms > {budget_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
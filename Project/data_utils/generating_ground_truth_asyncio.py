@@ -7,13 +7,13 @@ import json
 import pickle
 from pathlib import Path
 
-import aiohttp
 import loguru
 import pandas as pd
-import tenacity
 from dotenv import find_dotenv
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
+from rate_limiter import AdaptiveRateLimiter
+from rate_limiter import chat_completion
 from tqdm.asyncio import tqdm_asyncio
 
 
@@ -21,13 +21,13 @@ logger = loguru.logger
 
 load_dotenv(find_dotenv())
 
-client = AsyncOpenAI()
+# retries are done by the rate limiter
+client = AsyncOpenAI(max_retries=0)
 
-# Rate limiting settings
-MAX_CONCURRENT_REQUESTS = 5  # Adjust based on your API limits
-REQUEST_INTERVAL = 0.5  # Time in seconds between requests
-MAX_RETRIES = 3  # Maximum number of retries for a failed request
-RETRY_DELAY = 2  # Delay between retries in seconds
+# Rate limiting settings, the budgets are corrected by the rate limit headers
+REQUESTS_PER_MINUTE = 500  # Adjust based on your API limits
+TOKENS_PER_MINUTE = 200_000
+MAX_CONCURRENT_REQUESTS = 32
 
 prompt_template_for_generating_gt = """
 You are an AI assistant tasked with creating slight variations of IT manager statements.
@@ -73,40 +73,26 @@ Variations:
 """.strip()
 
 
-@tenacity.retry(
-    stop=tenacity.stop_after_attempt(MAX_RETRIES),
-    wait=tenacity.wait_fixed(RETRY_DELAY),
-    retry=tenacity.retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
-    before_sleep=lambda retry_state: print(
-        f"Retrying after error: {retry_state.outcome.exception()}"
-    ),
-)
-async def generate_ground_truth_statement(question, semaphore):
-    async with semaphore:
-        try:
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt_template_for_generating_gt.format(
-                            question=question
-                        ),
-                    }
-                ],
-            )
-            await asyncio.sleep(REQUEST_INTERVAL)  # Add delay between requests
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error in generate_ground_truth_statement: {e}")
-            raise  # Re-raise the exception to trigger a retry
+async def generate_ground_truth_statement(question, limiter):
+    response = await chat_completion(
+        limiter,
+        client,
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "user",
+                "content": prompt_template_for_generating_gt.format(question=question),
+            }
+        ],
+    )
+    return response.choices[0].message.content
 
 
-async def process_document(doc, semaphore):
+async def process_document(doc, limiter):
     max_attempts = 3
     for attempt in range(max_attempts):
         try:
-            generated = await generate_ground_truth_statement(doc["vague"], semaphore)
+            generated = await generate_ground_truth_statement(doc["vague"], limiter)
             generated = generated.replace("```", "").strip()
             parsed = json.loads(generated)
             if isinstance(parsed, list) and len(parsed) == 5:
@@ -120,22 +106,24 @@ async def process_document(doc, semaphore):
             print(f"Unexpected error for document {doc['id']}, attempt {attempt + 1}: \
                 {e}")
 
-        if attempt < max_attempts - 1:
-            await asyncio.sleep(REQUEST_INTERVAL)
-
     print(f"Failed to process document {doc['id']} after {max_attempts} attempts")
     return doc["id"], None
 
 
 async def generate_ground_truth_csv_file(data):
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    limiter = AdaptiveRateLimiter(
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_concurrency=MAX_CONCURRENT_REQUESTS,
+    )
     gt_doc_id_vague = {}
-    tasks = [process_document(doc, semaphore) for doc in data]
+    tasks = [process_document(doc, limiter) for doc in data]
 
     for task in tqdm_asyncio.as_completed(tasks, total=len(tasks)):
         doc_id, result = await task
         if result is not None:
             gt_doc_id_vague[doc_id] = result
+    logger.info(f"Rate limiter: {limiter.stats}")
 
     with open(Path().cwd().parents[0] / "data" / "gt_doc_id_vague.pkl", "wb") as f:
         pickle.dump(gt_doc_id_vague, f)
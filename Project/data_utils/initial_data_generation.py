@@ -12,13 +12,19 @@ from dotenv import find_dotenv
 from dotenv import load_dotenv
 from loguru import logger
 from openai import AsyncOpenAI
+from rate_limiter import AdaptiveRateLimiter
+from rate_limiter import chat_completion
 
 
 # Load environment variables
 load_dotenv(find_dotenv())
 
-# Initialize AsyncOpenAI client
-client = AsyncOpenAI()
+# Initialize AsyncOpenAI client, retries are done by the rate limiter
+client = AsyncOpenAI(max_retries=0)
+
+# Rate limiting settings, the budgets are corrected by the rate limit headers
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
 
 # Set up Loguru
 logger.add("script_log.log", rotation="10 MB", level="INFO")
@@ -57,10 +63,14 @@ def safe_json_loads(content: str) -> List[Dict[str, str]]:
         logger.error(f"JSON Decode Error: {str(e)}")
         return []  # Return an empty list instead of None
 
-async def generate_chat_response(prompt: str, session: aiohttp.ClientSession) -> List[Dict[str, str]]:
+async def generate_chat_response(
+    prompt: str, session: aiohttp.ClientSession, limiter: AdaptiveRateLimiter
+) -> List[Dict[str, str]]:
     try:
         logger.info("Sending request to OpenAI API")
-        response = await client.chat.completions.create(
+        response = await chat_completion(
+            limiter,
+            client,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are an AI assistant that generates pairs of IT-related sentences as specified. Always return a valid JSON list of dictionaries. Do not use contractions or apostrophes."},
@@ -77,10 +87,17 @@ async def generate_chat_response(prompt: str, session: aiohttp.ClientSession) ->
         return []
 
 async def generate_all_responses(num_requests: int) -> List[Dict[str, str]]:
+    limiter = AdaptiveRateLimiter(
+        requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE
+    )
     async with aiohttp.ClientSession() as session:
         logger.info(f"Starting {num_requests} API requests")
-        tasks = [generate_chat_response(PROMPT, session) for _ in range(num_requests)]
+        tasks = [
+            generate_chat_response(PROMPT, session, limiter)
+            for _ in range(num_requests)
+        ]
         results = await asyncio.gather(*tasks)
+    logger.info(f"Rate limiter: {limiter.stats}")
     flattened_results = [item for sublist in results for item in sublist if isinstance(item, dict) and 'vague' in item and 'actual' in item]
     logger.success(f"Generated a total of {len(flattened_results)} valid sentence pairs")
     return flattened_results
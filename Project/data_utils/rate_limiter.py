@@ -0,0 +1,272 @@
+"""
+Adaptive rate limiter for the OpenAI calls of the data generation scripts.
+
+A request waits for
+
+* a token of the requests-per-minute bucket,
+* its estimated tokens in the tokens-per-minute bucket (the estimate is corrected
+  by the usage of the response),
+* a free slot of the adaptive concurrency limit.
+
+The ``x-ratelimit-*`` headers of every response bring the buckets in line with what
+the API reports, a 429 pauses all requests for the ``retry-after`` of the response
+or an exponential backoff with full jitter. The concurrency limit follows AIMD: it
+grows by one per window of successful requests and is halved on every 429.
+
+Usage:
+
+    limiter = AdaptiveRateLimiter(requests_per_minute=500, tokens_per_minute=200_000)
+    response = await chat_completion(limiter, client, model=..., messages=[...])
+"""
+import asyncio
+import random
+import re
+import time
+from typing import Dict
+from typing import Optional
+
+import openai
+from loguru import logger
+from openai import AsyncOpenAI
+
+
+_DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses durations of the rate limit headers, e.g. ``6m0s``, ``1.5s``, ``20ms``."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def _header_number(headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_seconds: float = 10):
+        """
+        :param per_minute: Refill rate.
+        :param burst_seconds: The bucket holds the refill of that many seconds.
+        """
+        self.burst_seconds = burst_seconds
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def set_rate(self, per_minute: float) -> None:
+        self.refill()
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * self.burst_seconds)
+        self.level = min(self.level, self.capacity)
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(
+            self.capacity, self.level + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` is available, 0 if it is available now."""
+        self.refill()
+        # a request larger than the bucket only waits for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def limit_to(self, remaining: float, reset_seconds: Optional[float]) -> None:
+        """Applies the remaining budget reported by the API."""
+        self.refill()
+        self.level = min(self.level, remaining)
+        if remaining < 1 and reset_seconds:
+            # exhausted, nothing is available before the API resets the budget
+            self.level = min(self.level, -reset_seconds * self.rate)
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200_000,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 4,
+        max_retries: int = 6,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        """
+        :param requests_per_minute: Request budget, the RPM limit of the account.
+        :param tokens_per_minute: Token budget, the TPM limit of the account.
+        :param max_concurrency: Upper bound of the adaptive concurrency limit.
+        :param min_concurrency: Lower bound of the adaptive concurrency limit.
+        :param initial_concurrency: Concurrency limit to start with.
+        :param max_retries: Retries of a rate limited or failed request.
+        :param base_backoff: First backoff in seconds, doubled per attempt.
+        :param max_backoff: Upper bound of a backoff in seconds.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(initial_concurrency)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # created on first use, so that it is bound to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Waits until the request fits into the budgets and the concurrency limit."""
+        async with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                )
+                if wait <= 0 and self.in_flight < int(self.concurrency):
+                    self.requests.take(1)
+                    self.tokens.take(estimated_tokens)
+                    self.in_flight += 1
+                    return
+                # woken up by a finished request or when the budget is refilled
+                try:
+                    await asyncio.wait_for(
+                        self.condition.wait(), timeout=wait if wait > 0 else None
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def update_from_headers(self, headers) -> None:
+        """Aligns the buckets with the ``x-ratelimit-*`` headers of a response."""
+        for bucket, kind in [(self.requests, "requests"), (self.tokens, "tokens")]:
+            limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+            if limit:
+                # the limits of the account win over the configured budget
+                bucket.set_rate(limit)
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is not None:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                bucket.limit_to(remaining, reset)
+
+    def on_success(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        self.stats["requests"] += 1
+        if used_tokens is not None:
+            # charge (or refund) the difference to the estimate
+            self.tokens.take(used_tokens - estimated_tokens)
+        # additive increase: +1 per concurrency-many successful requests
+        self.concurrency = min(
+            self.max_concurrency, self.concurrency + 1 / self.concurrency
+        )
+
+    def on_rate_limited(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Halves the concurrency, pauses all requests and returns the pause."""
+        self.stats["rate_limited"] += 1
+        self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+        pause = self.backoff(attempt, retry_after)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        return pause
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            # a little jitter, so that the waiting requests do not return at once
+            return retry_after + random.uniform(0, self.base_backoff)
+        # full jitter
+        return random.uniform(
+            0, min(self.max_backoff, self.base_backoff * 2**attempt)
+        )
+
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None) -> int:
+    """Rough token estimate of a chat request: 4 characters per prompt token."""
+    prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+    return prompt_tokens + (max_tokens or 1000)
+
+
+def _retry_after(headers) -> Optional[float]:
+    if headers is None:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        return float(retry_after_ms) / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+async def chat_completion(limiter: AdaptiveRateLimiter, client: AsyncOpenAI, **kwargs):
+    """
+    ``client.chat.completions.create(**kwargs)`` under the limiter, retrying rate
+    limited requests, server errors and connection errors. The retries of the client
+    itself should be disabled (``AsyncOpenAI(max_retries=0)``).
+    """
+    estimated_tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    for attempt in range(limiter.max_retries + 1):
+        await limiter.acquire(estimated_tokens)
+        pause = 0.0
+        try:
+            raw_response = await client.chat.completions.with_raw_response.create(
+                **kwargs
+            )
+            response = raw_response.parse()
+            limiter.update_from_headers(raw_response.headers)
+            used_tokens = response.usage.total_tokens if response.usage else None
+            if response.usage:
+                limiter.stats["prompt_tokens"] += response.usage.prompt_tokens
+                limiter.stats["completion_tokens"] += response.usage.completion_tokens
+            limiter.on_success(estimated_tokens, used_tokens)
+            return response
+        except openai.RateLimitError as e:
+            # the pause applies to all requests, see acquire
+            pause_all = limiter.on_rate_limited(
+                attempt, _retry_after(e.response.headers)
+            )
+            logger.warning(f"Rate limited, pausing requests for {pause_all:.2f}s")
+            if attempt == limiter.max_retries:
+                raise
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            limiter.stats["errors"] += 1
+            if attempt == limiter.max_retries:
+                raise
+            pause = limiter.backoff(attempt)
+            logger.warning(f"Request failed ({e}), retrying in {pause:.2f}s")
+        finally:
+            # any other error (bad request, cancellation, ...) frees the slot as well
+            await limiter.release()
+        await asyncio.sleep(pause)
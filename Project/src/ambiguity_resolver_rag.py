@@ -1,6 +1,6 @@
-import os
+import threading
 
-import elastic_search_engine
+import answer_cache
 import rag
 
 
@@ -20,23 +20,35 @@ CONTEXT: {context}
 CLEAR STATEMENT:""".strip()
 
 
-def create_rag(elastic_url=None):
-    if elastic_url:
-        os.environ['ELASTIC_URL'] = elastic_url
-    
-    elastic_semantic_searcher = elastic_search_engine.ElasticSemanticSearcher(
-        index_name="vague-actual-mpnet",
-        elastic_search_client_uri=os.getenv("ELASTIC_URL", "http://localhost:9200"),
+def create_rag(elastic_url=None, search_backend=None):
+    elastic_semantic_searcher = rag.create_semantic_searcher(
+        elastic_url, search_backend
     )
-
-    print(f'ELASTIC_URL {os.getenv("ELASTIC_URL")}')
     # defining new RAG with a prompt above
     return rag.ChatGPTRAG(
         elastic_searcher=elastic_semantic_searcher,
         prompt_template=ambiguity_resolver_prompt,
         llm_model="gpt-4o-mini",
         sentence_transformer_name="all-mpnet-base-v2",
+        answer_cache=answer_cache.get_default_answer_cache(),
     )
 
-# Initialize with default settings
-ambiguity_resolver_rag = create_rag()
\ No newline at end of file
+_rag = None
+_rag_lock = threading.Lock()
+
+
+def get_rag():
+    """Returns the RAG with default settings, it is built on first use."""
+    global _rag
+    with _rag_lock:
+        if _rag is None:
+            _rag = create_rag()
+        return _rag
+
+
+def __getattr__(name):
+    # keeps ``from ambiguity_resolver_rag import ambiguity_resolver_rag`` working
+    # without building the RAG at import time
+    if name == "ambiguity_resolver_rag":
+        return get_rag()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,235 @@
+"""
+Cache of RAG answers in front of ``AbstractRAG.rag_results``.
+
+A lookup first tries an exact match on the normalized statement and then a semantic
+match: the answer of a cached statement is reused when the cosine similarity of the
+query embeddings is at least ``similarity_threshold``. Entries are namespaced by the
+LLM model and the prompt template, expire after ``ttl_seconds`` and the least
+recently used ones are evicted beyond ``max_entries``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class _Entry:
+    answer: str
+    vector: Optional[np.ndarray]
+    created_at: float
+    latency: float
+
+
+class _VectorIndex:
+    """
+    Normalized query vectors of one namespace in a preallocated matrix: a vector is
+    appended on ``add`` and the last row takes the place of a removed one.
+    """
+
+    def __init__(self, initial_capacity: int = 64):
+        self.initial_capacity = initial_capacity
+        self.keys: List[Tuple[str, str]] = []
+        self.rows: Dict[Tuple[str, str], int] = {}
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            return np.empty((0, 0), np.float32)
+        return self._matrix[: len(self.keys)]
+
+    def add(self, key: Tuple[str, str], vector: np.ndarray) -> None:
+        if self._matrix is None:
+            self._matrix = np.empty(
+                (self.initial_capacity, len(vector)), dtype=np.float32
+            )
+        elif len(self.keys) == len(self._matrix):
+            # doubled, so that appending stays amortized O(dim)
+            grown = np.empty((2 * len(self._matrix), self._matrix.shape[1]), np.float32)
+            grown[: len(self.keys)] = self._matrix
+            self._matrix = grown
+        self.rows[key] = len(self.keys)
+        self._matrix[len(self.keys)] = vector
+        self.keys.append(key)
+
+    def remove(self, key: Tuple[str, str]) -> None:
+        row = self.rows.pop(key)
+        last_key = self.keys.pop()
+        if last_key != key:
+            self._matrix[row] = self._matrix[len(self.keys)]
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_seconds: float = 24 * 3600,
+        similarity_threshold: float = 0.95,
+    ):
+        """
+        :param max_entries: Size bound, least recently used entries are evicted first.
+        :param ttl_seconds: Entries older than this are not returned.
+        :param similarity_threshold: Minimal cosine similarity of a semantic hit,
+            a value above 1 disables the semantic lookup.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # per namespace matrix of normalized query vectors
+        self._indexes: Dict[str, _VectorIndex] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def namespace(llm_model: str, prompt_template: str) -> str:
+        digest = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+        return f"{llm_model}:{digest}"
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split()).strip(" .!?")
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created_at > self.ttl_seconds
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key)
+        if entry.vector is not None:
+            index = self._indexes[key[0]]
+            index.remove(key)
+            if not len(index):
+                del self._indexes[key[0]]
+
+    def _hit(self, key: Tuple[str, str]) -> str:
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        self.saved_seconds += entry.latency
+        return entry.answer
+
+    def get(self, namespace: str, text: str, vector=None) -> Optional[str]:
+        """
+        :param namespace: Result of ``namespace``.
+        :param text: The vague statement.
+        :param vector: Embedding of the statement, without it only the exact lookup
+            is done.
+        :return: The cached answer or None.
+        """
+        key = (namespace, self.normalize(text))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self.exact_hits += 1
+                return self._hit(key)
+
+            if vector is not None and self.similarity_threshold <= 1:
+                index = self._indexes.get(namespace)
+                if index is not None:
+                    keys = index.keys
+                    similarities = index.matrix @ self._unit(vector)
+                    # only the few entries above the threshold are sorted; expired
+                    # entries are skipped, they are removed on their own lookup
+                    candidates = np.flatnonzero(
+                        similarities >= self.similarity_threshold
+                    )
+                    for i in candidates[np.argsort(-similarities[candidates])]:
+                        if not self._expired(self._entries[keys[i]], now):
+                            self.semantic_hits += 1
+                            logger.debug(
+                                f"Semantic answer cache hit for '{text}' "
+                                f"(similarity {similarities[i]:.3f} to '{keys[i][1]}')"
+                            )
+                            return self._hit(keys[i])
+
+            self.misses += 1
+            return None
+
+    def put(
+        self, namespace: str, text: str, answer: str, vector=None, latency: float = 0.0
+    ) -> None:
+        """
+        :param latency: Seconds it took to produce the answer, counted as saved on
+            every hit.
+        """
+        key = (namespace, self.normalize(text))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            entry = _Entry(
+                answer=answer,
+                vector=None if vector is None else self._unit(vector),
+                created_at=time.time(),
+                latency=latency,
+            )
+            self._entries[key] = entry
+            if entry.vector is not None:
+                self._indexes.setdefault(namespace, _VectorIndex()).add(
+                    key, entry.vector
+                )
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "entries": len(self._entries),
+            }
+
+
+_default_cache: Optional[AnswerCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_answer_cache() -> Optional[AnswerCache]:
+    """
+    Process-wide cache configured by ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL and
+    ANSWER_CACHE_THRESHOLD. It is shared by all users, so a user may get the answer
+    to another user's similar statement; it is off (returns None) unless
+    ANSWER_CACHE_ENABLED=true.
+    """
+    global _default_cache
+    if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache(
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10_000)),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600)),
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+            )
+        return _default_cache
@@ -9,13 +9,17 @@ also  includes a feedback system and displays usage statistics.
 The application uses Loguru for logging, Streamlit for the web interface, and interacts 
 with custom RAG (Retrieval-Augmented Generation) models and a judge LLM for evaluating 
 responses. It includes error handling for network issues and API problems.
+
+The judge LLM is not on the response path: conversations are saved right away and
+queued, a background worker fills in the judgement scores later.
 """
 
+import os
 import sys
-import time
 import uuid
 from typing import Any
 from typing import Dict
+from typing import Optional
 
 import streamlit as st
 from loguru import logger
@@ -24,14 +28,13 @@ from openai import OpenAIError
 # Import necessary exceptions
 from requests.exceptions import RequestException
 
-from ambiguity_resolver_rag import ambiguity_resolver_rag
 from database_operations.db import get_feedback_stats
 from database_operations.db import save_conversation
 from database_operations.db import save_feedback
-from judge_llm import JudgeLLM
-from judge_llm import JudgeLLMPromptInput
-from judge_llm import LLMJudgementScore
-from phi_rag import phi3_rag
+from judge_worker import start_judge_worker
+from pipelines import PIPELINES
+from pipelines import get_pipeline
+from pipelines import warmup
 
 
 def setup_logging():
@@ -52,6 +55,30 @@ def setup_logging():
     )
 
 
+@st.cache_resource
+def start_warmup():
+    """Warm up the RAG pipelines once per process in a background thread.
+
+    The first rendering of the page is not blocked by loading the encoder and creating
+    the clients; a request arriving before the warm up is finished builds the pipeline
+    itself.
+    """
+    return warmup(background=True)
+
+
+def start_background_judging():
+    """Start the judge worker once per process.
+
+    Called on every run of the script: ``start_judge_worker`` only starts a thread if
+    none is alive, so a worker thread that died is replaced. It can be disabled with
+    JUDGE_WORKER_IN_APP=false when the worker runs as a separate service
+    (``python judge_worker.py``).
+    """
+    if os.getenv("JUDGE_WORKER_IN_APP", "true").lower() == "true":
+        return start_judge_worker(max_workers=int(os.getenv("JUDGE_WORKERS", 4)))
+    return None
+
+
 def init_session_state():
     """Initialize the Streamlit session state.
 
@@ -65,42 +92,48 @@ def init_session_state():
         logger.info("Feedback count initialized to 0")
 
 
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
 def process_user_input(user_input: str, model_choice: str) -> Dict[str, Any]:
-    """Process the user's input using the selected model and judge LLM.
+    """Process the user's input using the selected model.
+
+    The answer is streamed to the page while it is generated.
 
     :param user_input: The vague statement input by the user.
     :type user_input: str
     :param model_choice: The name of the selected model to use for processing.
     :type model_choice: str
-    :return: A dictionary containing the processed answer, LLM judgement score,
-             and response time. In case of an error, it contains an error message.
+    :return: A dictionary containing the processed answer, response time,
+             time-to-first-token and tokens per second. In case of an error, it
+             contains an error message.
     :rtype: Dict[str, Any]
     :raises: RequestException, OpenAIError, Exception
     """
     logger.info(f"User asked: '{user_input}' using model {model_choice}")
-    start_time = time.time()
 
     try:
-        if model_choice == "openai/gpt-4o-mini":
-            answer = ambiguity_resolver_rag.rag_results(vague=user_input)
-        else:
-            answer = phi3_rag.rag_results(vague=user_input)
-
-        judge_llm = JudgeLLM()
-        judge_llm_input: JudgeLLMPromptInput = {
-            "vague": user_input,
-            "translation": answer,
-        }
-        llm_judgement_score: LLMJudgementScore = judge_llm.judget_it(judge_llm_input)
+        pipeline = get_pipeline(model_choice)
+        with st.spinner("Processing..."):
+            streamed_answer = pipeline.rag_results_stream(vague=user_input)
+        st.write_stream(streamed_answer)
+        if pipeline.answer_cache is not None:
+            logger.info(f"Answer cache: {pipeline.answer_cache.stats()}")
 
-        end_time = time.time()
-        response_time = round(end_time - start_time, 2)
-        logger.info(f"Answer received in {response_time} seconds")
+        response_time = _round(streamed_answer.response_time)
+        logger.info(
+            f"Answer received in {response_time} seconds, first token after "
+            f"{_round(streamed_answer.time_to_first_token)} seconds, "
+            f"{_round(streamed_answer.tokens_per_second)} tokens/s"
+        )
 
         return {
-            "answer": answer,
-            "llm_judgement_score": llm_judgement_score,
+            "answer": streamed_answer.text,
             "response_time": response_time,
+            "time_to_first_token": _round(streamed_answer.time_to_first_token),
+            "tokens_per_second": _round(streamed_answer.tokens_per_second),
+            "answer_cached": streamed_answer.cached,
             "error": None,
         }
     except RequestException as e:
@@ -152,13 +185,15 @@ def main():
     """
     setup_logging()
     logger.info("Starting the vague interpreter")
+    start_warmup()
+    start_background_judging()
 
     st.title("Vague Interpreter")
     init_session_state()
 
     model_choice = st.selectbox(
         "Select a model:",
-        ["openai/gpt-4o-mini", "ollama/phi3"],
+        list(PIPELINES),
     )
     logger.info(f"User selected model: {model_choice}")
 
@@ -170,26 +205,28 @@ def main():
             f"New conversation started with ID: {st.session_state.conversation_id}"
         )
 
-        with st.spinner("Processing..."):
-            result = process_user_input(user_input, model_choice)
-
-            if result.get("error"):
-                st.error(result["error"])
-                logger.error(f"Error occurred: {result['error']}")
-            else:
-                st.success("Completed!")
-                st.write(result["answer"])
-
-                save_conversation(
-                    conversation_id=st.session_state.conversation_id,
-                    question=user_input,
-                    answer=result["answer"],
-                    model_used=model_choice,
-                    llm_judgement_score=result["llm_judgement_score"],
-                    response_time=result["response_time"],
-                    timestamp=None,
-                )
-                logger.info("Conversation has been saved successfully.")
+        result = process_user_input(user_input, model_choice)
+
+        if result.get("error"):
+            st.error(result["error"])
+            logger.error(f"Error occurred: {result['error']}")
+        else:
+            st.success("Completed!")
+
+            save_conversation(
+                conversation_id=st.session_state.conversation_id,
+                question=user_input,
+                answer=result["answer"],
+                model_used=model_choice,
+                # queued for the judge worker
+                llm_judgement_score=None,
+                response_time=result["response_time"],
+                timestamp=None,
+                time_to_first_token=result["time_to_first_token"],
+                tokens_per_second=result["tokens_per_second"],
+                answer_cached=result["answer_cached"],
+            )
+            logger.info("Conversation has been saved successfully.")
 
     # Feedback buttons
     col1, col2 = st.columns(2)
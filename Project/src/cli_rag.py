@@ -35,8 +35,15 @@ def main(elastic_url):
             continue
 
         try:
-            result = rag.rag_results(vague_question)
-            click.echo(f'Clear statement: {result}')
+            click.echo('Clear statement: ', nl=False)
+            streamed_answer = rag.rag_results_stream(vague_question)
+            for chunk in streamed_answer:
+                click.echo(chunk, nl=False)
+            click.echo()
+            click.echo(
+                f'(first token after {streamed_answer.time_to_first_token or 0:.2f}s, '
+                f'{streamed_answer.tokens_per_second or 0:.1f} tokens/s)'
+            )
         except Exception as e:
             click.echo(f"An error occurred: {str(e)}")
 
@@ -1,75 +1,420 @@
+"""
+Synthetic load for the application database, the standard fixture of the database
+performance tests.
+
+* ``backfill`` generates conversations (and feedback for a part of them) spread over
+  the last days and loads them in chunks via ``COPY``. The rollup triggers are
+  disabled during the load and the rollups are rebuilt once at the end.
+* ``live`` inserts conversations at a constant rate, either through the write path of
+  the application (``save_conversation``/``save_feedback``) or as multi-row inserts.
+  All conversations come with a synthetic judgement unless ``--queue_judge_jobs`` is
+  given, which queues judge jobs (real LLM calls of the judge worker) for the
+  unjudged part.
+
+The distributions are loosely modelled on the application: most traffic goes to
+gpt-4o-mini, phi3 on CPU is slower, judge scores are correlated per conversation and
+the feedback follows the overall score.
+
+Usage (from src/):
+
+    python create_artificial_data.py backfill --rows 10000000 --days 90
+    python create_artificial_data.py live --rate 200 --duration 600
+"""
+import csv
 import datetime
-import random
+import io
+import time
+import uuid
+from typing import Dict
 
+import click
+import numpy as np
 from dotenv import load_dotenv
-from faker import Faker
-from sqlalchemy.orm import sessionmaker
+from loguru import logger
+from sqlalchemy import insert
 
 from database_operations.base_db_operations import get_db_engine
+from database_operations.db import save_conversation
+from database_operations.db import save_feedback
+from database_operations.rollups import backfill_rollups
 from database_operations.table_definitions import Base
 from database_operations.table_definitions import Conversation
 from database_operations.table_definitions import Feedback
+from judge_llm import LLMJudgementScore
 
 
 load_dotenv('../.env')
 
-def generate_data(n_minutes):
-    # Create a SQLite database in memory
+# share of the traffic, median response time (s), median time to first token (s),
+# mean tokens per second
+MODELS = {
+    "openai/gpt-4o-mini": (0.7, 1.8, 0.45, 60.0),
+    "ollama/phi3": (0.3, 7.0, 1.6, 12.0),
+}
+VAGUE_TEMPLATES = [
+    "Let's circle back on {}.",
+    "We need to move the needle on {}.",
+    "Can we take {} offline?",
+    "Let's double-click on {}.",
+    "I want more visibility into {}.",
+    "We should leverage synergies around {}.",
+    "Let's park {} for now.",
+    "Make {} a priority, but not urgent.",
+]
+TOPICS = [
+    "the migration",
+    "the Q3 roadmap",
+    "the on-call rotation",
+    "the flaky tests",
+    "the customer escalation",
+    "the cloud costs",
+    "the hiring plan",
+    "the release",
+]
+ANSWER_TEMPLATES = [
+    "Schedule a follow-up meeting about {} this week.",
+    "Improve the key metrics of {} measurably this quarter.",
+    "Discuss {} in a separate meeting with fewer people.",
+    "Analyze {} in detail and report the findings.",
+    "Share regular status updates about {}.",
+]
+CONVERSATION_COLUMNS = [
+    "id",
+    "question",
+    "answer",
+    "model_used",
+    "response_time",
+    "time_to_first_token",
+    "tokens_per_second",
+    "clarity",
+    "relevance",
+    "accuracy",
+    "completeness",
+    "overall_score",
+    "explanation",
+    "improvement_suggestions",
+    "timestamp",
+]
+FEEDBACK_COLUMNS = ["conversation_id", "feedback", "timestamp"]
+
+
+def synthetic_conversations(
+    rng: np.random.Generator,
+    n: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    judged_fraction: float = 0.95,
+) -> Dict[str, np.ndarray]:
+    """Column arrays of ``n`` conversations with sorted timestamps in [start, end)."""
+    names = list(MODELS)
+    share, median_rt, median_ttft, mean_tps = (
+        np.array(values) for values in zip(*MODELS.values())
+    )
+    model = rng.choice(len(names), size=n, p=share / share.sum())
+
+    response_time = np.round(rng.lognormal(np.log(median_rt[model]), 0.5), 2)
+    ttft = np.round(rng.lognormal(np.log(median_ttft[model]), 0.4), 3)
+    ttft = np.minimum(ttft, response_time)
+    tps = np.round(np.maximum(rng.normal(mean_tps[model], mean_tps[model] / 5), 1), 1)
+
+    # one latent quality per conversation, the criteria scatter around it
+    quality = np.clip(rng.normal(3.8 - 0.4 * model, 0.8), 1, 5)
+    scores = {
+        criterion: np.clip(np.rint(quality + rng.normal(0, 0.6, n)), 1, 5).astype(int)
+        for criterion in ["clarity", "relevance", "accuracy", "completeness"]
+    }
+    overall = np.round(
+        np.clip(np.mean(list(scores.values()), axis=0) + rng.normal(0, 0.3, n), 1, 5),
+        2,
+    )
+    judged = rng.random(n) < judged_fraction
+
+    span = (end - start).total_seconds()
+    offsets = np.sort(rng.random(n)) * span
+    timestamps = np.datetime64(start.replace(tzinfo=None), "ms") + (
+        offsets * 1000
+    ).astype("timedelta64[ms]")
+
+    template = rng.integers(len(VAGUE_TEMPLATES), size=n)
+    topic = rng.integers(len(TOPICS), size=n)
+    answer = rng.integers(len(ANSWER_TEMPLATES), size=n)
+    return {
+        "id": np.array(
+            [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(n)]
+        ),
+        "question": np.array(
+            [VAGUE_TEMPLATES[t].format(TOPICS[s]) for t, s in zip(template, topic)]
+        ),
+        "answer": np.array(
+            [ANSWER_TEMPLATES[a].format(TOPICS[s]) for a, s in zip(answer, topic)]
+        ),
+        "model_used": np.array(names)[model],
+        "response_time": response_time,
+        "time_to_first_token": ttft,
+        "tokens_per_second": tps,
+        **{criterion: scores[criterion] for criterion in scores},
+        "overall_score": overall,
+        "judged": judged,
+        "timestamp": timestamps,
+    }
+
+
+def synthetic_feedback(
+    rng: np.random.Generator,
+    conversations: Dict[str, np.ndarray],
+    feedback_fraction: float,
+    end: datetime.datetime,
+) -> Dict[str, np.ndarray]:
+    """
+    Feedback for a random part of the conversations, positive for good scores. The
+    feedback follows its conversation after a random delay, but not after ``end``.
+    """
+    picked = np.flatnonzero(rng.random(len(conversations["id"])) < feedback_fraction)
+    p_positive = (conversations["overall_score"][picked] - 1) / 4
+    delay = rng.exponential(120, size=len(picked)) * 1000
+    return {
+        "conversation_id": conversations["id"][picked],
+        "feedback": np.where(rng.random(len(picked)) < p_positive, 1, -1),
+        "timestamp": np.minimum(
+            conversations["timestamp"][picked] + delay.astype("timedelta64[ms]"),
+            np.datetime64(end.replace(tzinfo=None), "ms"),
+        ),
+    }
+
+
+def _csv(columns: Dict[str, list], names: list) -> io.StringIO:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(zip(*(columns[name] for name in names)))
+    buffer.seek(0)
+    return buffer
+
+
+def _conversation_csv_columns(conversations: Dict[str, np.ndarray]) -> dict:
+    judged = conversations["judged"]
+
+    def judged_only(values):
+        # an empty unquoted CSV field is NULL
+        return np.where(judged, values.astype(str), "")
+
+    return {
+        **{
+            name: conversations[name]
+            for name in [
+                "id",
+                "question",
+                "answer",
+                "model_used",
+                "response_time",
+                "time_to_first_token",
+                "tokens_per_second",
+            ]
+        },
+        **{
+            criterion: judged_only(conversations[criterion])
+            for criterion in ["clarity", "relevance", "accuracy", "completeness"]
+        },
+        "overall_score": judged_only(conversations["overall_score"]),
+        "explanation": np.where(judged, "Synthetic judgement.", ""),
+        "improvement_suggestions": np.where(judged, "None.", ""),
+        "timestamp": _timestamps(conversations["timestamp"]),
+    }
+
+
+def _timestamps(values: np.ndarray) -> np.ndarray:
+    return np.char.add(np.datetime_as_string(values, unit="ms"), "+00:00")
+
+
+def _copy(cursor, table: str, names: list, columns: dict) -> None:
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)",
+        _csv(columns, names),
+    )
+
+
+@click.group()
+def main():
+    """Synthetic data for the application database."""
+
+
+@main.command()
+@click.option("--rows", default=1_000_000, help="Number of conversations")
+@click.option("--days", default=30, help="History length, ending now")
+@click.option("--chunk_size", default=100_000, help="Conversations per COPY")
+@click.option("--feedback_fraction", default=0.1)
+@click.option("--seed", default=42)
+def backfill(rows, days, chunk_size, feedback_fraction, seed):
+    """Bulk loads conversations and feedback via COPY."""
+    rng = np.random.default_rng(seed)
     engine = get_db_engine()
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    fake = Faker()
-
-    # Generate data for n minutes from now
-    end_time = datetime.datetime.now() + datetime.timedelta(minutes=n_minutes)
-    current_time = datetime.datetime.now()
-
-    while current_time < end_time:
-        # Create a conversation
-        conv = Conversation(
-            id=fake.uuid4(),
-            question=fake.sentence(),
-            answer=fake.paragraph(),
-            model_used=random.choice(["GPT-3", "GPT-4", "BERT", "T5"]),
-            response_time=round(random.uniform(0, 5), 2),
-            clarity=random.randint(0, 5),
-            relevance=random.randint(0, 5),
-            accuracy=random.randint(0, 5),
-            completeness=random.randint(0, 5),
-            overall_score=round(random.uniform(0, 5), 2),
-            explanation=fake.paragraph(),
-            improvement_suggestions=fake.paragraph(),
-            timestamp=current_time,
-        )
-        session.add(conv)
-
-        # Create feedback for this conversation
-        feedback = Feedback(
-            conversation_id=conv.id,
-            feedback=random.randint(0, 5),
-            timestamp=current_time + datetime.timedelta(minutes=random.randint(1, 10)),
-        )
-        session.add(feedback)
+    end = datetime.datetime.now(datetime.timezone.utc)
+    start = end - datetime.timedelta(days=days)
+    chunks = max(1, -(-rows // chunk_size))
 
-        # Move time forward
-        current_time += datetime.timedelta(seconds=random.randint(1, 5))
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    feedback_rows = 0
+    started = time.perf_counter()
+    try:
+        # per row rollup updates would dominate the load, they are rebuilt at the end
+        for table in ["conversations", "feedback"]:
+            cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+        connection.commit()
+        for chunk in range(chunks):
+            n = min(chunk_size, rows - chunk * chunk_size)
+            conversations = synthetic_conversations(
+                rng,
+                n,
+                start + (end - start) * chunk / chunks,
+                start + (end - start) * (chunk + 1) / chunks,
+            )
+            feedback = synthetic_feedback(rng, conversations, feedback_fraction, end)
+            feedback["timestamp"] = _timestamps(feedback["timestamp"])
+            _copy(
+                cursor,
+                "conversations",
+                CONVERSATION_COLUMNS,
+                _conversation_csv_columns(conversations),
+            )
+            _copy(cursor, "feedback", FEEDBACK_COLUMNS, feedback)
+            connection.commit()
+            feedback_rows += len(feedback["conversation_id"])
+            done = chunk * chunk_size + n
+            logger.info(
+                f"{done}/{rows} conversations loaded, "
+                f"{done / (time.perf_counter() - started):.0f} rows/s"
+            )
+    finally:
+        connection.rollback()
+        for table in ["conversations", "feedback"]:
+            cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+        connection.commit()
+        connection.close()
 
-    # Commit the session to save the data
-    session.commit()
+    with engine.begin() as connection:
+        backfill_rollups(connection)
+    print(
+        f"Generated {rows} conversations and {feedback_rows} feedback entries in "
+        f"{time.perf_counter() - started:.1f}s."
+    )
 
-    # Query and print some data to verify
-    conversations = session.query(Conversation).all()
-    feedbacks = session.query(Feedback).all()
 
+@main.command()
+@click.option("--rate", default=10.0, help="Conversations per second")
+@click.option("--duration", default=60.0, help="Seconds, 0 runs until interrupted")
+@click.option("--feedback_fraction", default=0.1)
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help="Multi-row inserts per tick instead of the write path of the application",
+)
+@click.option(
+    "--queue_judge_jobs",
+    is_flag=True,
+    help="Queue judge jobs for the unjudged conversations (real LLM calls) instead "
+    "of a synthetic judgement for all, only with the write path of the application",
+)
+@click.option("--ticks_per_second", default=10)
+@click.option("--seed", default=42)
+def live(
+    rate, duration, feedback_fraction, bulk, queue_judge_jobs, ticks_per_second, seed
+):
+    """Inserts conversations at a constant rate."""
+    rng = np.random.default_rng(seed)
+    engine = get_db_engine()
+    tick = 1 / ticks_per_second
+    started = time.perf_counter()
+    inserted = 0
+    reported_at = started
+    try:
+        while not duration or time.perf_counter() - started < duration:
+            # rows due so far, so that slow ticks are caught up without drifting
+            due = int((time.perf_counter() - started + tick) * rate) - inserted
+            if due > 0:
+                now = datetime.datetime.now(datetime.timezone.utc)
+                conversations = synthetic_conversations(rng, due, now, now)
+                feedback = synthetic_feedback(
+                    rng, conversations, feedback_fraction, now
+                )
+                if bulk:
+                    _insert_bulk(engine, conversations, feedback)
+                else:
+                    _insert_via_application(conversations, feedback, queue_judge_jobs)
+                inserted += due
+            if time.perf_counter() - reported_at >= 10:
+                reported_at = time.perf_counter()
+                logger.info(
+                    f"{inserted} conversations inserted, "
+                    f"{inserted / (reported_at - started):.1f}/s (target {rate}/s)"
+                )
+            time.sleep(max(0.0, tick - (time.perf_counter() - started) % tick))
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - started
     print(
-        f"Generated {len(conversations)} conversations and {len(feedbacks)}\
-          feedback entries.")
+        f"Inserted {inserted} conversations in {elapsed:.1f}s, "
+        f"{inserted / elapsed:.1f}/s"
+    )
+
+
+def _rows(columns: Dict[str, np.ndarray], names: list) -> list:
+    return [
+        dict(zip(names, values))
+        for values in zip(*(columns[name].tolist() for name in names))
+    ]
 
-    session.close()
+
+def _insert_bulk(engine, conversations, feedback) -> None:
+    rows = _rows(conversations, CONVERSATION_COLUMNS[:11] + ["overall_score"])
+    for row, judged, timestamp in zip(
+        rows, conversations["judged"], conversations["timestamp"].tolist()
+    ):
+        row["timestamp"] = timestamp.replace(tzinfo=datetime.timezone.utc)
+        if not judged:
+            for criterion in ["clarity", "relevance", "accuracy", "completeness"]:
+                row[criterion] = None
+            row["overall_score"] = None
+    feedback_rows = _rows(feedback, FEEDBACK_COLUMNS)
+    for row in feedback_rows:
+        row["timestamp"] = row["timestamp"].replace(tzinfo=datetime.timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(insert(Conversation), rows)
+        if feedback_rows:
+            connection.execute(insert(Feedback), feedback_rows)
+
+
+def _insert_via_application(conversations, feedback, queue_judge_jobs: bool) -> None:
+    """
+    :param queue_judge_jobs: Save the unjudged conversations without a judgement, so
+        that they are queued for the judge worker.
+    """
+    for i, conversation_id in enumerate(conversations["id"].tolist()):
+        judgement = None
+        if conversations["judged"][i] or not queue_judge_jobs:
+            judgement = LLMJudgementScore(
+                clarity=int(conversations["clarity"][i]),
+                relevance=int(conversations["relevance"][i]),
+                accuracy=int(conversations["accuracy"][i]),
+                completeness=int(conversations["completeness"][i]),
+                overall_score=float(conversations["overall_score"][i]),
+                explanation="Synthetic judgement.",
+                improvement_suggestions="None.",
+            )
+        save_conversation(
+            conversation_id=conversation_id,
+            question=str(conversations["question"][i]),
+            answer=str(conversations["answer"][i]),
+            model_used=str(conversations["model_used"][i]),
+            llm_judgement_score=judgement,
+            response_time=float(conversations["response_time"][i]),
+            time_to_first_token=float(conversations["time_to_first_token"][i]),
+            tokens_per_second=float(conversations["tokens_per_second"][i]),
+        )
+    for conversation_id, value in zip(
+        feedback["conversation_id"].tolist(), feedback["feedback"].tolist()
+    ):
+        save_feedback(conversation_id, value)
 
 
 if __name__ == "__main__":
-    n_minutes = 2  # Generate data for the next 60 minutes
-    generate_data(n_minutes)
+    main()
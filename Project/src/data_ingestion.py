@@ -1,28 +1,103 @@
 import asyncio
 import hashlib
 import json
+import re
+import time
+import uuid
 from abc import ABC
 from abc import abstractmethod
 from pathlib import Path
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Set
 
 from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_scan
+from elasticsearch.helpers import async_streaming_bulk
 from loguru import logger
-from sentence_transformers import SentenceTransformer
 from tqdm.asyncio import tqdm
 
+import model_registry
+
+
+DATA_DIR: Path = Path(__file__).resolve().parents[1] / "data"
+
+def encode_in_length_sorted_batches(
+    model, texts: List[str], batch_size: int = 64, pool=None
+) -> List[List[float]]:
+    """
+    Encodes texts sorted by length, so that every batch is padded to similar lengths,
+    and returns the embeddings in the original order.
+    :param model: SentenceTransformer or CachedEncoder used for encoding.
+    :param texts: Texts to encode.
+    :param batch_size: Encoding batch size.
+    :param pool: Optional multi-process pool of ``model.start_multi_process_pool``,
+        the texts are then encoded by ``model.encode_multi_process``.
+    :return: Embeddings as lists of floats.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    sorted_texts = [texts[i] for i in order]
+    if pool is not None:
+        embeddings = model.encode_multi_process(
+            sorted_texts, pool, batch_size=batch_size
+        )
+    else:
+        embeddings = model.encode(
+            sorted_texts, batch_size=batch_size, show_progress_bar=True
+        )
+
+    result: List[List[float]] = [None] * len(texts)
+    for position, i in enumerate(order):
+        result[i] = embeddings[position].tolist()
+    return result
+
 
 class AbstractElasticsearchIngestion(ABC):
     def __init__(
-        self, es_host: str, index_name: str, model_name: str, dims: int = None
+        self,
+        es_host: str,
+        index_name: str,
+        model_name: str,
+        dims: int = None,
+        chunk_size: int = 500,
+        max_in_flight_chunks: int = 4,
+        max_retries: int = 5,
+        encode_batch_size: int = 64,
+        encode_processes: int = 0,
+        incremental: bool = False,
+        keep_previous_versions: int = 0,
     ):
+        """
+        :param chunk_size: Number of documents per bulk request.
+        :param max_in_flight_chunks: Maximal number of concurrent bulk requests.
+        :param max_retries: Number of retries of documents rejected with 429.
+        :param encode_batch_size: Batch size of the embedding step.
+        :param encode_processes: Number of CPU worker processes for the embedding
+            step, 0 encodes in the current process.
+        :param incremental: If True, ``index_name`` is an alias in front of versioned
+            indices: only new or changed documents are embedded, the result is
+            written into a new version and the alias is swapped atomically.
+        :param keep_previous_versions: Number of superseded versions kept for a
+            rollback, older ones are deleted.
+        """
         self.es_client = AsyncElasticsearch([es_host])
         self.index_name = index_name
+        # index the documents are written to, a new version in the incremental mode
+        self.target_index = index_name
+        self.model_name = model_name
         if model_name is not None:
-            self.model = SentenceTransformer(model_name)
+            self.model = model_registry.get_encoder(model_name)
         self.dims = dims
+        self.chunk_size = chunk_size
+        self.max_in_flight_chunks = max_in_flight_chunks
+        self.max_retries = max_retries
+        self.encode_batch_size = encode_batch_size
+        self.encode_processes = encode_processes
+        self.incremental = incremental
+        self.keep_previous_versions = keep_previous_versions
+        self._existing_hashes: Dict[str, str] = {}
+        self._current_ids: Set[str] = set()
         logger.add("elasticsearch_ingestion.log", rotation="10 MB")
 
     @abstractmethod
@@ -33,55 +108,278 @@ class AbstractElasticsearchIngestion(ABC):
     async def create_index(self) -> None:
         pass
 
+    async def _delete_target_index(self) -> None:
+        """Deletes a leftover target index, never the one the alias points to."""
+        if await self.es_client.indices.exists_alias(
+            name=self.index_name, index=self.target_index
+        ):
+            raise RuntimeError(
+                f"Index {self.target_index} is served by the alias {self.index_name}, "
+                f"refusing to delete it"
+            )
+        await self.es_client.indices.delete(index=self.target_index, ignore=[404])
+
+    def content_hash(self, doc: Dict[str, Any]) -> str:
+        # the encoder is part of the hash, so switching the model re-embeds everything
+        content = json.dumps([doc["vague"], doc["actual"], self.model_name, self.dims])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def read_initial_data(self) -> List[Dict[str, Any]]:
+        """Loads initial_data.json and assigns the md5 id and the content hash."""
+        with open(DATA_DIR / "initial_data.json", "r") as f:
+            data: List[Dict[str, Any]] = json.load(f)
+        for doc in data:
+            concatenated_fields: str = doc["vague"] + doc["actual"]
+            doc["id"] = hashlib.md5(concatenated_fields.encode()).hexdigest()
+            doc["content_hash"] = self.content_hash(doc)
+        return data
+
+    def select_changed(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Documents to embed and index: all of them unless in the incremental mode."""
+        self._current_ids = {doc["id"] for doc in data}
+        if not self.incremental:
+            return data
+        changed = [
+            doc
+            for doc in data
+            if self._existing_hashes.get(doc["id"]) != doc["content_hash"]
+        ]
+        logger.info(f"{len(changed)} of {len(data)} documents are new or changed")
+        return changed
+
+    def encode_texts(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if not self.encode_processes:
+            return encode_in_length_sorted_batches(
+                self.model, texts, batch_size=self.encode_batch_size
+            )
+        logger.info(f"Encoding with {self.encode_processes} CPU processes")
+        pool = self.model.start_multi_process_pool(
+            target_devices=["cpu"] * self.encode_processes
+        )
+        try:
+            return encode_in_length_sorted_batches(
+                self.model, texts, batch_size=self.encode_batch_size, pool=pool
+            )
+        finally:
+            self.model.stop_multi_process_pool(pool)
+
     async def index_document(self, doc: Dict[str, Any]) -> None:
         try:
-            await self.es_client.index(index=self.index_name, id=doc["id"], body=doc)
+            await self.es_client.index(index=self.target_index, id=doc["id"], body=doc)
         except Exception as e:
             logger.error(f"Error indexing document {doc['id']}: {str(e)}")
 
-    async def run(self) -> None:
-        logger.info("Starting Elasticsearch ingestion process")
-
-        data: List[Dict[str, Any]] = await self.load_and_process_data()
-
-        await self.create_index()
+    async def _disable_refresh_and_replicas(self) -> Dict[str, Any]:
+        """Switches the index to bulk load mode, returns the settings to restore."""
+        response = await self.es_client.indices.get_settings(
+            index=self.target_index,
+            name=["index.refresh_interval", "index.number_of_replicas"],
+        )
+        previous = next(iter(response.values()))["settings"]["index"]
+        await self.es_client.indices.put_settings(
+            index=self.target_index,
+            settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+        )
+        return {
+            # None resets a setting that was not set explicitly to its default
+            "refresh_interval": previous.get("refresh_interval"),
+            "number_of_replicas": previous.get("number_of_replicas"),
+        }
 
-        logger.info("Starting document indexing")
-        tasks: List[asyncio.Task] = [
-            asyncio.create_task(self.index_document(doc)) for doc in data
+    async def _restore_settings(self, settings: Dict[str, Any]) -> None:
+        await self.es_client.indices.put_settings(
+            index=self.target_index, settings={"index": settings}
+        )
+        await self.es_client.indices.refresh(index=self.target_index)
+
+    def _bulk_actions(self, docs: List[Dict[str, Any]]):
+        for doc in docs:
+            yield {"_index": self.target_index, "_id": doc["id"], "_source": doc}
+
+    async def _bulk_index(self, docs: List[Dict[str, Any]], progress: tqdm) -> int:
+        failed = 0
+        async for ok, item in async_streaming_bulk(
+            self.es_client,
+            self._bulk_actions(docs),
+            chunk_size=self.chunk_size,
+            max_retries=self.max_retries,
+            initial_backoff=1,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if not ok:
+                failed += 1
+                result = next(iter(item.values()))
+                logger.error(
+                    f"Error indexing document {result.get('_id')}: "
+                    f"{result.get('error')}"
+                )
+            progress.update()
+        return failed
+
+    async def _bulk_load(self, data: List[Dict[str, Any]]) -> None:
+        logger.info(f"Starting indexing of {len(data)} documents")
+        start = time.perf_counter()
+        # every worker streams its share sequentially, so at most
+        # max_in_flight_chunks bulk requests are in flight at the same time
+        n_workers = max(1, min(self.max_in_flight_chunks, len(data)))
+        with tqdm(total=len(data), desc="Indexing Progress") as progress:
+            failed = sum(
+                await asyncio.gather(
+                    *[
+                        self._bulk_index(data[i::n_workers], progress)
+                        for i in range(n_workers)
+                    ]
+                )
+            )
+        elapsed = time.perf_counter() - start
+
+        logger.info(
+            f"Indexing process completed: {len(data) - failed} documents indexed, "
+            f"{failed} failed in {elapsed:.2f}s "
+            f"({(len(data) - failed) / elapsed:.1f} docs/sec)"
+        )
+
+    async def index_documents(self, data: List[Dict[str, Any]]) -> None:
+        previous_settings = await self._disable_refresh_and_replicas()
+        try:
+            await self._bulk_load(data)
+        finally:
+            await self._restore_settings(previous_settings)
+
+    async def _read_existing_hashes(self) -> Dict[str, str]:
+        if not await self.es_client.indices.exists(index=self.index_name):
+            return {}
+        hashes: Dict[str, str] = {}
+        async for hit in async_scan(
+            self.es_client, index=self.index_name, query={"_source": ["content_hash"]}
+        ):
+            hashes[hit["_id"]] = hit["_source"].get("content_hash")
+        logger.info(f"Found {len(hashes)} documents in {self.index_name}")
+        return hashes
+
+    async def _reindex_unchanged(self, removed: List[str]) -> None:
+        # changed documents are copied as well and overwritten by the bulk load
+        response = await self.es_client.reindex(
+            source={
+                "index": self.index_name,
+                "query": {"bool": {"must_not": {"ids": {"values": removed}}}},
+            },
+            dest={"index": self.target_index},
+            wait_for_completion=True,
+        )
+        logger.info(f"Copied {response['created']} documents to {self.target_index}")
+
+    async def _swap_alias(self) -> None:
+        alias = self.index_name
+        actions = [{"add": {"index": self.target_index, "alias": alias}}]
+        if await self.es_client.indices.exists_alias(name=alias):
+            response = await self.es_client.indices.get_alias(name=alias)
+            actions += [
+                {"remove": {"index": index, "alias": alias}} for index in response
+            ]
+        elif await self.es_client.indices.exists(index=alias):
+            # a concrete index of the former non-versioned ingestion has the alias name
+            actions.append({"remove_index": {"index": alias}})
+        await self.es_client.indices.update_aliases(actions=actions)
+        logger.info(f"Alias {alias} points to {self.target_index}")
+
+    async def _delete_superseded_versions(self) -> None:
+        response = await self.es_client.indices.get(index=f"{self.index_name}-v*")
+        version_pattern = re.compile(
+            rf"{re.escape(self.index_name)}-v\d{{14}}(-[0-9a-f]{{8}})?"
+        )
+        # a concurrent run may have pointed the alias to its own version meanwhile
+        served = {self.target_index}
+        if await self.es_client.indices.exists_alias(name=self.index_name):
+            served.update(await self.es_client.indices.get_alias(name=self.index_name))
+
+        def created_at(index: str) -> int:
+            return int(response[index]["settings"]["index"]["creation_date"])
+
+        # oldest first; names of the same second only differ by their random suffix
+        versions = sorted(
+            (
+                index
+                for index in response
+                if version_pattern.fullmatch(index) and index not in served
+            ),
+            key=created_at,
+        )
+        superseded = versions[: max(0, len(versions) - self.keep_previous_versions)]
+        for index in superseded:
+            await self.es_client.indices.delete(index=index)
+            logger.info(f"Deleted superseded index {index}")
+
+    async def _run_incremental(self) -> None:
+        self._existing_hashes = await self._read_existing_hashes()
+        changed: List[Dict[str, Any]] = await self.load_and_process_data()
+        removed = [
+            doc_id
+            for doc_id in self._existing_hashes
+            if doc_id not in self._current_ids
         ]
-        await tqdm.gather(*tasks, desc="Indexing Progress")
+        if not changed and not removed:
+            logger.info(f"Index {self.index_name} is up to date, nothing to ingest")
+            return
+        logger.info(f"{len(changed)} new or changed, {len(removed)} removed documents")
+
+        # the suffix keeps two runs within the same second apart
+        self.target_index = (
+            f"{self.index_name}-v{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        )
+        await self.create_index()
+        previous_settings = await self._disable_refresh_and_replicas()
+        try:
+            if len(changed) < len(self._current_ids):
+                await self._reindex_unchanged(removed)
+            await self._bulk_load(changed)
+        finally:
+            await self._restore_settings(previous_settings)
+        await self._swap_alias()
+        await self._delete_superseded_versions()
 
-        logger.info("Indexing process completed")
-        await self.es_client.close()
+    async def run(self) -> None:
+        logger.info("Starting Elasticsearch ingestion process")
+        try:
+            if self.incremental:
+                await self._run_incremental()
+            else:
+                data: List[Dict[str, Any]] = await self.load_and_process_data()
+                await self.create_index()
+                await self.index_documents(data)
+        finally:
+            await self.es_client.close()
 
 
 class ElasticsearchIngestionForSemanticSearch(AbstractElasticsearchIngestion):
     async def load_and_process_data(self) -> List[Dict[str, Any]]:
         logger.info("Starting to load and process data")
-        data_dir: Path = Path(__file__).resolve().parents[1] / "data"
-        with open(data_dir / "initial_data.json", "r") as f:
-            data: List[Dict[str, Any]] = json.load(f)
-        data_w_id: List[Dict[str, Any]] = []
-        for doc in tqdm(data, desc="Processing documents"):
-            doc["vague_embedding"] = self.model.encode(doc["vague"]).tolist()
-            concatenated_fields: str = doc["vague"] + doc["actual"]
-            doc["id"] = hashlib.md5(concatenated_fields.encode()).hexdigest()
-            data_w_id.append(doc)
+        data: List[Dict[str, Any]] = self.read_initial_data()
+        changed: List[Dict[str, Any]] = self.select_changed(data)
+        embeddings = self.encode_texts([doc["vague"] for doc in changed])
+        for doc, embedding in tqdm(
+            zip(changed, embeddings), total=len(changed), desc="Processing documents"
+        ):
+            doc["vague_embedding"] = embedding
 
-        with open(data_dir / "initial_data_w_id.json", "w") as f:
-            json.dump(data_w_id, f)
+        with open(DATA_DIR / "initial_data_w_id.json", "w") as f:
+            json.dump(data, f)
 
-        logger.info(f"Processed {len(data)} documents")
-        return data_w_id
+        logger.info(f"Processed {len(changed)} documents")
+        logger.info(f"Embedding cache: {self.model.cache.stats()}")
+        return changed
 
     async def create_index(self) -> None:
-        logger.info(f"Creating index: {self.index_name}")
+        logger.info(f"Creating index: {self.target_index}")
         index_settings: Dict[str, Any] = {
             "settings": {"number_of_shards": 1, "number_of_replicas": 0},
             "mappings": {
                 "properties": {
                     "id": {"type": "keyword"},
+                    "content_hash": {"type": "keyword"},
                     "vague": {"type": "text"},
                     "actual": {"type": "text"},
                     "vague_embedding": {
@@ -94,46 +392,43 @@ class ElasticsearchIngestionForSemanticSearch(AbstractElasticsearchIngestion):
             },
         }
 
-        await self.es_client.indices.delete(index=self.index_name, ignore=[404])
-        await self.es_client.indices.create(index=self.index_name, body=index_settings)
-        logger.info(f"Index {self.index_name} created successfully")
+        await self._delete_target_index()
+        await self.es_client.indices.create(
+            index=self.target_index, body=index_settings
+        )
+        logger.info(f"Index {self.target_index} created successfully")
 
 
 class ElasticSearchIngestionForKeywordSearch(AbstractElasticsearchIngestion):
     async def load_and_process_data(self) -> List[Dict[str, Any]]:
         logger.info("Starting to load and process data")
-        data_dir: Path = Path(__file__).resolve().parents[1] / "data"
-
-        with open(data_dir / "initial_data.json", "r") as f:
-            data: List[Dict[str, Any]] = json.load(f)
-
-        data_w_id: List[Dict[str, Any]] = []
-        for doc in tqdm(data, desc="Processing documents"):
-            concatenated_fields: str = doc["vague"] + doc["actual"]
-            doc["id"] = hashlib.md5(concatenated_fields.encode()).hexdigest()
-            data_w_id.append(doc)
+        data: List[Dict[str, Any]] = self.read_initial_data()
+        changed: List[Dict[str, Any]] = self.select_changed(data)
 
-        with open(data_dir / "initial_data_w_id_keyword.json", "w") as f:
-            json.dump(data_w_id, f)
+        with open(DATA_DIR / "initial_data_w_id_keyword.json", "w") as f:
+            json.dump(data, f)
 
-        logger.info(f"Processed {len(data)} documents")
-        return data_w_id
+        logger.info(f"Processed {len(changed)} documents")
+        return changed
 
     async def create_index(self) -> None:
-        logger.info(f"Creating index: {self.index_name}")
+        logger.info(f"Creating index: {self.target_index}")
         index_settings: Dict[str, Any] = {
             "settings": {"number_of_shards": 1, "number_of_replicas": 0},
             "mappings": {
                 "properties": {
+                    "content_hash": {"type": "keyword"},
                     "vague": {"type": "text"},
                     "actual": {"type": "text"},
                 }
             },
         }
 
-        await self.es_client.indices.delete(index=self.index_name, ignore=[404])
-        await self.es_client.indices.create(index=self.index_name, body=index_settings)
-        logger.info(f"Index {self.index_name} created successfully")
+        await self._delete_target_index()
+        await self.es_client.indices.create(
+            index=self.target_index, body=index_settings
+        )
+        logger.info(f"Index {self.target_index} created successfully")
 
 
 async def main_semantic_search(
@@ -141,9 +436,14 @@ async def main_semantic_search(
     index_name="vague-actual",
     dims=384,
     es_host="http://localhost:9200",
+    **ingestion_kwargs,
 ):
     ingestion = ElasticsearchIngestionForSemanticSearch(
-        es_host=es_host, index_name=index_name, model_name=model_name, dims=dims
+        es_host=es_host,
+        index_name=index_name,
+        model_name=model_name,
+        dims=dims,
+        **ingestion_kwargs,
     )
     await ingestion.run()
 
@@ -158,38 +458,37 @@ async def main_keyword_search():
 
 
 class ElasticsearchIngestionForHybridSearch(AbstractElasticsearchIngestion):
-    def __init__(self, es_host: str, index_name: str, model_name: str, dims: int):
-        super().__init__(es_host, index_name, model_name, dims)
+    def __init__(
+        self, es_host: str, index_name: str, model_name: str, dims: int, **kwargs
+    ):
+        super().__init__(es_host, index_name, model_name, dims, **kwargs)
 
     async def load_and_process_data(self) -> List[Dict[str, Any]]:
         logger.info("Starting to load and process data for hybrid search")
-        data_dir: Path = Path(__file__).resolve().parents[1] / "data"
-
-        with open(data_dir / "initial_data.json", "r") as f:
-            data: List[Dict[str, Any]] = json.load(f)
-
-        data_w_id: List[Dict[str, Any]] = []
-        for doc in tqdm(data, desc="Processing documents for hybrid search"):
-            # Generate embedding for semantic search
-            doc["vague_embedding"] = self.model.encode(doc["vague"]).tolist()
+        data: List[Dict[str, Any]] = self.read_initial_data()
+        changed: List[Dict[str, Any]] = self.select_changed(data)
+
+        # Generate embeddings for semantic search
+        embeddings = self.encode_texts([doc["vague"] for doc in changed])
+        for doc, embedding in tqdm(
+            zip(changed, embeddings),
+            total=len(changed),
+            desc="Processing documents for hybrid search",
+        ):
+            doc["vague_embedding"] = embedding
 
             # Create a combined field for better keyword matching
             doc["combined_text"] = f"{doc['vague']} {doc['actual']}"
 
-            # Generate a unique ID
-            concatenated_fields: str = doc["vague"] + doc["actual"]
-            doc["id"] = hashlib.md5(concatenated_fields.encode()).hexdigest()
-
-            data_w_id.append(doc)
-
-        with open(data_dir / "initial_data_w_id_hybrid.json", "w") as f:
-            json.dump(data_w_id, f)
+        with open(DATA_DIR / "initial_data_w_id_hybrid.json", "w") as f:
+            json.dump(data, f)
 
-        logger.info(f"Processed {len(data)} documents for hybrid search")
-        return data_w_id
+        logger.info(f"Processed {len(changed)} documents for hybrid search")
+        logger.info(f"Embedding cache: {self.model.cache.stats()}")
+        return changed
 
     async def create_index(self) -> None:
-        logger.info(f"Creating hybrid search index: {self.index_name}")
+        logger.info(f"Creating hybrid search index: {self.target_index}")
         index_settings: Dict[str, Any] = {
             "settings": {
                 "number_of_shards": 1,
@@ -207,6 +506,7 @@ class ElasticsearchIngestionForHybridSearch(AbstractElasticsearchIngestion):
             "mappings": {
                 "properties": {
                     "id": {"type": "keyword"},
+                    "content_hash": {"type": "keyword"},
                     "vague": {
                         "type": "text",
                         "analyzer": "custom_analyzer",
@@ -228,9 +528,11 @@ class ElasticsearchIngestionForHybridSearch(AbstractElasticsearchIngestion):
             },
         }
 
-        await self.es_client.indices.delete(index=self.index_name, ignore=[404])
-        await self.es_client.indices.create(index=self.index_name, body=index_settings)
-        logger.info(f"Hybrid search index {self.index_name} created successfully")
+        await self._delete_target_index()
+        await self.es_client.indices.create(
+            index=self.target_index, body=index_settings
+        )
+        logger.info(f"Hybrid search index {self.target_index} created successfully")
 
 
 async def main_hybrid_search(
@@ -238,9 +540,14 @@ async def main_hybrid_search(
     index_name="vague-actual-hybrid",
     dims=768,
     es_host="http://localhost:9200",
+    **ingestion_kwargs,
 ):
     ingestion = ElasticsearchIngestionForHybridSearch(
-        es_host=es_host, index_name=index_name, model_name=model_name, dims=dims
+        es_host=es_host,
+        index_name=index_name,
+        model_name=model_name,
+        dims=dims,
+        **ingestion_kwargs,
     )
     await ingestion.run()
 
@@ -248,6 +555,7 @@ async def main_hybrid_search(
 if __name__ == "__main__":
      asyncio.run(main_semantic_search(model_name='all-mpnet-base-v2',
                                      index_name='vague-actual-mpnet',
-                                     dims=768))
+                                     dims=768,
+                                     incremental=True))
     # asyncio.run(main_key_work_search())
     #asyncio.run(main_hybrid_search())
@@ -1,12 +1,24 @@
 import os
+import threading
+from typing import Optional
 
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import sessionmaker
 
+from .rollups import install_rollup_triggers
 from .table_definitions import Base
 
 
+_engine: Optional[Engine] = None
+_engine_pid: Optional[int] = None
+_session_factory: Optional[scoped_session] = None
+_engine_lock = threading.Lock()
+
+
 def create_user_and_db():
     if os.path.exists("../.env"):
         POSTGRES_HOST = os.getenv("POSTGRES_HOST_LOCAL")
@@ -51,7 +63,12 @@ def create_user_and_db():
     conn.close()
 
 
-def get_db_engine():
+def create_db_engine() -> Engine:
+    """
+    Creates a new engine with its own connection pool, configured by
+    POSTGRES_POOL_SIZE, POSTGRES_MAX_OVERFLOW and POSTGRES_POOL_RECYCLE (seconds).
+    Connections are checked with a ping before they are handed out.
+    """
     if os.path.exists("../.env"):
         POSTGRES_HOST = os.getenv("POSTGRES_HOST_LOCAL")
     else:
@@ -60,11 +77,48 @@ def get_db_engine():
         f"postgresql://{os.getenv('POSTGRES_USER', 'your_username')}:"
         f"{os.getenv('POSTGRES_PASSWORD', 'your_password')}@"
         f"{POSTGRES_HOST}/"
-        f"{os.getenv('POSTGRES_DB', 'vague_translator')}"
+        f"{os.getenv('POSTGRES_DB', 'vague_translator')}",
+        pool_size=int(os.getenv("POSTGRES_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("POSTGRES_MAX_OVERFLOW", 10)),
+        pool_recycle=int(os.getenv("POSTGRES_POOL_RECYCLE", 1800)),
+        pool_pre_ping=True,
     )
 
 
+def get_db_engine() -> Engine:
+    """Process-wide engine, created on first use."""
+    global _engine, _engine_pid, _session_factory
+    with _engine_lock:
+        if _engine is not None and _engine_pid != os.getpid():
+            # pooled connections must not be shared with a forked child
+            _engine.dispose(close=False)
+            _engine = None
+            _session_factory = None
+        if _engine is None:
+            _engine = create_db_engine()
+            _engine_pid = os.getpid()
+        return _engine
+
+
+def get_session_factory() -> scoped_session:
+    """Thread-local sessions bound to the process-wide engine."""
+    global _session_factory
+    engine = get_db_engine()
+    with _engine_lock:
+        if _session_factory is None:
+            _session_factory = scoped_session(sessionmaker(bind=engine))
+        return _session_factory
+
+
 def init_db():
     engine = get_db_engine()
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    # imported here, migrations uses get_db_engine of this module
+    from .migrations import partition_conversations_by_month
+
+    with engine.begin() as connection:
+        if os.getenv("POSTGRES_PARTITION_CONVERSATIONS", "false").lower() == "true":
+            partition_conversations_by_month(connection)
+        else:
+            install_rollup_triggers(connection)
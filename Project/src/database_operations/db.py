@@ -1,21 +1,33 @@
+import os
+import threading
+import time
 from datetime import datetime
+from datetime import timedelta
+from typing import Dict
+from typing import List
+from typing import Optional
 from zoneinfo import ZoneInfo
 
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func
 
 from judge_llm import LLMJudgementScore
 
-from .base_db_operations import get_db_engine
+from .base_db_operations import get_session_factory
 from .table_definitions import Conversation
 from .table_definitions import Feedback
+from .table_definitions import JudgeJob
+from .write_behind import get_write_behind_buffer
 
 
 tz = ZoneInfo("Europe/Berlin")
 
+FEEDBACK_STATS_TTL = float(os.getenv("FEEDBACK_STATS_TTL", 30))
+_feedback_stats: Optional[Dict[str, int]] = None
+_feedback_stats_expires_at = 0.0
+_feedback_stats_lock = threading.Lock()
+
 def get_db_session():
-    engine = get_db_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return get_session_factory()()
 
 
 def save_conversation(
@@ -23,58 +35,245 @@ def save_conversation(
     question: str,
     answer: str,
     model_used: str,
-    llm_judgement_score: LLMJudgementScore,
+    llm_judgement_score: Optional[LLMJudgementScore],
     response_time: float,
     timestamp=None,
+    time_to_first_token: Optional[float] = None,
+    tokens_per_second: Optional[float] = None,
+    answer_cached: Optional[bool] = None,
 ):
+    """
+    Saves a conversation. Without a judgement score the conversation is queued for
+    the judge worker in the same transaction, which fills in the scores later.
+    ``time_to_first_token`` and ``tokens_per_second`` are known for streamed answers,
+    ``answer_cached`` tells whether the answer came from the answer cache.
+    In the write-behind mode (DB_WRITE_BEHIND=true) the rows are only buffered.
+    """
     if timestamp is None:
         timestamp = datetime.now(tz)
 
+    conversation = {
+        "id": conversation_id,
+        "question": question,
+        "answer": answer,
+        "model_used": model_used,
+        "response_time": response_time,
+        "time_to_first_token": time_to_first_token,
+        "tokens_per_second": tokens_per_second,
+        "answer_cached": answer_cached,
+        "timestamp": timestamp,
+        **_judgement_values(llm_judgement_score),
+    }
+    rows = [(Conversation, conversation)]
+    if llm_judgement_score is None:
+        rows.append(
+            (
+                JudgeJob,
+                {
+                    "conversation_id": conversation_id,
+                    "status": JudgeJob.PENDING,
+                    "attempts": 0,
+                    "enqueued_at": timestamp,
+                    "updated_at": timestamp,
+                },
+            )
+        )
+
+    buffer = get_write_behind_buffer()
+    if buffer is not None:
+        buffer.submit(rows)
+        return
+
     session = get_db_session()
     try:
-        conversation = Conversation(
-            id=conversation_id,
-            question=question,
-            answer=answer,
-            model_used=model_used,
-            response_time=response_time,
-            clarity=llm_judgement_score.clarity,
-            relevance=llm_judgement_score.relevance,
-            accuracy=llm_judgement_score.accuracy,
-            completeness=llm_judgement_score.completeness,
-            overall_score=llm_judgement_score.overall_score,
-            explanation=llm_judgement_score.explanation,
-            improvement_suggestions=llm_judgement_score.improvement_suggestions,
-            timestamp=timestamp,
+        for model, values in rows:
+            session.add(model(**values))
+            # flush in order, the job references the conversation
+            session.flush()
+        session.commit()
+    finally:
+        session.close()
+
+
+def _judgement_values(llm_judgement_score: Optional[LLMJudgementScore]) -> dict:
+    if llm_judgement_score is None:
+        return dict.fromkeys(
+            [
+                "clarity",
+                "relevance",
+                "accuracy",
+                "completeness",
+                "overall_score",
+                "explanation",
+                "improvement_suggestions",
+            ]
         )
-        session.add(conversation)
+    return {
+        "clarity": llm_judgement_score.clarity,
+        "relevance": llm_judgement_score.relevance,
+        "accuracy": llm_judgement_score.accuracy,
+        "completeness": llm_judgement_score.completeness,
+        "overall_score": llm_judgement_score.overall_score,
+        "explanation": llm_judgement_score.explanation,
+        "improvement_suggestions": llm_judgement_score.improvement_suggestions,
+    }
+
+
+def _apply_judgement(
+    conversation: Conversation, llm_judgement_score: LLMJudgementScore
+) -> None:
+    for column, value in _judgement_values(llm_judgement_score).items():
+        setattr(conversation, column, value)
+
+
+def claim_judge_jobs(limit: int) -> List[dict]:
+    """
+    Marks up to ``limit`` pending jobs as running and returns them with the question
+    and answer to judge. Concurrent workers never claim the same job.
+    """
+    session = get_db_session()
+    try:
+        jobs = (
+            session.query(JudgeJob)
+            .filter(JudgeJob.status == JudgeJob.PENDING)
+            .order_by(JudgeJob.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        now = datetime.now(tz)
+        claimed = []
+        for job in jobs:
+            job.status = JudgeJob.RUNNING
+            job.attempts += 1
+            job.updated_at = now
+            conversation = session.get(Conversation, job.conversation_id)
+            claimed.append(
+                {
+                    "job_id": job.id,
+                    "attempts": job.attempts,
+                    "vague": conversation.question,
+                    "translation": conversation.answer,
+                }
+            )
         session.commit()
+        return claimed
     finally:
         session.close()
 
 
-def save_feedback(conversation_id, feedback_value, timestamp=None):
-    if timestamp is None:
-        timestamp = datetime.now(tz)
+def complete_judge_job(job_id: int, llm_judgement_score: LLMJudgementScore) -> None:
+    session = get_db_session()
+    try:
+        job = session.get(JudgeJob, job_id)
+        _apply_judgement(
+            session.get(Conversation, job.conversation_id), llm_judgement_score
+        )
+        job.status = JudgeJob.DONE
+        job.error = None
+        job.updated_at = datetime.now(tz)
+        session.commit()
+    finally:
+        session.close()
 
+
+def fail_judge_job(job_id: int, error: str, retry: bool) -> None:
     session = get_db_session()
     try:
-        feedback = Feedback(
-            conversation_id=conversation_id,
-            feedback=feedback_value,
-            timestamp=timestamp,
+        job = session.get(JudgeJob, job_id)
+        job.status = JudgeJob.PENDING if retry else JudgeJob.FAILED
+        job.error = error
+        job.updated_at = datetime.now(tz)
+        session.commit()
+    finally:
+        session.close()
+
+
+def requeue_stale_judge_jobs(older_than: timedelta) -> int:
+    """Puts jobs of a crashed worker (running for too long) back into the queue."""
+    session = get_db_session()
+    try:
+        requeued = (
+            session.query(JudgeJob)
+            .filter(
+                JudgeJob.status == JudgeJob.RUNNING,
+                JudgeJob.updated_at < datetime.now(tz) - older_than,
+            )
+            .update({JudgeJob.status: JudgeJob.PENDING}, synchronize_session=False)
         )
-        session.add(feedback)
         session.commit()
+        return requeued
     finally:
         session.close()
 
 
+def get_judge_queue_depth() -> int:
+    session = get_db_session()
+    try:
+        return (
+            session.query(JudgeJob)
+            .filter(JudgeJob.status.in_([JudgeJob.PENDING, JudgeJob.RUNNING]))
+            .count()
+        )
+    finally:
+        session.close()
+
+
+def save_feedback(conversation_id, feedback_value, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now(tz)
+
+    feedback = {
+        "conversation_id": conversation_id,
+        "feedback": feedback_value,
+        "timestamp": timestamp,
+    }
+    buffer = get_write_behind_buffer()
+    if buffer is not None:
+        buffer.submit([(Feedback, feedback)])
+    else:
+        session = get_db_session()
+        try:
+            session.add(Feedback(**feedback))
+            session.commit()
+        finally:
+            session.close()
+    _count_feedback(feedback_value)
+
+
+def _count_feedback(feedback_value) -> None:
+    # keeps the memoized stats of this process up to date without a recount
+    with _feedback_stats_lock:
+        if _feedback_stats is None:
+            return
+        if feedback_value > 0:
+            _feedback_stats["thumbs_up"] += 1
+        elif feedback_value < 0:
+            _feedback_stats["thumbs_down"] += 1
+
+
 def get_feedback_stats():
+    """
+    Thumbs up/down counts. They are counted in one query and memoized for
+    FEEDBACK_STATS_TTL seconds (feedback of other processes shows up after that),
+    ``save_feedback`` updates the memoized counts.
+    """
+    global _feedback_stats, _feedback_stats_expires_at
+    with _feedback_stats_lock:
+        fresh = time.monotonic() < _feedback_stats_expires_at
+        if _feedback_stats is not None and fresh:
+            return dict(_feedback_stats)
+
     session = get_db_session()
     try:
-        thumbs_up = session.query(Feedback).filter(Feedback.feedback > 0).count()
-        thumbs_down = session.query(Feedback).filter(Feedback.feedback < 0).count()
-        return {"thumbs_up": thumbs_up, "thumbs_down": thumbs_down}
+        thumbs_up, thumbs_down = session.query(
+            func.count().filter(Feedback.feedback > 0),
+            func.count().filter(Feedback.feedback < 0),
+        ).one()
     finally:
         session.close()
+
+    with _feedback_stats_lock:
+        _feedback_stats = {"thumbs_up": thumbs_up, "thumbs_down": thumbs_down}
+        _feedback_stats_expires_at = time.monotonic() + FEEDBACK_STATS_TTL
+        return dict(_feedback_stats)
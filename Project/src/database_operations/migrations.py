@@ -0,0 +1,314 @@
+"""
+Schema migrations that ``init_db`` does not cover for an existing database.
+
+* ``add_missing_columns`` adds the columns added to ``table_definitions`` since a
+  table was created (``create_all`` does not alter existing tables).
+* ``create_missing_indexes`` creates the indexes defined in ``table_definitions``.
+* ``add_rollup_shards_to_keys`` adds the ``shard`` column to the primary keys of
+  rollups created before the rollups were sharded.
+* ``partition_conversations_by_month`` turns ``conversations`` into a table that is
+  range partitioned by ``timestamp``, one partition per month plus a default one,
+  keeping the existing rows. Foreign keys referencing a partitioned table have to
+  include the partition key, so the foreign keys of ``feedback`` and ``judge_jobs``
+  on ``conversations.id`` are dropped (their indexes stay).
+* ``ensure_conversation_partitions`` creates the partitions of the upcoming months,
+  moving rows that went to the default partition in the meantime. The judge worker
+  runs it on start and daily (``ensure_upcoming_partitions``).
+* the dashboard rollups (see ``rollups``) are created, their triggers installed and,
+  on request, rebuilt from the history.
+
+Tables are referenced without a schema, i.e. via the ``search_path``.
+
+Usage (from src/):
+
+    python -m database_operations.migrations --partition --backfill_rollups
+"""
+import os
+from datetime import date
+from datetime import datetime
+from typing import Optional
+
+import click
+from dotenv import load_dotenv
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex
+
+from .base_db_operations import get_db_engine
+from .rollups import backfill_rollups
+from .rollups import install_rollup_triggers
+from .table_definitions import Base
+from .table_definitions import ConversationHistogram
+from .table_definitions import ConversationRollup
+
+
+# columns added since the tables of ``init_db``: (table, column, SQL type)
+ADDED_COLUMNS = [
+    ("conversations", "time_to_first_token", "double precision"),
+    ("conversations", "tokens_per_second", "double precision"),
+    ("conversations", "answer_cached", "boolean"),
+    ("conversation_rollups", "cached_count", "integer NOT NULL DEFAULT 0"),
+    ("conversation_rollups", "shard", "smallint NOT NULL DEFAULT 0"),
+    ("conversation_histograms", "shard", "smallint NOT NULL DEFAULT 0"),
+]
+
+
+def add_missing_columns(connection: Connection) -> None:
+    for table_name, column_name, column_type in ADDED_COLUMNS:
+        connection.execute(
+            text(
+                f"ALTER TABLE {table_name} "
+                f"ADD COLUMN IF NOT EXISTS {column_name} {column_type}"
+            )
+        )
+
+
+def create_missing_indexes(connection: Connection) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def add_rollup_shards_to_keys(connection: Connection) -> None:
+    """
+    The existing rows stay in shard 0, the readers sum over the shards. Runs after
+    ``add_missing_columns``.
+    """
+    for table in [ConversationRollup.__table__, ConversationHistogram.__table__]:
+        key_columns = (
+            connection.execute(
+                text(
+                    "SELECT a.attname FROM pg_index i "
+                    "JOIN pg_attribute a "
+                    "ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                    "WHERE i.indrelid = CAST(:table_name AS regclass) "
+                    "AND i.indisprimary"
+                ),
+                {"table_name": table.name},
+            )
+            .scalars()
+            .all()
+        )
+        if "shard" in key_columns:
+            continue
+        primary_key = ", ".join(column.name for column in table.primary_key)
+        connection.execute(
+            text(
+                f"ALTER TABLE {table.name} DROP CONSTRAINT {table.name}_pkey, "
+                f"ADD PRIMARY KEY ({primary_key})"
+            )
+        )
+        logger.info(f"Added shard to the primary key of {table.name}")
+
+
+def is_partitioned(connection: Connection, table_name: str = "conversations") -> bool:
+    return (
+        connection.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = :table_name "
+                "AND pg_table_is_visible(c.oid)"
+            ),
+            {"table_name": table_name},
+        ).first()
+        is not None
+    )
+
+
+def _add_months(month: date, months: int) -> date:
+    month_index = month.year * 12 + month.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _table_exists(connection: Connection, table_name: str) -> bool:
+    return connection.execute(
+        text("SELECT to_regclass(:table_name) IS NOT NULL"),
+        {"table_name": table_name},
+    ).scalar()
+
+
+def _create_month_partition(connection: Connection, month: date) -> None:
+    table_name = f"conversations_{month:%Y_%m}"
+    if _table_exists(connection, table_name):
+        return
+    upper = _add_months(month, 1)
+    bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+    in_month = f"timestamp >= '{month:%Y-%m-%d}' AND timestamp < '{upper:%Y-%m-%d}'"
+    default_has_rows = (
+        _table_exists(connection, "conversations_default")
+        and connection.execute(
+            text(f"SELECT 1 FROM conversations_default WHERE {in_month} LIMIT 1")
+        ).first()
+        is not None
+    )
+    if not default_has_rows:
+        connection.execute(
+            text(
+                f"CREATE TABLE {table_name} PARTITION OF conversations "
+                f"FOR VALUES {bounds}"
+            )
+        )
+        return
+
+    # the rows of the month in the default partition would violate its constraint:
+    # they are moved into the new table before it is attached; the rows are copied
+    # into a table that is not a partition yet, so the rollup triggers do not fire
+    connection.execute(
+        text("ALTER TABLE conversations DETACH PARTITION conversations_default")
+    )
+    connection.execute(
+        text(
+            f"CREATE TABLE {table_name} (LIKE conversations "
+            f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    moved = connection.execute(
+        text(
+            f"INSERT INTO {table_name} "
+            f"SELECT * FROM conversations_default WHERE {in_month}"
+        )
+    ).rowcount
+    connection.execute(text(f"DELETE FROM conversations_default WHERE {in_month}"))
+    connection.execute(
+        text(
+            f"ALTER TABLE conversations ATTACH PARTITION {table_name} "
+            f"FOR VALUES {bounds}"
+        )
+    )
+    connection.execute(
+        text(
+            "ALTER TABLE conversations "
+            "ATTACH PARTITION conversations_default DEFAULT"
+        )
+    )
+    logger.info(f"Moved {moved} rows from conversations_default to {table_name}")
+
+
+def ensure_conversation_partitions(
+    connection: Connection, start: Optional[date] = None, months_ahead: int = 3
+) -> None:
+    """
+    Creates the monthly partitions from the month of ``start`` (defaults to the
+    current month) until ``months_ahead`` months after the current one. Rows of a
+    new month that already went to the default partition are moved into it.
+    """
+    # the application and the judge worker may run this at the same time
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext('conversations_partitions'))")
+    )
+    current = datetime.now().date().replace(day=1)
+    month = (start or current).replace(day=1)
+    last = _add_months(current, months_ahead)
+    while month <= last:
+        _create_month_partition(connection, month)
+        month = _add_months(month, 1)
+    connection.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS conversations_default "
+            "PARTITION OF conversations DEFAULT"
+        )
+    )
+
+
+def ensure_upcoming_partitions(months_ahead: int = 3) -> None:
+    """
+    Creates the partitions of the upcoming months if ``conversations`` is
+    partitioned; run on start and daily by the judge worker.
+    """
+    with get_db_engine().begin() as connection:
+        if is_partitioned(connection):
+            ensure_conversation_partitions(connection, months_ahead=months_ahead)
+
+
+def partition_conversations_by_month(
+    connection: Connection, months_ahead: int = 3
+) -> None:
+    """
+    Migrates ``conversations`` to monthly range partitions within the transaction of
+    ``connection``; it is a no-op for an already partitioned table apart from
+    creating upcoming partitions.
+    """
+    if is_partitioned(connection):
+        ensure_conversation_partitions(connection, months_ahead=months_ahead)
+        return
+
+    for table_name in ["feedback", "judge_jobs"]:
+        connection.execute(
+            text(
+                f"ALTER TABLE IF EXISTS {table_name} "
+                f"DROP CONSTRAINT IF EXISTS {table_name}_conversation_id_fkey"
+            )
+        )
+
+    # the old table keeps its data until it is copied, its index names are freed
+    connection.execute(
+        text("ALTER TABLE conversations RENAME TO conversations_unpartitioned")
+    )
+    connection.execute(
+        text(
+            "ALTER TABLE conversations_unpartitioned "
+            "RENAME CONSTRAINT conversations_pkey TO conversations_unpartitioned_pkey"
+        )
+    )
+    indexes = Base.metadata.tables["conversations"].indexes
+    for index in indexes:
+        connection.execute(
+            text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_old")
+        )
+
+    connection.execute(
+        text(
+            "CREATE TABLE conversations (LIKE conversations_unpartitioned "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (timestamp)"
+        )
+    )
+    # a primary key of a partitioned table has to contain the partition key
+    connection.execute(
+        text("ALTER TABLE conversations ADD PRIMARY KEY (id, timestamp)")
+    )
+    for index in indexes:
+        connection.execute(CreateIndex(index))
+
+    first_timestamp = connection.execute(
+        text("SELECT min(timestamp) FROM conversations_unpartitioned")
+    ).scalar()
+    ensure_conversation_partitions(
+        connection,
+        start=first_timestamp.date() if first_timestamp else None,
+        months_ahead=months_ahead,
+    )
+    copied = connection.execute(
+        text("INSERT INTO conversations SELECT * FROM conversations_unpartitioned")
+    ).rowcount
+    connection.execute(text("DROP TABLE conversations_unpartitioned"))
+    # the triggers were dropped with the old table; installed after the copy, the
+    # copied rows are not counted twice
+    install_rollup_triggers(connection)
+    logger.info(f"Partitioned conversations by month, {copied} rows copied")
+
+
+@click.command()
+@click.option("--partition", is_flag=True, help="Partition conversations by month")
+@click.option("--months_ahead", default=3, help="Partitions created in advance")
+@click.option("--backfill_rollups", "backfill", is_flag=True, help="Rebuild rollups")
+def main(partition, months_ahead, backfill):
+    if os.path.exists("../.env"):
+        load_dotenv("../.env")
+    with get_db_engine().begin() as connection:
+        # creates tables added since init_db, e.g. the rollups
+        Base.metadata.create_all(connection)
+        add_missing_columns(connection)
+        add_rollup_shards_to_keys(connection)
+        create_missing_indexes(connection)
+        if partition:
+            partition_conversations_by_month(connection, months_ahead=months_ahead)
+        install_rollup_triggers(connection)
+        if backfill:
+            backfill_rollups(connection)
+    logger.info("Migration completed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Incrementally maintained rollups of ``conversations`` and ``feedback`` for the
+Grafana dashboard.
+
+Row triggers keep ``conversation_rollups`` (counts, answer cache hits, sums and the
+maximal response time per minute and model) and ``conversation_histograms`` up to
+date:
+
+* an inserted conversation adds its response time and, if it is already judged, its
+  scores;
+* the judge worker setting the scores of a conversation later is an update of the
+  score columns, the difference between the old and new scores is applied;
+* an inserted feedback is counted in the minute of the feedback and the model of its
+  conversation.
+
+The dashboard only reads the rollups, so the cost of a refresh depends on the
+selected time range, not on the size of the history.
+
+Concurrent writers would all update the row of the current minute and wait for each
+other's row lock, so the rows are split into ``ROLLUP_SHARDS`` shards by a hash of the
+conversation id. Readers sum over the shards, which the aggregating dashboard
+queries do anyway.
+"""
+from sqlalchemy.engine import Connection
+
+
+RESPONSE_TIME_BUCKETS = [0.5, 1, 2, 3, 5, 10, 30]
+ROLLUP_SHARDS = 8
+
+_FUNCTIONS = [
+    # the versions without a shard parameter
+    "DROP FUNCTION IF EXISTS rollup_bump_histogram("
+    "timestamptz, text, text, double precision, integer)",
+    "DROP FUNCTION IF EXISTS rollup_add_judgement(timestamptz, text, "
+    "double precision, double precision, double precision, double precision, "
+    "double precision, integer)",
+    f"""
+CREATE OR REPLACE FUNCTION rollup_shard(p_conversation_id text)
+RETURNS smallint AS $$
+    SELECT ((hashtext(p_conversation_id) & 2147483647) % {ROLLUP_SHARDS})::smallint
+$$ LANGUAGE sql IMMUTABLE
+""",
+    f"""
+CREATE OR REPLACE FUNCTION rollup_response_time_bucket(p_value double precision)
+RETURNS double precision AS $$
+    SELECT coalesce(min(b), 'Infinity')
+    FROM unnest(ARRAY{RESPONSE_TIME_BUCKETS}::double precision[]) AS b
+    WHERE b >= p_value
+$$ LANGUAGE sql IMMUTABLE
+""",
+    """
+CREATE OR REPLACE FUNCTION rollup_bump_histogram(
+    p_minute timestamptz,
+    p_model text,
+    p_shard smallint,
+    p_metric text,
+    p_bucket double precision,
+    p_delta integer
+) RETURNS void AS $$
+BEGIN
+    IF p_bucket IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO conversation_histograms AS h (
+        minute, model_used, shard, metric, bucket, count
+    )
+    VALUES (p_minute, p_model, p_shard, p_metric, p_bucket, p_delta)
+    ON CONFLICT (minute, model_used, shard, metric, bucket)
+    DO UPDATE SET count = h.count + EXCLUDED.count;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION rollup_add_judgement(
+    p_minute timestamptz,
+    p_model text,
+    p_shard smallint,
+    p_clarity double precision,
+    p_relevance double precision,
+    p_accuracy double precision,
+    p_completeness double precision,
+    p_overall_score double precision,
+    p_sign integer
+) RETURNS void AS $$
+BEGIN
+    -- a conversation counts as judged once it has an overall score
+    IF p_overall_score IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO conversation_rollups AS r (
+        minute, model_used, shard, judged_count, clarity_sum, relevance_sum,
+        accuracy_sum, completeness_sum, overall_score_sum
+    )
+    VALUES (
+        p_minute, p_model, p_shard, p_sign,
+        p_sign * coalesce(p_clarity, 0),
+        p_sign * coalesce(p_relevance, 0),
+        p_sign * coalesce(p_accuracy, 0),
+        p_sign * coalesce(p_completeness, 0),
+        p_sign * p_overall_score
+    )
+    ON CONFLICT (minute, model_used, shard) DO UPDATE SET
+        judged_count = r.judged_count + EXCLUDED.judged_count,
+        clarity_sum = r.clarity_sum + EXCLUDED.clarity_sum,
+        relevance_sum = r.relevance_sum + EXCLUDED.relevance_sum,
+        accuracy_sum = r.accuracy_sum + EXCLUDED.accuracy_sum,
+        completeness_sum = r.completeness_sum + EXCLUDED.completeness_sum,
+        overall_score_sum = r.overall_score_sum + EXCLUDED.overall_score_sum;
+    PERFORM rollup_bump_histogram(
+        p_minute, p_model, p_shard, 'overall_score', floor(p_overall_score), p_sign
+    );
+    PERFORM rollup_bump_histogram(
+        p_minute, p_model, p_shard, 'relevance', p_relevance, p_sign
+    );
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION rollup_conversations() RETURNS trigger AS $$
+DECLARE
+    v_minute timestamptz;
+    -- the id does not change, the updates of a conversation hit the shard of its insert
+    v_shard smallint := rollup_shard(NEW.id);
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_minute := date_trunc('minute', NEW.timestamp);
+        INSERT INTO conversation_rollups AS r (
+            minute, model_used, shard, request_count, response_time_sum,
+            response_time_max, cached_count
+        )
+        VALUES (
+            v_minute, NEW.model_used, v_shard, 1, NEW.response_time,
+            NEW.response_time, coalesce(NEW.answer_cached, false)::integer
+        )
+        ON CONFLICT (minute, model_used, shard) DO UPDATE SET
+            request_count = r.request_count + 1,
+            cached_count = r.cached_count + EXCLUDED.cached_count,
+            response_time_sum = r.response_time_sum + EXCLUDED.response_time_sum,
+            response_time_max = greatest(
+                r.response_time_max, EXCLUDED.response_time_max
+            );
+        PERFORM rollup_bump_histogram(
+            v_minute, NEW.model_used, v_shard, 'response_time',
+            rollup_response_time_bucket(NEW.response_time), 1
+        );
+    ELSE
+        PERFORM rollup_add_judgement(
+            date_trunc('minute', OLD.timestamp), OLD.model_used, v_shard,
+            OLD.clarity, OLD.relevance, OLD.accuracy, OLD.completeness,
+            OLD.overall_score, -1
+        );
+    END IF;
+    PERFORM rollup_add_judgement(
+        date_trunc('minute', NEW.timestamp), NEW.model_used, v_shard, NEW.clarity,
+        NEW.relevance, NEW.accuracy, NEW.completeness, NEW.overall_score, 1
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION rollup_feedback() RETURNS trigger AS $$
+DECLARE
+    v_model text;
+BEGIN
+    SELECT c.model_used INTO v_model FROM conversations c
+    WHERE c.id = NEW.conversation_id;
+    INSERT INTO conversation_rollups AS r (
+        minute, model_used, shard, thumbs_up, thumbs_down
+    )
+    VALUES (
+        date_trunc('minute', NEW.timestamp),
+        coalesce(v_model, 'unknown'),
+        rollup_shard(NEW.conversation_id),
+        (NEW.feedback > 0)::integer,
+        (NEW.feedback < 0)::integer
+    )
+    ON CONFLICT (minute, model_used, shard) DO UPDATE SET
+        thumbs_up = r.thumbs_up + EXCLUDED.thumbs_up,
+        thumbs_down = r.thumbs_down + EXCLUDED.thumbs_down;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+]
+
+_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS conversations_rollup_insert ON conversations",
+    """
+CREATE TRIGGER conversations_rollup_insert AFTER INSERT ON conversations
+FOR EACH ROW EXECUTE FUNCTION rollup_conversations()
+""",
+    "DROP TRIGGER IF EXISTS conversations_rollup_judgement ON conversations",
+    """
+CREATE TRIGGER conversations_rollup_judgement
+AFTER UPDATE OF clarity, relevance, accuracy, completeness, overall_score
+ON conversations
+FOR EACH ROW EXECUTE FUNCTION rollup_conversations()
+""",
+    "DROP TRIGGER IF EXISTS feedback_rollup_insert ON feedback",
+    """
+CREATE TRIGGER feedback_rollup_insert AFTER INSERT ON feedback
+FOR EACH ROW EXECUTE FUNCTION rollup_feedback()
+""",
+]
+
+_BACKFILL = [
+    # no writes while the rollups are rebuilt
+    "LOCK TABLE conversations, feedback IN SHARE MODE",
+    "TRUNCATE conversation_rollups, conversation_histograms",
+    """
+INSERT INTO conversation_rollups (
+    minute, model_used, shard, request_count, response_time_sum, response_time_max,
+    cached_count, judged_count, clarity_sum, relevance_sum, accuracy_sum,
+    completeness_sum, overall_score_sum
+)
+SELECT
+    date_trunc('minute', timestamp),
+    model_used,
+    rollup_shard(id),
+    count(*),
+    sum(response_time),
+    max(response_time),
+    count(*) FILTER (WHERE answer_cached),
+    count(overall_score),
+    coalesce(sum(clarity) FILTER (WHERE overall_score IS NOT NULL), 0),
+    coalesce(sum(relevance) FILTER (WHERE overall_score IS NOT NULL), 0),
+    coalesce(sum(accuracy) FILTER (WHERE overall_score IS NOT NULL), 0),
+    coalesce(sum(completeness) FILTER (WHERE overall_score IS NOT NULL), 0),
+    coalesce(sum(overall_score), 0)
+FROM conversations
+GROUP BY 1, 2, 3
+""",
+    """
+INSERT INTO conversation_rollups AS r (
+    minute, model_used, shard, thumbs_up, thumbs_down
+)
+SELECT
+    date_trunc('minute', f.timestamp),
+    coalesce(c.model_used, 'unknown'),
+    rollup_shard(f.conversation_id),
+    count(*) FILTER (WHERE f.feedback > 0),
+    count(*) FILTER (WHERE f.feedback < 0)
+FROM feedback f
+LEFT JOIN conversations c ON c.id = f.conversation_id
+GROUP BY 1, 2, 3
+ON CONFLICT (minute, model_used, shard) DO UPDATE SET
+    thumbs_up = r.thumbs_up + EXCLUDED.thumbs_up,
+    thumbs_down = r.thumbs_down + EXCLUDED.thumbs_down
+""",
+    """
+INSERT INTO conversation_histograms (
+    minute, model_used, shard, metric, bucket, count
+)
+SELECT date_trunc('minute', timestamp), model_used, rollup_shard(id),
+    'response_time', rollup_response_time_bucket(response_time), count(*)
+FROM conversations
+GROUP BY 1, 2, 3, 5
+UNION ALL
+SELECT date_trunc('minute', timestamp), model_used, rollup_shard(id),
+    'overall_score', floor(overall_score), count(*)
+FROM conversations
+WHERE overall_score IS NOT NULL
+GROUP BY 1, 2, 3, 5
+UNION ALL
+SELECT date_trunc('minute', timestamp), model_used, rollup_shard(id),
+    'relevance', relevance, count(*)
+FROM conversations
+WHERE overall_score IS NOT NULL AND relevance IS NOT NULL
+GROUP BY 1, 2, 3, 5
+""",
+]
+
+
+def install_rollup_triggers(connection: Connection) -> None:
+    """Creates (or replaces) the trigger functions and triggers."""
+    for statement in _FUNCTIONS + _TRIGGERS:
+        connection.exec_driver_sql(statement)
+
+
+def backfill_rollups(connection: Connection) -> None:
+    """Rebuilds the rollups from the whole history, e.g. after a bulk load."""
+    for statement in _BACKFILL:
+        connection.exec_driver_sql(statement)
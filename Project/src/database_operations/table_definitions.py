@@ -1,9 +1,13 @@
+from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Float
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import SmallInteger
 from sqlalchemy import String
+from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -17,8 +21,11 @@ class Conversation(Base):
     id = Column(String, primary_key=True)
     question = Column(String, nullable=False)
     answer = Column(String, nullable=False)
-    model_used = Column(String, nullable=False)
+    model_used = Column(String, nullable=False, index=True)
     response_time = Column(Float, nullable=False)
+    time_to_first_token = Column(Float, nullable=True)
+    tokens_per_second = Column(Float, nullable=True)
+    answer_cached = Column(Boolean, nullable=True)
     clarity = Column(Integer, nullable=True)
     relevance = Column(Integer, nullable=True)
     accuracy = Column(Integer, nullable=True)
@@ -26,7 +33,7 @@ class Conversation(Base):
     overall_score = Column(Float, nullable=True)
     explanation = Column(String, nullable=True)
     improvement_suggestions = Column(String, nullable=True)
-    timestamp = Column(DateTime(timezone=True), nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False, index=True)
     feedback = relationship("Feedback", back_populates="conversation")
 
 
@@ -34,7 +41,77 @@ class Feedback(Base):
     __tablename__ = "feedback"
 
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(String, ForeignKey("conversations.id"))
+    conversation_id = Column(String, ForeignKey("conversations.id"), index=True)
     feedback = Column(Integer, nullable=False)
     timestamp = Column(DateTime(timezone=True), nullable=False)
     conversation = relationship("Conversation", back_populates="feedback")
+
+
+class JudgeJob(Base):
+    """Durable queue of conversations waiting for the LLM-as-a-judge scores."""
+
+    __tablename__ = "judge_jobs"
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
+    status = Column(String, nullable=False, default=PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    enqueued_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+    # finished jobs are kept, the queue queries only read the unfinished ones
+    __table_args__ = (
+        Index(
+            "ix_judge_jobs_open_status",
+            "status",
+            postgresql_where=text(f"status <> '{DONE}'"),
+        ),
+    )
+
+
+class ConversationRollup(Base):
+    """
+    Per minute and model aggregates of ``conversations`` and ``feedback`` for the
+    dashboard, maintained by the triggers of ``rollups``. Every minute and model is
+    split into shards, the aggregates are the sums over the shards.
+    """
+
+    __tablename__ = "conversation_rollups"
+
+    minute = Column(DateTime(timezone=True), primary_key=True)
+    model_used = Column(String, primary_key=True)
+    shard = Column(SmallInteger, primary_key=True, server_default="0")
+    request_count = Column(Integer, nullable=False, server_default="0")
+    response_time_sum = Column(Float, nullable=False, server_default="0")
+    response_time_max = Column(Float, nullable=True)
+    cached_count = Column(Integer, nullable=False, server_default="0")
+    judged_count = Column(Integer, nullable=False, server_default="0")
+    clarity_sum = Column(Float, nullable=False, server_default="0")
+    relevance_sum = Column(Float, nullable=False, server_default="0")
+    accuracy_sum = Column(Float, nullable=False, server_default="0")
+    completeness_sum = Column(Float, nullable=False, server_default="0")
+    overall_score_sum = Column(Float, nullable=False, server_default="0")
+    thumbs_up = Column(Integer, nullable=False, server_default="0")
+    thumbs_down = Column(Integer, nullable=False, server_default="0")
+
+
+class ConversationHistogram(Base):
+    """
+    Per minute and model histograms: ``response_time`` (bucket is the upper bound in
+    seconds), ``overall_score`` (bucket is the score rounded down) and ``relevance``.
+    """
+
+    __tablename__ = "conversation_histograms"
+
+    minute = Column(DateTime(timezone=True), primary_key=True)
+    model_used = Column(String, primary_key=True)
+    shard = Column(SmallInteger, primary_key=True, server_default="0")
+    metric = Column(String, primary_key=True)
+    bucket = Column(Float, primary_key=True)
+    count = Column(Integer, nullable=False, server_default="0")
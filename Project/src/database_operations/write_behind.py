@@ -0,0 +1,240 @@
+"""
+Optional write-behind mode for the inserts of the application.
+
+Rows are put into a bounded in-process buffer and a background thread writes them in
+multi-row inserts, every ``flush_rows`` rows or ``flush_interval_ms`` milliseconds,
+so the request thread does not wait for the database. When the buffer is full the
+caller writes synchronously (together with everything buffered before, to keep the
+order of dependent rows). The buffer is flushed on interpreter shutdown.
+
+Rows rejected by the database (integrity or data errors) are dropped one by one. If
+the database is unavailable, the rows stay at the front of the buffer and the flusher
+retries with an exponential backoff; a synchronous write then raises
+``DatabaseUnavailableError`` to its caller like a write without the buffer.
+
+Buffered rows are not visible to queries until they are flushed.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from loguru import logger
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError
+from sqlalchemy.exc import IntegrityError
+
+from .base_db_operations import get_session_factory
+from .table_definitions import Base
+
+
+Row = Tuple[type, dict]
+
+
+class DatabaseUnavailableError(Exception):
+    """The rows could not be written for a reason other than the rows themselves."""
+
+    def __init__(self, rows: List[Row], error: Exception):
+        super().__init__(f"{len(rows)} rows not written: {str(error)}")
+        self.rows = rows
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        max_rows: int = 10_000,
+        flush_rows: int = 500,
+        flush_interval_ms: int = 200,
+        max_backoff_ms: int = 30_000,
+    ):
+        """
+        :param max_rows: Size bound of the buffer, beyond it rows are written
+            synchronously.
+        :param flush_rows: Number of buffered rows that triggers a flush.
+        :param flush_interval_ms: Maximal time a row waits in the buffer.
+        :param max_backoff_ms: Upper bound of the wait between flushes while the
+            database is unavailable.
+        """
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_backoff = max_backoff_ms / 1000
+        self._rows: "deque[Row]" = deque()
+        self._condition = threading.Condition()
+        # a flush drains and writes under this lock, so batches are written in order
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.sync_writes = 0
+        self._thread = threading.Thread(
+            target=self._run, name="db-write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, rows: List[Row]) -> None:
+        """
+        Buffers rows that have to be inserted together, e.g. a conversation and its
+        judge job. Rows are (ORM class, column values) pairs.
+        """
+        with self._condition:
+            if not self._closed and len(self._rows) + len(rows) <= self.max_rows:
+                self._rows.extend(rows)
+                if len(self._rows) >= self.flush_rows:
+                    self._condition.notify()
+                return
+        self.sync_writes += 1
+        self.flush(extra=rows)
+
+    def flush(self, extra: Iterable[Row] = ()) -> None:
+        """
+        Writes all buffered rows (and ``extra``) in the calling thread. If the
+        database is unavailable, the unwritten buffered rows are put back in front of
+        the buffer (the ``extra`` rows are not) and ``DatabaseUnavailableError`` is
+        raised.
+        """
+        extra = list(extra)
+        with self._write_lock:
+            with self._condition:
+                rows = list(self._rows)
+                self._rows.clear()
+            if not rows and not extra:
+                return
+            try:
+                self._write(rows + extra)
+            except DatabaseUnavailableError as e:
+                extra_ids = {id(row) for row in extra}
+                with self._condition:
+                    self._rows.extendleft(
+                        reversed([row for row in e.rows if id(row) not in extra_ids])
+                    )
+                raise
+
+    def _backoff(self, failures: int) -> float:
+        return min(self.max_backoff, self.flush_interval * 2**failures)
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            with self._condition:
+                if not self._closed and failures:
+                    # the database is unavailable, new rows do not trigger a flush
+                    deadline = time.monotonic() + self._backoff(failures)
+                    while not self._closed and time.monotonic() < deadline:
+                        self._condition.wait(deadline - time.monotonic())
+                elif not self._closed and len(self._rows) < self.flush_rows:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+            try:
+                self.flush()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(
+                    f"Write-behind flush failed, {len(self._rows)} rows kept, "
+                    f"retrying in {self._backoff(failures):.2f}s: {str(e)}"
+                )
+            if closed:
+                if self._rows:
+                    logger.error(f"{len(self._rows)} buffered rows were not written")
+                return
+
+    @staticmethod
+    def _grouped(rows: List[Row]) -> List[Tuple[object, List[Row]]]:
+        # parents are inserted before children; rows with the same columns form one
+        # multi-row insert
+        groups: Dict[Tuple[object, tuple], List[Row]] = {}
+        for row in rows:
+            model, values = row
+            groups.setdefault((model.__table__, tuple(sorted(values))), []).append(row)
+        order = {table: i for i, table in enumerate(Base.metadata.sorted_tables)}
+        return [
+            (table, groups[(table, columns)])
+            for table, columns in sorted(groups, key=lambda key: order[key[0]])
+        ]
+
+    def _write(self, rows: List[Row]) -> None:
+        groups = self._grouped(rows)
+        session = get_session_factory()()
+        try:
+            for table, group in groups:
+                session.execute(insert(table), [values for _, values in group])
+            session.commit()
+            self.flushed_rows += len(rows)
+            return
+        except (IntegrityError, DataError) as e:
+            session.rollback()
+            logger.error(
+                f"Write-behind batch of {len(rows)} rows failed, "
+                f"retrying row by row: {str(e)}"
+            )
+        except Exception as e:
+            session.rollback()
+            raise DatabaseUnavailableError(rows, e) from e
+        finally:
+            session.close()
+
+        ordered = [row for _, group in groups for row in group]
+        for position, (model, values) in enumerate(ordered):
+            session = get_session_factory()()
+            try:
+                session.execute(insert(model.__table__), [values])
+                session.commit()
+                self.flushed_rows += 1
+            except (IntegrityError, DataError) as e:
+                session.rollback()
+                self.failed_rows += 1
+                logger.error(f"Dropping a row of {model.__tablename__}: {str(e)}")
+            except Exception as e:
+                session.rollback()
+                raise DatabaseUnavailableError(ordered[position:], e) from e
+            finally:
+                session.close()
+
+    def close(self) -> None:
+        """Stops the flusher after writing the remaining rows."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        logger.info(f"Write-behind buffer closed: {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "buffered_rows": len(self._rows),
+                "flushed_rows": self.flushed_rows,
+                "failed_rows": self.failed_rows,
+                "sync_writes": self.sync_writes,
+            }
+
+
+_buffer: Optional[WriteBehindBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_behind_buffer() -> Optional[WriteBehindBuffer]:
+    """
+    Process-wide buffer if DB_WRITE_BEHIND=true, configured by
+    DB_WRITE_BEHIND_MAX_ROWS, DB_WRITE_BEHIND_FLUSH_ROWS and DB_WRITE_BEHIND_FLUSH_MS.
+    """
+    global _buffer
+    if os.getenv("DB_WRITE_BEHIND", "false").lower() != "true":
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                max_rows=int(os.getenv("DB_WRITE_BEHIND_MAX_ROWS", 10_000)),
+                flush_rows=int(os.getenv("DB_WRITE_BEHIND_FLUSH_ROWS", 500)),
+                flush_interval_ms=int(os.getenv("DB_WRITE_BEHIND_FLUSH_MS", 200)),
+            )
+        return _buffer
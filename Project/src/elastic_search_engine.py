@@ -1,42 +1,125 @@
 """
 Includes ElasticSearch functionality for different cases.
 """
+import asyncio
+from typing import Dict
+from typing import Optional
+
+from elasticsearch import AsyncElasticsearch
 from elasticsearch import Elasticsearch
-from sentence_transformers import SentenceTransformer
+
+import model_registry
 
 
 class ElasticSearcher:
+    # the async client keeps many requests in flight, the default pool has 10
+    async_connections_per_node = 100
+
     def __init__(
         self, index_name: str, elastic_search_client_uri="http://localhost:9200"
     ):
         self.client = Elasticsearch([elastic_search_client_uri])
+        self.elastic_search_client_uri = elastic_search_client_uri
         self.index_name = index_name
+        self._async_client = None
+
+    @property
+    def async_client(self) -> AsyncElasticsearch:
+        # created on first use, so that it is bound to the running event loop
+        if self._async_client is None:
+            self._async_client = AsyncElasticsearch(
+                [self.elastic_search_client_uri],
+                connections_per_node=self.async_connections_per_node,
+            )
+        return self._async_client
 
     def search_query(self, input_argument):
         raise NotImplementedError
 
+    @staticmethod
+    def _source_docs(es_results):
+        result_docs = []
+        for hit in es_results["hits"]["hits"]:
+            result_docs.append(hit["_source"])
+
+        return result_docs
+
     def search(self, input_argument):
         es_results = self.client.search(
             index=self.index_name, body=self.search_query(input_argument)
         )
+        return self._source_docs(es_results)
 
-        result_docs = []
-        for hit in es_results["hits"]["hits"]:
-            result_docs.append(hit["_source"])
+    def _msearch_body(self, input_arguments):
+        searches = []
+        for input_argument in input_arguments:
+            searches.append({"index": self.index_name})
+            searches.append(self.search_query(input_argument))
+        return searches
 
-        return result_docs
+    def search_many(self, input_arguments):
+        """
+        Runs the searches for all input arguments in a single _msearch request.
+        :param input_arguments: Input arguments as accepted by ``search_query``.
+        :return: List of result documents per input argument (in the input order).
+        """
+        searches = self._msearch_body(input_arguments)
+        if not searches:
+            return []
+        return self._msearch_results(self.client.msearch(searches=searches))
+
+    async def _run_blocking(self, func, *args):
+        # building a query may encode the input (ElasticHybridSearcher), which must
+        # not block the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def asearch(self, input_argument):
+        query = await self._run_blocking(self.search_query, input_argument)
+        es_results = await self.async_client.search(index=self.index_name, body=query)
+        return self._source_docs(es_results)
+
+    async def asearch_many(self, input_arguments):
+        searches = await self._run_blocking(self._msearch_body, input_arguments)
+        if not searches:
+            return []
+        es_results = await self.async_client.msearch(searches=searches)
+        return self._msearch_results(es_results)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+    def _msearch_results(self, es_results):
+        results = []
+        for response in es_results["responses"]:
+            if "error" in response:
+                raise RuntimeError(f"Search in msearch request failed: {response}")
+            results.append(self._source_docs(response))
+        return results
 
 
 class ElasticKeywordSearcher(ElasticSearcher):
+    def __init__(
+        self,
+        index_name: str,
+        elastic_search_client_uri="http://localhost:9200",
+        size: int = 5,
+        vague_boost: float = 3,
+    ):
+        super().__init__(index_name, elastic_search_client_uri)
+        self.size = size
+        self.vague_boost = vague_boost
+
     def search_query(self, input_argument):
         _search_query = {
-            "size": 5,
+            "size": self.size,
             "query": {
                 "bool": {
                     "must": {
                         "multi_match": {
                             "query": input_argument,
-                            "fields": ["vague^3", "actual"],
+                            "fields": [f"vague^{self.vague_boost}", "actual"],
                             "type": "best_fields",
                         }
                     },
@@ -47,59 +130,97 @@ class ElasticKeywordSearcher(ElasticSearcher):
 
 
 class ElasticSemanticSearcher(ElasticSearcher):
+    def __init__(
+        self,
+        index_name: str,
+        elastic_search_client_uri="http://localhost:9200",
+        k: int = 5,
+        num_candidates: int = 100,
+    ):
+        super().__init__(index_name, elastic_search_client_uri)
+        self.k = k
+        self.num_candidates = num_candidates
+
     def search_query(self, input_argument):
         knn = {
             "field": "vague_embedding",
             "query_vector": input_argument,
-            "num_candidates": 100,
-            "k": 5,
+            "num_candidates": self.num_candidates,
+            "k": self.k,
         }
         _search_query = {"knn": knn, "_source": ["vague", "actual", "id"]}
         return _search_query
 
 
 class ElasticHybridSearcher(ElasticSearcher):
+    DEFAULT_FIELD_BOOSTS = {
+        "vague": 3,
+        "vague.keyword": 2,
+        "actual": 2,
+        "actual.keyword": 1,
+        "combined_text": 4,
+    }
+
     def __init__(
         self,
         index_name: str,
         elastic_search_client_uri="http://localhost:9200",
         model_name="all-mpnet-base-v2",
+        size: int = 10,
+        field_boosts: Optional[Dict[str, float]] = None,
+        fuzziness: Optional[str] = "AUTO",
+        semantic_weight: float = 0.5,
     ):
+        """
+        :param model_name: Encoder of the statements, ``None`` if the statements are
+            passed with their embeddings (see ``search_query``).
+        :param field_boosts: Boost per field of the keyword query.
+        :param fuzziness: Fuzziness of the keyword query, ``None`` for exact matching.
+        :param semantic_weight: Weight of the cosine similarity in the final score,
+            the keyword score gets ``1 - semantic_weight``.
+        """
         super().__init__(index_name, elastic_search_client_uri)
-        self.model = SentenceTransformer(model_name)
+        self.model = model_registry.get_encoder(model_name) if model_name else None
+        self.size = size
+        self.field_boosts = field_boosts or self.DEFAULT_FIELD_BOOSTS
+        self.fuzziness = fuzziness
+        self.semantic_weight = semantic_weight
 
     def search_query(self, input_argument):
-        # Generate embedding for the input query
-        query_vector = self.model.encode(input_argument).tolist()
+        """
+        :param input_argument: The statement or a (statement, embedding) pair.
+        """
+        if isinstance(input_argument, tuple):
+            input_argument, query_vector = input_argument
+        else:
+            # Generate embedding for the input query
+            query_vector = self.model.encode(input_argument).tolist()
+
+        multi_match = {
+            "query": input_argument,
+            "fields": [
+                f"{field}^{boost}" if boost != 1 else field
+                for field, boost in self.field_boosts.items()
+            ],
+            "type": "best_fields",
+        }
+        if self.fuzziness is not None:
+            multi_match["fuzziness"] = self.fuzziness
 
         search_query = {
-            "size": 10,
+            "size": self.size,
             "query": {
                 "script_score": {
-                    "query": {
-                        "bool": {
-                            "should": [
-                                {
-                                    "multi_match": {
-                                        "query": input_argument,
-                                        "fields": [
-                                            "vague^3",
-                                            "vague.keyword^2",
-                                            "actual^2",
-                                            "actual.keyword",
-                                            "combined_text^4",
-                                        ],
-                                        "type": "best_fields",
-                                        "fuzziness": "AUTO",
-                                    }
-                                }
-                            ]
-                        }
-                    },
+                    "query": {"bool": {"should": [{"multi_match": multi_match}]}},
                     "script": {
                         "source": "(cosineSimilarity(params.query_vector, \
-                            'vague_embedding') + 1.0) * 0.5 + _score * 0.5",
-                        "params": {"query_vector": query_vector},
+                            'vague_embedding') + 1.0) * params.semantic_weight \
+                            + _score * params.keyword_weight",
+                        "params": {
+                            "query_vector": query_vector,
+                            "semantic_weight": self.semantic_weight,
+                            "keyword_weight": 1 - self.semantic_weight,
+                        },
                     },
                 }
             },
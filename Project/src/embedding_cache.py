@@ -0,0 +1,284 @@
+"""
+Two-tier cache for sentence embeddings: an in-memory LRU in front of a SQLite file.
+
+Entries are keyed by (model name, sha256 of the text), so several models can share one
+cache file. ``CachedEncoder`` wraps a ``SentenceTransformer`` and only encodes texts
+that are found in neither tier; encode options that change the embeddings (e.g.
+``normalize_embeddings``) are part of the model name of the key. Cached vectors are
+read-only, so that a caller cannot modify them in place.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+
+DEFAULT_CACHE_PATH: Path = (
+    Path(__file__).resolve().parents[1] / "data" / "embedding_cache.sqlite"
+)
+# options of SentenceTransformer.encode that do not change the embeddings
+_NEUTRAL_OPTIONS = {"batch_size", "show_progress_bar", "device", "chunk_size"}
+# options that change the embeddings, with their defaults
+_KEYED_OPTIONS = {
+    "prompt_name": None,
+    "prompt": None,
+    "precision": "float32",
+    "normalize_embeddings": False,
+}
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        max_memory_bytes: int = 64 * 1024**2,
+        max_disk_bytes: int = 1024**3,
+    ):
+        """
+        :param path: SQLite file of the disk tier, ``None`` keeps the cache in memory.
+        :param max_memory_bytes: Size bound of the LRU tier.
+        :param max_disk_bytes: Size bound of the disk tier, least recently used entries
+            are evicted first.
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+                "ON embeddings (last_access)"
+            )
+            self._db.commit()
+            self._disk_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()[0]
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{digest}"
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _select(self, query: str, keys: List[str]) -> list:
+        # SQLite limits the number of bound parameters per statement
+        rows = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows.extend(
+                self._db.execute(
+                    query.format(",".join("?" * len(chunk))), chunk
+                ).fetchall()
+            )
+        return rows
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.key(model_name, text) for text in texts]
+        with self._lock:
+            found: Dict[str, np.ndarray] = {}
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.memory_hits += sum(key in found for key in keys)
+
+            disk_keys = list({key for key in keys if key not in found})
+            if disk_keys and self._db is not None:
+                rows = self._select(
+                    "SELECT key, dtype, vector FROM embeddings WHERE key IN ({})",
+                    disk_keys,
+                )
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype)
+                    self._remember(key, found[key])
+                disk_found = {row[0] for row in rows}
+                self.disk_hits += sum(key in disk_found for key in keys)
+                if rows:
+                    now = time.time()
+                    self._db.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, row[0]) for row in rows],
+                    )
+                    self._db.commit()
+
+            self.misses += sum(key not in found for key in keys)
+        return [found.get(key) for key in keys]
+
+    def put_many(
+        self, model_name: str, texts: List[str], vectors: List[np.ndarray]
+    ) -> None:
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                # a copy, the caller keeps its own array
+                vector = np.array(vector)
+                vector.flags.writeable = False
+                key = self.key(model_name, text)
+                self._remember(key, vector)
+                rows.append(
+                    (key, vector.dtype.str, vector.tobytes(), vector.nbytes, now)
+                )
+            if self._db is None:
+                return
+            replaced = self._select(
+                "SELECT size FROM embeddings WHERE key IN ({})",
+                [row[0] for row in rows],
+            )
+            self._disk_bytes -= sum(row[0] for row in replaced)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._disk_bytes += sum(row[3] for row in rows)
+            self._evict_disk()
+            self._db.commit()
+
+    def _evict_disk(self) -> None:
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        # evict down to 90% of the bound to avoid evicting on every insert
+        target = int(self.max_disk_bytes * 0.9)
+        evicted = 0
+        cursor = self._db.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access"
+        )
+        keys = []
+        for key, size in cursor:
+            if self._disk_bytes - evicted <= target:
+                break
+            keys.append((key,))
+            evicted += size
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        self._disk_bytes -= evicted
+        logger.info(f"Evicted {len(keys)} embeddings ({evicted} bytes) from disk cache")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_bytes": self._memory_bytes,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """Process-wide cache, its file can be set by the EMBEDDING_CACHE_PATH variable."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+            )
+        return _default_cache
+
+
+class CachedEncoder:
+    """
+    Wraps a SentenceTransformer; ``encode`` has the same signature and return shape
+    (a single vector for a string, a matrix for a list of strings).
+    """
+
+    def __init__(self, model, model_name: str, cache: EmbeddingCache = None):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache if cache is not None else get_default_cache()
+
+    def _cache_name(self, kwargs) -> Optional[str]:
+        """
+        Model name of the cache keys for the encode options, ``None`` if the results
+        of the options are not cached (e.g. tensors or token embeddings).
+        """
+        if any(
+            name not in _NEUTRAL_OPTIONS and name not in _KEYED_OPTIONS
+            for name in kwargs
+        ):
+            return None
+        options = [
+            f"{name}={kwargs[name]!r}"
+            for name, default in _KEYED_OPTIONS.items()
+            if kwargs.get(name, default) != default
+        ]
+        return "|".join([self.model_name] + options)
+
+    def _encode_uncached(self, texts, pool, **kwargs):
+        if pool is not None:
+            return self.model.encode_multi_process(texts, pool, **kwargs)
+        return self.model.encode(texts, **kwargs)
+
+    def encode(self, sentences, pool=None, **kwargs) -> np.ndarray:
+        """
+        :param pool: Optional pool of ``start_multi_process_pool``, the cache misses are
+            then encoded by ``encode_multi_process``.
+        """
+        cache_name = self._cache_name(kwargs)
+        if cache_name is None:
+            return self._encode_uncached(sentences, pool, **kwargs)
+
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = self.cache.get_many(cache_name, texts)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # the same text can be missing several times within one call
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = self._encode_uncached(unique_texts, pool, **kwargs)
+            self.cache.put_many(cache_name, unique_texts, list(encoded))
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+
+        if single:
+            # a writable copy, the cached vector is read-only
+            return np.array(vectors[0])
+        return np.stack(vectors) if vectors else np.empty((0,))
+
+    def encode_multi_process(self, sentences, pool, **kwargs) -> np.ndarray:
+        """Same as ``SentenceTransformer.encode_multi_process``, through the cache."""
+        return self.encode(sentences, pool=pool, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
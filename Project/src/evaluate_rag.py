@@ -0,0 +1,275 @@
+"""
+Checkpointed evaluation of the ambiguity resolver RAG with the LLM judge.
+
+Every ground truth statement is answered by ``AbstractRAG.arag_results`` and the
+answer judged by ``JudgeLLM.ajudget_it``, with at most ``--generation_concurrency``
+and ``--judge_concurrency`` calls in flight. A record is appended to the JSONL
+checkpoint as soon as it is judged, so an interrupted run loses at most the records
+in flight: started again with the same checkpoint, the runner skips the statements
+found there. Failed statements are logged and not checkpointed, i.e. retried by the
+next run.
+
+At the end the throughput of the run, the token usage and cost and the
+distributions of the judge scores of all checkpointed records are written to
+``<checkpoint>.report.json``; ``--export_csv`` additionally writes the records in
+the format of ``data/ambiguity_resolver_rag_evaluation.csv``.
+
+Usage (from the project directory, Elasticsearch has to be running and
+OPENAI_API_KEY set):
+
+    python src/evaluate_rag.py --sample 4000 --generation_concurrency 32
+"""
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Set
+
+import click
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from loguru import logger
+
+import ambiguity_resolver_rag
+from judge_llm import JudgeLLM
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+# USD per million (prompt, completion) tokens
+PRICES_PER_MILLION_TOKENS = {"gpt-4o-mini": (0.15, 0.60)}
+SCORES = ["clarity", "relevance", "accuracy", "completeness", "overall_score"]
+
+
+def read_checkpoint(path: Path) -> List[Dict[str, Any]]:
+    """Returns the records of the checkpoint, a truncated last line is skipped."""
+    records = []
+    if not path.exists():
+        return records
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping incomplete checkpoint line: {line[:80]!r}")
+    return records
+
+
+def cost(token_usage: Dict[str, int], model: str) -> float:
+    prompt_price, completion_price = PRICES_PER_MILLION_TOKENS.get(model, (0.0, 0.0))
+    return (
+        token_usage.get("prompt_tokens", 0) * prompt_price
+        + token_usage.get("completion_tokens", 0) * completion_price
+    ) / 1e6
+
+
+async def evaluate_statements(
+    rag,
+    judge: JudgeLLM,
+    statements: List[Dict[str, Any]],
+    checkpoint_path: Path,
+    generation_concurrency: int,
+    judge_concurrency: int,
+) -> int:
+    """
+    Answers and judges the statements, appending a record per statement to the
+    checkpoint.
+    :return: Number of failed statements.
+    """
+    generation_semaphore = asyncio.Semaphore(generation_concurrency)
+    judge_semaphore = asyncio.Semaphore(judge_concurrency)
+    failures = 0
+
+    with open(checkpoint_path, "a") as checkpoint:
+
+        async def evaluate_statement(statement: Dict[str, Any]) -> None:
+            nonlocal failures
+            generation_usage, judge_usage = {}, {}
+            try:
+                async with generation_semaphore:
+                    start = time.perf_counter()
+                    answer_llm = await rag.arag_results(
+                        statement["vague"], token_usage=generation_usage
+                    )
+                    generation_seconds = time.perf_counter() - start
+                async with judge_semaphore:
+                    start = time.perf_counter()
+                    score = await judge.ajudget_it(
+                        {"vague": statement["vague"], "translation": answer_llm},
+                        token_usage=judge_usage,
+                    )
+                    judge_seconds = time.perf_counter() - start
+            except Exception as e:
+                failures += 1
+                logger.error(f"Statement {statement['id']} failed: {e}")
+                return
+
+            record = {
+                **statement,
+                "answer_llm": answer_llm,
+                "generation_seconds": generation_seconds,
+                "judge_seconds": judge_seconds,
+                **{name: getattr(score, name) for name in SCORES},
+                "explanation": score.explanation,
+                "generation_tokens": generation_usage,
+                "judge_tokens": judge_usage,
+                "cost": cost(generation_usage, str(rag.llm_model))
+                + cost(judge_usage, judge.gpt_model),
+            }
+            # one write per line from the event loop thread, lines never interleave
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+
+        await asyncio.gather(*[evaluate_statement(s) for s in statements])
+    await rag.elastic_searcher.aclose()
+    return failures
+
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Token usage, cost and score distributions of the checkpointed records."""
+    summary: Dict[str, Any] = {
+        "records": len(records),
+        "cost": sum(record["cost"] for record in records),
+    }
+    for usage in ["generation_tokens", "judge_tokens"]:
+        summary[usage] = {
+            key: sum(record[usage].get(key, 0) for record in records)
+            for key in ["prompt_tokens", "completion_tokens"]
+        }
+    for latency in ["generation_seconds", "judge_seconds"]:
+        values = np.array([record[latency] for record in records])
+        summary[latency] = {}
+        if len(values):
+            summary[latency] = {
+                f"p{percentile}": float(np.percentile(values, percentile))
+                for percentile in [50, 95, 99]
+            }
+
+    summary["scores"] = {}
+    for name in SCORES:
+        values = pd.Series([record[name] for record in records], dtype=float)
+        summary["scores"][name] = {
+            "mean": float(values.mean()) if len(values) else None,
+            "std": float(values.std()) if len(values) > 1 else None,
+            # the judge scores on a 1-5 scale, 0 means the score was not parsed
+            "histogram": {
+                str(int(score)): int(count)
+                for score, count in values.round().value_counts().sort_index().items()
+            },
+        }
+    return summary
+
+
+@click.command()
+@click.option(
+    "--ground_truth", default=str(PROJECT_DIR / "data" / "ground_truth_data.csv")
+)
+@click.option(
+    "--documents",
+    default=str(PROJECT_DIR / "data" / "initial_data_w_id_keyword.json"),
+    help="Documents with ids, their actual meaning is the reference answer",
+)
+@click.option("--sample", default=0, help="Number of statements, 0 for all")
+@click.option("--elastic_url", default=None)
+@click.option("--search_backend", default=None, help="elastic or numpy")
+@click.option("--generation_concurrency", default=16, help="RAG calls in flight")
+@click.option("--judge_concurrency", default=16, help="Judge calls in flight")
+@click.option(
+    "--checkpoint",
+    default=str(PROJECT_DIR / "evaluations" / "rag_evaluation.jsonl"),
+    help="JSONL file the records are appended to and resumed from",
+)
+@click.option("--export_csv", default=None, help="Optional CSV of the records")
+def main(
+    ground_truth,
+    documents,
+    sample,
+    elastic_url,
+    search_backend,
+    generation_concurrency,
+    judge_concurrency,
+    checkpoint,
+    export_csv,
+):
+    """Answers and judges the ground truth statements with a resumable checkpoint."""
+    if os.path.exists(PROJECT_DIR / ".env"):
+        load_dotenv(PROJECT_DIR / ".env")
+
+    ground_truth_data = pd.read_csv(ground_truth)
+    if sample:
+        ground_truth_data = ground_truth_data.sample(
+            min(sample, len(ground_truth_data)), random_state=42
+        )
+    with open(documents, "r") as f:
+        actual_by_id = {doc["id"]: doc["actual"] for doc in json.load(f)}
+
+    checkpoint_path = Path(checkpoint)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    done: Set[int] = {record["id"] for record in read_checkpoint(checkpoint_path)}
+    # the row of the ground truth file identifies a statement across runs
+    statements = [
+        {
+            "id": int(row),
+            "vague": entry["vague"],
+            "document": entry["doc_id"],
+            "answer_orig": actual_by_id.get(entry["doc_id"]),
+        }
+        for row, entry in ground_truth_data.iterrows()
+        if int(row) not in done
+    ]
+    logger.info(
+        f"{len(done)} statements found in {checkpoint_path}, "
+        f"{len(statements)} to evaluate"
+    )
+
+    rag = ambiguity_resolver_rag.create_rag(elastic_url, search_backend)
+    judge = JudgeLLM()
+    start = time.perf_counter()
+    failures = asyncio.run(
+        evaluate_statements(
+            rag,
+            judge,
+            statements,
+            checkpoint_path,
+            generation_concurrency,
+            judge_concurrency,
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    records = read_checkpoint(checkpoint_path)
+    evaluated = len(statements) - failures
+    report = {
+        "run": {
+            "evaluated": evaluated,
+            "failed": failures,
+            "seconds": elapsed,
+            "statements_per_second": evaluated / elapsed if elapsed else 0.0,
+            "generation_concurrency": generation_concurrency,
+            "judge_concurrency": judge_concurrency,
+        },
+        **summarize(records),
+    }
+    report_path = checkpoint_path.with_suffix(".report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    if export_csv:
+        columns = ["answer_llm", "answer_orig", "document", "vague"]
+        pd.DataFrame(records, columns=columns).to_csv(export_csv, index=False)
+
+    click.echo(
+        f"{evaluated} statements in {elapsed:.1f}s "
+        f"({report['run']['statements_per_second']:.2f}/s), {failures} failed; "
+        f"{report['records']} records, cost ${report['cost']:.4f}, "
+        f"overall score {report['scores']['overall_score']['mean'] or 0:.2f}"
+    )
+    click.echo(f"Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
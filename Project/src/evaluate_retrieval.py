@@ -0,0 +1,271 @@
+"""
+Evaluates retrieval quality and speed of a searcher on ``data/ground_truth_data.csv``.
+
+All queries are encoded in one batched call, sent in ``_msearch`` requests of
+``--batch_size`` queries with at most ``--concurrency`` requests in flight, and the
+hit rate, MRR (and the other metrics of ``retrieval_metrics`` at every cutoff), the
+search latency percentiles and the throughput are written to a JSON file, one per
+searcher and commit.
+
+The latency of a query is the latency of the ``_msearch`` request it was sent in,
+i.e. what a client batching its queries observes.
+
+Usage (from the project directory, Elasticsearch with the index has to be running):
+
+    python src/evaluate_retrieval.py --searcher semantic --concurrency 8
+"""
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import click
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import elastic_search_engine
+import model_registry
+import numpy_search_engine
+
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_DIR / "utils"))
+
+import retrieval_metrics  # noqa: E402
+
+
+# searcher -> (searcher class, default index), the indexes of the notebook
+SEARCHERS = {
+    "semantic": (elastic_search_engine.ElasticSemanticSearcher, "vague-actual-mpnet"),
+    "keyword": (elastic_search_engine.ElasticKeywordSearcher, "vague_actual_keyword"),
+    "hybrid": (elastic_search_engine.ElasticHybridSearcher, "vague-actual-hybrid"),
+    "numpy": (numpy_search_engine.NumpySemanticSearcher, None),
+}
+ENCODED_QUERIES = {"semantic", "hybrid", "numpy"}
+
+
+def create_searcher(
+    searcher_name: str, index_name: str, elastic_url: str, **searcher_kwargs
+):
+    """
+    :param searcher_kwargs: Parameters of the searcher class, e.g. ``k``.
+    """
+    searcher_class, default_index_name = SEARCHERS[searcher_name]
+    if searcher_class is numpy_search_engine.NumpySemanticSearcher:
+        return searcher_class(**searcher_kwargs)
+    return searcher_class(
+        index_name=index_name or default_index_name,
+        elastic_search_client_uri=elastic_url,
+        **searcher_kwargs,
+    )
+
+
+def embed_queries(searcher_name: str, model_name: str, queries: List[str]) -> list:
+    """Returns the input arguments of the searcher, embedding the queries at once."""
+    if searcher_name not in ENCODED_QUERIES:
+        return queries
+    vectors = model_registry.get_encoder(model_name).encode(queries).tolist()
+    if searcher_name == "hybrid":
+        # the hybrid searcher takes (statement, embedding) tuples
+        return list(zip(queries, vectors))
+    return vectors
+
+
+def result_count(searcher) -> int:
+    """Number of results the searcher returns per query."""
+    return searcher.k if hasattr(searcher, "k") else searcher.size
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def search_batches(
+    searcher, input_arguments: list, batch_size: int, concurrency: int
+):
+    """
+    Runs ``searcher.asearch_many`` over batches of the input arguments, at most
+    ``concurrency`` batches at a time.
+    :return: Result documents per input argument and latency in seconds per input
+    argument.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def search_batch(batch: list):
+        async with semaphore:
+            start = time.perf_counter()
+            results = await searcher.asearch_many(batch)
+            return results, time.perf_counter() - start
+
+    batches = [
+        input_arguments[i : i + batch_size]
+        for i in range(0, len(input_arguments), batch_size)
+    ]
+    try:
+        batch_results = await asyncio.gather(*[search_batch(b) for b in batches])
+    finally:
+        await searcher.aclose()
+
+    results, latencies = [], []
+    for batch, (batch_docs, latency) in zip(batches, batch_results):
+        results.extend(batch_docs)
+        latencies.extend([latency] * len(batch))
+    return results, latencies
+
+
+def evaluate(
+    searcher,
+    ground_truth: pd.DataFrame,
+    input_arguments: list,
+    batch_size: int,
+    concurrency: int,
+    k: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    :param k: Cutoff of the hit rate and MRR, defaults to the number of results of
+        the searcher.
+    """
+    if k is None:
+        k = result_count(searcher)
+    if k < 1:
+        raise ValueError(f"The cutoff k has to be at least 1, got {k}")
+    start = time.perf_counter()
+    results, latencies = asyncio.run(
+        search_batches(searcher, input_arguments, batch_size, concurrency)
+    )
+    elapsed = time.perf_counter() - start
+
+    relevance: List[List[bool]] = [
+        [document["id"] == doc_id for document in documents]
+        for documents, doc_id in zip(results, ground_truth["doc_id"])
+    ]
+    metrics = retrieval_metrics.metrics_at_k(relevance, k)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "k": k,
+        "hit_rate": float(metrics["hit_rate"][-1]),
+        "mrr": float(metrics["mrr"][-1]),
+        "metrics_at_k": {name: values.tolist() for name, values in metrics.items()},
+        "latency_ms": {
+            f"p{percentile}": float(np.percentile(latencies_ms, percentile))
+            for percentile in [50, 95, 99]
+        },
+        "queries_per_second": len(input_arguments) / elapsed,
+        "search_seconds": elapsed,
+    }
+
+
+@click.command()
+@click.option(
+    "--searcher",
+    "searcher_name",
+    type=click.Choice(list(SEARCHERS)),
+    default="semantic",
+)
+@click.option("--index_name", default=None, help="Defaults to the searcher's index")
+@click.option("--elastic_url", default="http://localhost:9200")
+@click.option("--model_name", default="all-mpnet-base-v2", help="Query encoder")
+@click.option(
+    "--ground_truth", default=str(PROJECT_DIR / "data" / "ground_truth_data.csv")
+)
+@click.option("--sample", default=0, help="Number of queries, 0 for all")
+@click.option("--batch_size", default=64, help="Queries per _msearch request")
+@click.option("--concurrency", default=8, help="_msearch requests in flight")
+@click.option(
+    "--k",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Cutoff of hit rate and MRR, defaults to the results of the searcher",
+)
+@click.option(
+    "--output",
+    default=None,
+    help="Defaults to evaluations/retrieval_<searcher>_<commit>.json",
+)
+def main(
+    searcher_name,
+    index_name,
+    elastic_url,
+    model_name,
+    ground_truth,
+    sample,
+    batch_size,
+    concurrency,
+    k,
+    output,
+):
+    """Hit rate, MRR, latency and throughput of a searcher on the ground truth."""
+    ground_truth_data = pd.read_csv(ground_truth)
+    if sample:
+        ground_truth_data = ground_truth_data.sample(
+            min(sample, len(ground_truth_data)), random_state=42
+        )
+    queries = ground_truth_data["vague"].tolist()
+
+    start = time.perf_counter()
+    input_arguments = embed_queries(searcher_name, model_name, queries)
+    encode_seconds = time.perf_counter() - start
+
+    searcher_kwargs = {}
+    if searcher_name == "hybrid":
+        # the statements come with their embeddings
+        searcher_kwargs["model_name"] = None
+    searcher = create_searcher(
+        searcher_name, index_name, elastic_url, **searcher_kwargs
+    )
+    logger.info(f"Evaluating {searcher_name} searcher on {len(queries)} queries")
+    report = {
+        "searcher": searcher_name,
+        "index_name": getattr(searcher, "index_name", None),
+        "model_name": model_name if searcher_name in ENCODED_QUERIES else None,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "queries": len(queries),
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "encode_seconds": encode_seconds,
+        **evaluate(
+            searcher, ground_truth_data, input_arguments, batch_size, concurrency, k
+        ),
+    }
+
+    if output is None:
+        output = (
+            PROJECT_DIR
+            / "evaluations"
+            / f"retrieval_{searcher_name}_{report['commit'][:8]}.json"
+        )
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    click.echo(
+        f"hit_rate={report['hit_rate']:.3f} mrr={report['mrr']:.3f} "
+        f"p50={report['latency_ms']['p50']:.1f}ms "
+        f"p95={report['latency_ms']['p95']:.1f}ms "
+        f"p99={report['latency_ms']['p99']:.1f}ms "
+        f"{report['queries_per_second']:.0f} queries/s"
+    )
+    click.echo(f"Written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,8 @@ def main():
     asyncio.run(main_semantic_search(model_name=os.getenv("MODEL_NAME"),
                                      index_name=os.getenv("INDEX_NAME"),
                                      dims=768,
-                                     es_host=ELASTIC_URL))
+                                     es_host=ELASTIC_URL,
+                                     incremental=True))
     logger.info("Indexing process completed successfully!")
     logger.info("Initializing database...")
     create_user_and_db()
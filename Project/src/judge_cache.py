@@ -0,0 +1,141 @@
+"""
+Persistent, content-addressed cache of LLM-as-a-judge answers.
+
+An answer is keyed by the sha256 of the judge prompt template, the judge model and
+the inputs, so re-judging unchanged (vague, translation) pairs - in the application,
+the evaluation notebooks or reruns of an experiment - does not call the LLM again.
+The raw answer is cached, parsing it is cheap and may change.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+
+DEFAULT_CACHE_PATH: Path = (
+    Path(__file__).resolve().parents[1] / "data" / "judge_cache.sqlite"
+)
+
+
+class JudgeCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        """
+        :param path: SQLite file of the cache, ``None`` keeps the cache in memory.
+        """
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            ":memory:" if path is None else str(path), check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS judgements ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, answer TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt_template: str, model: str, inputs: Dict) -> str:
+        payload = json.dumps(
+            {"template": prompt_template, "model": model, "inputs": inputs},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT answer FROM judgements WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, answer: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO judgements VALUES (?, ?, ?, ?)",
+                (key, model, answer, time.time()),
+            )
+            self._db.commit()
+
+    def judge(
+        self,
+        prompt_template: str,
+        model: str,
+        inputs: Dict,
+        call: Callable[..., str],
+    ) -> str:
+        """
+        Returns the cached answer or calls the judge and caches its answer.
+        :param prompt_template: Judge prompt, formatted with ``inputs``.
+        :param model: Judge model, passed to ``call`` as ``gpt_model``.
+        :param inputs: Values of the template placeholders.
+        :param call: The LLM, e.g. ``llm.llm``; called as
+            ``call(prompt=..., gpt_model=...)``.
+        :return: The raw answer of the judge.
+        """
+        key = self.key(prompt_template, model, inputs)
+        answer = self.get(key)
+        if answer is None:
+            answer = call(prompt=prompt_template.format(**inputs), gpt_model=model)
+            self.put(key, model, answer)
+        return answer
+
+    async def ajudge(
+        self,
+        prompt_template: str,
+        model: str,
+        inputs: Dict,
+        call: Callable[..., Awaitable[str]],
+    ) -> str:
+        """Async version of ``judge``, ``call`` is awaited, e.g. ``llm.allm``."""
+        key = self.key(prompt_template, model, inputs)
+        answer = self.get(key)
+        if answer is None:
+            answer = await call(
+                prompt=prompt_template.format(**inputs), gpt_model=model
+            )
+            self.put(key, model, answer)
+        return answer
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._db.execute(
+                    "SELECT COUNT(*) FROM judgements"
+                ).fetchone()[0],
+            }
+
+
+_default_cache: Optional[JudgeCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_judge_cache() -> JudgeCache:
+    """Process-wide cache, its file can be set by the JUDGE_CACHE_PATH variable."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = JudgeCache(
+                path=os.getenv("JUDGE_CACHE_PATH", DEFAULT_CACHE_PATH)
+            )
+        return _default_cache
@@ -1,9 +1,13 @@
 import re
 from dataclasses import dataclass
+from functools import partial
 from typing import Dict
+from typing import Optional
 from typing import TypedDict
 
 import llm
+from judge_cache import JudgeCache
+from judge_cache import get_default_judge_cache
 
 
 @dataclass
@@ -36,6 +40,7 @@ class JudgeLLMPromptInput(TypedDict):
 
 
 class JudgeLLM:
+    gpt_model = "gpt-4o-mini"
     judge_prompt_template = """ 
     LLM-as-a-Judge Prompt for RAG Evaluation
     You are an expert judge evaluating the performance of a 
@@ -91,6 +96,12 @@ class JudgeLLM:
     Please provide your evaluation for the given example.
     """.strip()
 
+    def __init__(self, cache: Optional[JudgeCache] = None):
+        """
+        :param cache: Cache of the judge answers, defaults to the process-wide one.
+        """
+        self.cache = cache if cache is not None else get_default_judge_cache()
+
     @staticmethod
     def parse_evaluation_text(text: str) -> dict:
         """ Parses the answer from gpt-4o-mini in a particular form
@@ -130,7 +141,25 @@ class JudgeLLM:
         return result
 
     def judget_it(self, rec: JudgeLLMPromptInput) -> LLMJudgementScore:
-        judge_prompt = self.judge_prompt_template.format(**rec)
-        answer = llm.llm(prompt=judge_prompt, gpt_model="gpt-4o-mini")
+        # identical inputs are judged only once, see judge_cache
+        answer = self.cache.judge(
+            self.judge_prompt_template, self.gpt_model, dict(rec), llm.llm
+        )
         print(answer, flush=True)
         return LLMJudgementScore.from_dict(self.parse_evaluation_text(answer))
+
+    async def ajudget_it(
+        self, rec: JudgeLLMPromptInput, token_usage: Optional[Dict[str, int]] = None
+    ) -> LLMJudgementScore:
+        """
+        Async version of ``judget_it``.
+        :param token_usage: Optional dict the tokens of the judge call are added to,
+            cached judgements add nothing.
+        """
+        answer = await self.cache.ajudge(
+            self.judge_prompt_template,
+            self.gpt_model,
+            dict(rec),
+            partial(llm.allm, token_usage=token_usage),
+        )
+        return LLMJudgementScore.from_dict(self.parse_evaluation_text(answer))
@@ -0,0 +1,163 @@
+"""
+Background worker that scores queued conversations with the LLM-as-a-judge.
+
+The queue lives in the ``judge_jobs`` table, so it survives restarts of the
+application. The worker can run inside the Streamlit process (see
+``start_judge_worker``) or as a separate process: ``python judge_worker.py``. It
+also creates the upcoming monthly partitions of a partitioned ``conversations``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict
+from typing import Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from database_operations.db import claim_judge_jobs
+from database_operations.db import complete_judge_job
+from database_operations.db import fail_judge_job
+from database_operations.db import get_judge_queue_depth
+from database_operations.db import requeue_stale_judge_jobs
+from database_operations.migrations import ensure_upcoming_partitions
+from judge_llm import JudgeLLM
+from judge_llm import JudgeLLMPromptInput
+
+
+class JudgeWorker:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        stale_after: timedelta = timedelta(minutes=5),
+        partition_interval: timedelta = timedelta(days=1),
+        requeue_interval: timedelta = timedelta(minutes=1),
+        max_backoff: float = 60.0,
+    ):
+        """
+        :param max_workers: Number of concurrent judge calls.
+        :param poll_interval: Seconds to wait when the queue is empty.
+        :param max_attempts: Attempts per job before it is marked as failed.
+        :param stale_after: Running jobs older than this are requeued, e.g. the jobs
+            of a crashed worker.
+        :param partition_interval: How often the upcoming monthly partitions of a
+            partitioned ``conversations`` table are created.
+        :param requeue_interval: How often stale running jobs are requeued.
+        :param max_backoff: Upper bound in seconds of the wait after failed loops,
+            e.g. while the database is unreachable.
+        """
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.partition_interval = partition_interval
+        self.requeue_interval = requeue_interval
+        self.max_backoff = max_backoff
+        # monotonic time of the last run per periodic task
+        self._last_runs: Dict[str, float] = {}
+        self.judge_llm = JudgeLLM()
+        self._stop = threading.Event()
+
+    def _judge(self, job: dict) -> None:
+        judge_llm_input: JudgeLLMPromptInput = {
+            "vague": job["vague"],
+            "translation": job["translation"],
+        }
+        try:
+            complete_judge_job(job["job_id"], self.judge_llm.judget_it(judge_llm_input))
+        except Exception as e:
+            retry = job["attempts"] < self.max_attempts
+            logger.error(
+                f"Judging job {job['job_id']} failed (attempt {job['attempts']}, "
+                f"retry={retry}): {str(e)}"
+            )
+            fail_judge_job(job["job_id"], str(e), retry=retry)
+
+    def _due(self, task: str, interval: timedelta) -> bool:
+        last_run = self._last_runs.get(task)
+        if last_run is None:
+            return True
+        return time.monotonic() - last_run >= interval.total_seconds()
+
+    def ensure_partitions(self) -> None:
+        if not self._due("partitions", self.partition_interval):
+            return
+        self._last_runs["partitions"] = time.monotonic()
+        try:
+            ensure_upcoming_partitions()
+        except Exception as e:
+            logger.error(f"Creating the upcoming partitions failed: {str(e)}")
+
+    def requeue_stale_jobs(self) -> None:
+        """Requeues the jobs of crashed workers (of any process), periodically."""
+        if not self._due("requeue", self.requeue_interval):
+            return
+        requeued = requeue_stale_judge_jobs(self.stale_after)
+        # only marked as done when it succeeded, otherwise retried on the next loop
+        self._last_runs["requeue"] = time.monotonic()
+        if requeued:
+            logger.info(
+                f"{requeued} stale jobs requeued, queue depth {get_judge_queue_depth()}"
+            )
+
+    def run_once(self, pool: ThreadPoolExecutor) -> int:
+        jobs = claim_judge_jobs(limit=self.max_workers)
+        list(pool.map(self._judge, jobs))
+        return len(jobs)
+
+    def run(self) -> None:
+        logger.info("Judge worker started")
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not self._stop.is_set():
+                self.ensure_partitions()
+                try:
+                    self.requeue_stale_jobs()
+                    if self.run_once(pool) == 0:
+                        self._stop.wait(self.poll_interval)
+                    else:
+                        logger.info(f"Judge queue depth: {get_judge_queue_depth()}")
+                    failures = 0
+                except Exception as e:
+                    # e.g. the database is unreachable, the worker keeps retrying
+                    failures += 1
+                    backoff = min(self.max_backoff, self.poll_interval * 2**failures)
+                    logger.error(
+                        f"Judge worker loop failed, retrying in {backoff:.1f}s: "
+                        f"{str(e)}"
+                    )
+                    self._stop.wait(backoff)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_worker_thread: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def start_judge_worker(max_workers: int = 4) -> threading.Thread:
+    """Starts the judge worker in a daemon thread, once per process."""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            worker = JudgeWorker(max_workers=max_workers)
+            _worker_thread = threading.Thread(
+                target=worker.run, name="judge-worker", daemon=True
+            )
+            _worker_thread.start()
+        return _worker_thread
+
+
+if __name__ == "__main__":
+    if os.path.exists("../.env"):
+        load_dotenv("../.env")
+    worker = JudgeWorker(max_workers=int(os.getenv("JUDGE_WORKERS", 4)))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        logger.info("Judge worker stopped")
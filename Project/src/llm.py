@@ -2,11 +2,43 @@
 General functionality for LLM.
 """
 
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import Optional
+
+from openai import AsyncOpenAI
 from openai import OpenAI
-from sentence_transformers import SentenceTransformer
 
 
-client = OpenAI()
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+_client = None
+_async_client = None
+
+
+def get_client() -> OpenAI:
+    """OpenAI client, created on first use to keep the import of this module cheap."""
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI()
+    return _async_client
+
+
+def add_token_usage(token_usage: Optional[Dict[str, int]], response) -> None:
+    """Adds the prompt and completion tokens of a chat completion to ``token_usage``."""
+    if token_usage is None or response.usage is None:
+        return
+    for key in ["prompt_tokens", "completion_tokens"]:
+        token_usage[key] = token_usage.get(key, 0) + getattr(response.usage, key)
 
 
 def build_prompt(query: str, search_results: list):
@@ -37,16 +69,31 @@ def llm(prompt, gpt_model="gpt-4o-mini") -> str:
     :param gpt_model: Model to use, defaults to "gpt-4o-mini".
     :return: Generated response text.
     """
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
+        model=gpt_model,
+        messages=[{"role": "user", "content": prompt}],
+    )
+    return response.choices[0].message.content
+
+
+async def allm(
+    prompt, gpt_model="gpt-4o-mini", token_usage: Optional[Dict[str, int]] = None
+) -> str:
+    """
+    Async version of ``llm``.
+    :param token_usage: Optional dict the tokens of the call are added to.
+    """
+    response = await get_async_client().chat.completions.create(
         model=gpt_model,
         messages=[{"role": "user", "content": prompt}],
     )
+    add_token_usage(token_usage, response)
     return response.choices[0].message.content
 
 
 def rag(
     vague: str,
-    model: SentenceTransformer,
+    model: "SentenceTransformer",
     elastic_search_knn: dict,
     gpt_model="gpt-4o-mini",
 ):
@@ -0,0 +1,54 @@
+"""
+Process-wide registry of SentenceTransformer models.
+
+Every model is loaded once per process and shared by the RAG pipelines, the searchers
+and the ingestion, wrapped into a ``CachedEncoder`` that uses the shared embedding
+cache.
+"""
+import threading
+from typing import Dict
+
+from loguru import logger
+
+from embedding_cache import CachedEncoder
+
+
+_encoders: Dict[str, CachedEncoder] = {}
+_lock = threading.Lock()
+
+
+def get_encoder(model_name: str) -> CachedEncoder:
+    """
+    Returns the shared encoder for ``model_name``, loading the model on first use.
+    :param model_name: Name of a SentenceTransformer model, e.g. all-mpnet-base-v2.
+    :return: The cached encoder wrapping the shared model.
+    """
+    encoder = _encoders.get(model_name)
+    if encoder is not None:
+        return encoder
+    with _lock:
+        # another thread may have loaded the model while we waited for the lock
+        if model_name not in _encoders:
+            # imported here since importing torch is the most expensive part of startup
+            from sentence_transformers import SentenceTransformer
+
+            logger.info(f"Loading SentenceTransformer {model_name}")
+            _encoders[model_name] = CachedEncoder(
+                SentenceTransformer(model_name), model_name
+            )
+            logger.info(
+                f"Loaded {model_name} ({model_memory_usage()[model_name]} bytes)"
+            )
+        return _encoders[model_name]
+
+
+def model_memory_usage() -> Dict[str, int]:
+    """Bytes used by the parameters and buffers of every loaded model."""
+    usage = {}
+    for model_name, encoder in list(_encoders.items()):
+        model = encoder.model
+        usage[model_name] = sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in list(model.parameters()) + list(model.buffers())
+        )
+    return usage
@@ -0,0 +1,128 @@
+"""
+In-process semantic search over a memory-mapped NumPy matrix of embeddings.
+
+``NumpySemanticSearcher`` is a drop-in alternative to
+``elastic_search_engine.ElasticSemanticSearcher``: it takes the same query vector and
+returns the same ``_source``-shaped dicts (``vague``, ``actual``, ``id``), but answers
+with a single matrix-vector product instead of an HTTP round trip to Elasticsearch.
+"""
+import json
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+
+DEFAULT_INDEX_PATH: Path = Path(__file__).resolve().parents[1] / "data" / "numpy_index"
+EMBEDDINGS_FILE = "vague_embedding.npy"
+SOURCES_FILE = "sources.json"
+SOURCE_FIELDS = ("vague", "actual", "id")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpySemanticSearcher:
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, k: int = 5):
+        """
+        :param index_path: Directory created by ``NumpySemanticSearcher.build_index``.
+        :param k: Number of documents returned by ``search``.
+        """
+        self.index_path = Path(index_path)
+        self.k = k
+        # rows are L2-normalized at build time, so a dot product is a cosine similarity
+        self.embeddings: np.ndarray = np.load(
+            self.index_path / EMBEDDINGS_FILE, mmap_mode="r"
+        )
+        with open(self.index_path / SOURCES_FILE, "r") as f:
+            self.sources: List[Dict[str, Any]] = json.load(f)
+        logger.info(
+            f"Loaded numpy index with {len(self.sources)} documents "
+            f"({self.embeddings.dtype}) from {self.index_path}"
+        )
+
+    def _top_k(self, scores: np.ndarray) -> np.ndarray:
+        k = min(self.k, scores.shape[-1])
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def search(self, input_argument) -> List[Dict[str, Any]]:
+        query = _normalize(np.asarray(input_argument, dtype=np.float32))
+        scores = self.embeddings @ query
+        return [self.sources[i] for i in self._top_k(scores)]
+
+    def search_many(self, input_arguments) -> List[List[Dict[str, Any]]]:
+        queries = _normalize(np.asarray(input_arguments, dtype=np.float32))
+        if queries.size == 0:
+            return []
+        scores = queries @ self.embeddings.T
+        return [[self.sources[i] for i in self._top_k(row)] for row in scores]
+
+    # the in-process search takes microseconds, the async variants do not need to
+    # leave the event loop
+    async def asearch(self, input_argument) -> List[Dict[str, Any]]:
+        return self.search(input_argument)
+
+    async def asearch_many(self, input_arguments) -> List[List[Dict[str, Any]]]:
+        return self.search_many(input_arguments)
+
+    async def aclose(self):
+        pass
+
+    @staticmethod
+    def build_index(
+        documents: List[Dict[str, Any]], index_path=DEFAULT_INDEX_PATH, dtype="float32"
+    ) -> Path:
+        """
+        Writes the normalized ``vague_embedding`` matrix and the document sources.
+        :param documents: Documents with ``vague``, ``actual``, ``id`` and
+            ``vague_embedding`` keys, e.g. the content of ``initial_data_w_id.json``.
+        :param index_path: Target directory.
+        :param dtype: ``float32`` or ``float16`` (halves the size of the matrix).
+        :return: The index directory.
+        """
+        index_path = Path(index_path)
+        index_path.mkdir(parents=True, exist_ok=True)
+        embeddings = np.asarray(
+            [doc["vague_embedding"] for doc in documents], dtype=np.float32
+        )
+        np.save(index_path / EMBEDDINGS_FILE, _normalize(embeddings).astype(dtype))
+        with open(index_path / SOURCES_FILE, "w") as f:
+            json.dump([{k: doc[k] for k in SOURCE_FIELDS} for doc in documents], f)
+        logger.info(f"Numpy index of {len(documents)} documents saved to {index_path}")
+        return index_path
+
+
+def build_index_from_ingested_data(
+    model_name: str = "all-mpnet-base-v2",
+    index_path=DEFAULT_INDEX_PATH,
+    dtype="float32",
+) -> Path:
+    """
+    Builds the numpy index from ``data/initial_data_w_id.json`` written by the semantic
+    ingestion. Documents without a stored embedding are encoded with ``model_name``.
+    """
+    data_dir: Path = Path(__file__).resolve().parents[1] / "data"
+    with open(data_dir / "initial_data_w_id.json", "r") as f:
+        documents: List[Dict[str, Any]] = json.load(f)
+
+    missing = [doc for doc in documents if "vague_embedding" not in doc]
+    if missing:
+        import model_registry
+
+        encoder = model_registry.get_encoder(model_name)
+        embeddings = encoder.encode([doc["vague"] for doc in missing])
+        for doc, embedding in zip(missing, embeddings):
+            doc["vague_embedding"] = embedding.tolist()
+
+    return NumpySemanticSearcher.build_index(documents, index_path, dtype=dtype)
+
+
+if __name__ == "__main__":
+    build_index_from_ingested_data()
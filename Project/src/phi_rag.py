@@ -1,9 +1,9 @@
 """
 Implements a RAG that exploits Phi3 Model as an LLM model in Ollama fashion.
 """
-import os
+import threading
 
-import elastic_search_engine
+import answer_cache
 import rag
 
 
@@ -23,29 +23,43 @@ CONTEXT: {context}
 CLEAR STATEMENT:""".strip()
 
 
-def create_ollama_rag(ollama_model_name: str, elastic_url=None):
+def create_ollama_rag(ollama_model_name: str, elastic_url=None, search_backend=None):
     """
     Create an Ollama RAG instance with specified model and Elasticsearch configuration.
     :param ollama_model_name: Name of the Ollama model to use.
     :param elastic_url: Optional Elasticsearch URL, defaults to None.
+    :param search_backend: "elastic" (default) or "numpy" for the in-process index,
+        falls back to the SEARCH_BACKEND environment variable.
     :return: Configured OllamaRag instance.
     """
-    if elastic_url:
-        os.environ['ELASTIC_URL'] = elastic_url
-    
-    elastic_semantic_searcher = elastic_search_engine.ElasticSemanticSearcher(
-        index_name="vague-actual-mpnet",
-        elastic_search_client_uri=os.getenv("ELASTIC_URL", "http://localhost:9200"),
+    elastic_semantic_searcher = rag.create_semantic_searcher(
+        elastic_url, search_backend
     )
-
-    print(f'ELASTIC_URL {os.getenv("ELASTIC_URL")}')
     # defining new RAG with a prompt above
     return rag.OllamaRag(
         elastic_searcher=elastic_semantic_searcher,
         prompt_template=ambiguity_resolver_prompt,
         llm_model=ollama_model_name,
         sentence_transformer_name="all-mpnet-base-v2",
+        answer_cache=answer_cache.get_default_answer_cache(),
     )
 
-# Initialize with default settings
-phi3_rag = create_ollama_rag('phi3')
\ No newline at end of file
+_phi3_rag = None
+_phi3_rag_lock = threading.Lock()
+
+
+def get_phi3_rag():
+    """Returns the phi3 RAG with default settings, it is built on first use."""
+    global _phi3_rag
+    with _phi3_rag_lock:
+        if _phi3_rag is None:
+            _phi3_rag = create_ollama_rag("phi3")
+        return _phi3_rag
+
+
+def __getattr__(name):
+    # keeps ``from phi_rag import phi3_rag`` working without building the RAG at
+    # import time
+    if name == "phi3_rag":
+        return get_phi3_rag()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,57 @@
+"""
+Lazy access to the RAG pipelines offered by the application.
+
+The pipelines are built on first use, so importing the application does not create
+Elasticsearch/OpenAI clients or load the encoder. ``warmup`` builds all of them ahead
+of time, e.g. in a background thread at container start.
+"""
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from loguru import logger
+
+import ambiguity_resolver_rag
+import phi_rag
+from rag import AbstractRAG
+
+
+PIPELINES: Dict[str, Callable[[], AbstractRAG]] = {
+    "openai/gpt-4o-mini": ambiguity_resolver_rag.get_rag,
+    "ollama/phi3": phi_rag.get_phi3_rag,
+}
+
+
+def get_pipeline(model_choice: str) -> AbstractRAG:
+    """
+    :param model_choice: One of the keys of ``PIPELINES``.
+    :return: The (lazily built) RAG for the model.
+    """
+    return PIPELINES[model_choice]()
+
+
+def _warmup() -> None:
+    for model_choice, factory in PIPELINES.items():
+        try:
+            pipeline = factory()
+            # the first encode call initializes torch kernels and the embedding cache
+            if pipeline.sentence_transformer is not None:
+                pipeline.sentence_transformer.encode("warm up")
+            logger.info(f"Pipeline {model_choice} is warmed up")
+        except Exception as e:
+            logger.error(f"Warm up of pipeline {model_choice} failed: {str(e)}")
+
+
+def warmup(background: bool = True) -> Optional[threading.Thread]:
+    """
+    Builds all pipelines and loads the encoder.
+    :param background: Run in a daemon thread instead of blocking the caller.
+    :return: The started thread in the background mode.
+    """
+    if not background:
+        _warmup()
+        return None
+    thread = threading.Thread(target=_warmup, name="pipeline-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -2,27 +2,144 @@
 Includes different RAG classes: ChatGPTRAG and OllamaRAG that incapsulate
 neccessary functionality.
 """
+import asyncio
 import os
+import time
 from abc import ABC
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
 
+from openai import AsyncOpenAI
 from openai import OpenAI
-from sentence_transformers import SentenceTransformer
 
+import elastic_search_engine
+import llm
+import model_registry
+import numpy_search_engine
+from answer_cache import AnswerCache
 from elastic_search_engine import ElasticKeywordSearcher
 
 
+def create_semantic_searcher(elastic_url=None, search_backend=None):
+    """
+    Creates the semantic searcher of the RAG pipelines.
+    :param elastic_url: Optional Elasticsearch URL, sets ELASTIC_URL.
+    :param search_backend: "elastic" (default) or "numpy" for the in-process index
+        at NUMPY_INDEX_PATH, falls back to the SEARCH_BACKEND environment variable.
+    :return: ElasticSemanticSearcher or NumpySemanticSearcher.
+    """
+    if elastic_url:
+        os.environ['ELASTIC_URL'] = elastic_url
+
+    search_backend = search_backend or os.getenv("SEARCH_BACKEND", "elastic")
+    if search_backend == "numpy":
+        return numpy_search_engine.NumpySemanticSearcher(
+            index_path=os.getenv(
+                "NUMPY_INDEX_PATH", numpy_search_engine.DEFAULT_INDEX_PATH
+            ),
+        )
+    print(f'ELASTIC_URL {os.getenv("ELASTIC_URL")}')
+    return elastic_search_engine.ElasticSemanticSearcher(
+        index_name="vague-actual-mpnet",
+        elastic_search_client_uri=os.getenv("ELASTIC_URL", "http://localhost:9200"),
+    )
+
+
+class StreamedAnswer:
+    """
+    Iterates over the chunks of a streamed LLM answer and measures the
+    time-to-first-token and the generation speed on the way.
+
+    Every content chunk of the chat completions stream is counted as one token,
+    which is what both OpenAI and Ollama send.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterator[str],
+        start: Optional[float] = None,
+        on_complete: Optional[Callable[["StreamedAnswer"], None]] = None,
+        cached: bool = False,
+    ):
+        """
+        :param chunks: The text chunks of the answer.
+        :param start: ``time.perf_counter()`` of the request start, defaults to now.
+        :param on_complete: Called with the answer once the stream is consumed.
+        :param cached: The answer comes from the answer cache.
+        """
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.cached = cached
+        self.start = time.perf_counter() if start is None else start
+        self.first_token_at: Optional[float] = None
+        self.end: Optional[float] = None
+        self.tokens = 0
+        self.text = ""
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens += 1
+            self.text += chunk
+            yield chunk
+        self.end = time.perf_counter()
+        if self._on_complete is not None:
+            self._on_complete(self)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def response_time(self) -> Optional[float]:
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        # the first token only marks the start of the generation
+        if self.end is None or self.first_token_at is None or self.tokens < 2:
+            return None
+        generation_time = self.end - self.first_token_at
+        if generation_time <= 0:
+            return None
+        return (self.tokens - 1) / generation_time
+
+
 class AbstractRAG(ABC):
     
     def __init__(self, elastic_searcher: ElasticKeywordSearcher,
-                 prompt_template: str, sentence_transformer_name: str, llm_model: Any):
+                 prompt_template: str, sentence_transformer_name: str, llm_model: Any,
+                 answer_cache: Optional[AnswerCache] = None):
+        """
+        :param answer_cache: Optional cache of answers in front of ``rag_results`` and
+            ``rag_results_stream``, entries are namespaced by the LLM model and the
+            prompt template.
+        """
         self.elastic_searcher = elastic_searcher
         self.prompt_template = prompt_template
         self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        self.answer_cache_namespace = AnswerCache.namespace(
+            str(llm_model), prompt_template
+        )
         self.sentence_transformer = None
         if sentence_transformer_name:
-            self.sentence_transformer = SentenceTransformer(sentence_transformer_name)
+            self.sentence_transformer = model_registry.get_encoder(
+                sentence_transformer_name
+            )
     
     @abstractmethod
     def build_prompt(query: str, search_result: list):
@@ -31,19 +148,136 @@ class AbstractRAG(ABC):
     @abstractmethod
     def llm(*args, **kwargs):
         ...
+
+    @abstractmethod
+    async def allm(*args, **kwargs):
+        ...
+
+    @abstractmethod
+    def llm_stream(*args, **kwargs):
+        ...
+
+    def _input_argument(self, vague):
+        if self.sentence_transformer:
+            return self.sentence_transformer.encode(vague)
+        return vague
+
+    def _cached_answer(self, vague, input_argument) -> Optional[str]:
+        if self.answer_cache is None:
+            return None
+        vector = input_argument if self.sentence_transformer else None
+        return self.answer_cache.get(self.answer_cache_namespace, vague, vector)
+
+    def _cache_answer(self, vague, input_argument, answer, latency) -> None:
+        if self.answer_cache is None or not answer:
+            return
+        vector = input_argument if self.sentence_transformer else None
+        self.answer_cache.put(
+            self.answer_cache_namespace, vague, answer, vector, latency=latency
+        )
+
+    def _retrieve_and_build_prompt(self, vague, input_argument):
+        search_results = self.elastic_searcher.search(input_argument=input_argument)
+        return self.build_prompt(vague, search_results=search_results)
     
     def rag_results(self, vague):
+        start = time.perf_counter()
+        input_argument = self._input_argument(vague)
+        answer = self._cached_answer(vague, input_argument)
+        if answer is not None:
+            return answer
+        prompt = self._retrieve_and_build_prompt(vague, input_argument)
+        answer = self.llm(prompt)
+        self._cache_answer(
+            vague, input_argument, answer, latency=time.perf_counter() - start
+        )
+        return answer    
+
+    def rag_results_stream(self, vague) -> StreamedAnswer:
+        """
+        Streaming version of ``rag_results``. Retrieval happens right away, the LLM
+        answer is produced while iterating over the result.
+        :param vague: Vague statement.
+        :return: Iterable over the answer chunks, that holds the full text and the
+                 time-to-first-token/tokens per second once it is consumed.
+        """
+        start = time.perf_counter()
+        input_argument = self._input_argument(vague)
+        answer = self._cached_answer(vague, input_argument)
+        if answer is not None:
+            return StreamedAnswer(iter([answer]), start=start, cached=True)
+        prompt = self._retrieve_and_build_prompt(vague, input_argument)
+        return StreamedAnswer(
+            self.llm_stream(prompt),
+            start=start,
+            on_complete=lambda streamed: self._cache_answer(
+                vague, input_argument, streamed.text, streamed.response_time
+            ),
+        )
+
+    async def arag_results(self, vague, token_usage: Optional[Dict[str, int]] = None):
+        """
+        Async version of ``rag_results``: the encoder runs in the default executor,
+        search and LLM call are awaited, so many statements can be in flight at once.
+        :param token_usage: Optional dict the tokens of the LLM call are added to.
+        """
         if self.sentence_transformer:
-            input_argument = self.sentence_transformer.encode(vague)
+            input_argument = await asyncio.get_running_loop().run_in_executor(
+                None, self.sentence_transformer.encode, vague
+            )
         else:
-            input_argument = vague    
-        search_results = self.elastic_searcher.search(input_argument=input_argument)
+            input_argument = vague
+        search_results = await self.elastic_searcher.asearch(
+            input_argument=input_argument
+        )
         prompt = self.build_prompt(vague, search_results=search_results)
-        answer = self.llm(prompt)
-        return answer    
+        answer = await self.allm(prompt, token_usage=token_usage)
+        return answer
+
+    def rag_results_batch(self, vagues: List[str], max_workers: int = 8) -> List[str]:
+        """
+        Batched version of ``rag_results``: one encode call for all statements, one
+        _msearch request and the LLM calls run concurrently in a bounded thread pool.
+        :param vagues: Vague statements.
+        :param max_workers: Maximal number of concurrent LLM calls.
+        :return: Answers in the order of the input statements.
+        """
+        if self.sentence_transformer:
+            input_arguments = list(self.sentence_transformer.encode(vagues))
+        else:
+            input_arguments = vagues
+        search_results = self.elastic_searcher.search_many(
+            input_arguments=input_arguments
+        )
+        prompts = [
+            self.build_prompt(vague, search_results=search_result)
+            for vague, search_result in zip(vagues, search_results)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(self.llm, prompts))
 
 class ChatGPTRAG(AbstractRAG):
-    client = OpenAI()
+    _client = None
+    _async_client = None
+
+    @property
+    def client(self) -> OpenAI:
+        # created on first use, so that constructing a RAG does not need the API key
+        if self._client is None:
+            self._client = self.create_client()
+        return self._client
+
+    def create_client(self) -> OpenAI:
+        return OpenAI()
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = self.create_async_client()
+        return self._async_client
+
+    def create_async_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI()
       
     def build_prompt(self, query, search_results):
        
@@ -58,7 +292,29 @@ class ChatGPTRAG(AbstractRAG):
                                              messages=[{'role': 'user', 'content': prompt}],)
         _message = response.choices[0].message.content
         return _message
+
+    async def allm(self, prompt, token_usage: Optional[Dict[str, int]] = None):
+        response = await self.async_client.chat.completions.create(
+            model=self.llm_model, messages=[{"role": "user", "content": prompt}]
+        )
+        llm.add_token_usage(token_usage, response)
+        return response.choices[0].message.content
+
+    def llm_stream(self, prompt) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.llm_model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     
 class OllamaRag(ChatGPTRAG):
     OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434/v1/")
-    client = OpenAI(base_url=OLLAMA_URL, api_key="ollama")
\ No newline at end of file
+
+    def create_client(self) -> OpenAI:
+        return OpenAI(base_url=self.OLLAMA_URL, api_key="ollama")
+
+    def create_async_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(base_url=self.OLLAMA_URL, api_key="ollama")
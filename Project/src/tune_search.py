@@ -0,0 +1,272 @@
+"""
+Grid search over the parameters of a searcher on ``data/ground_truth_data.csv``.
+
+The queries are embedded once, every configuration of the grid is evaluated by
+``evaluate_retrieval.evaluate`` in a pool of worker processes, and the hit rate, MRR
+and latency of every configuration plus the Pareto frontier of quality (``--quality``)
+against p95 latency are written to a JSON file.
+
+The grid is a JSON object mapping constructor parameters of the searcher class to
+lists of values, e.g. for the hybrid searcher:
+
+    {"semantic_weight": [0.3, 0.5, 0.7], "fuzziness": ["AUTO", null]}
+
+Every configuration is scored at the same cutoff ``--k``, and the searchers return
+``--k`` results unless the grid sets their number of results (``k`` or ``size``), which
+may not exceed ``--k``. The numpy searcher has no parameters to tune besides its
+index, so by default its single configuration is evaluated; a grid like
+``{"index_path": ["data/numpy_index", "data/numpy_index_fp16"]}`` compares indexes.
+
+The workers search the same Elasticsearch node concurrently, so the absolute latency
+grows with ``--workers``; the configurations are compared under the same load.
+
+Usage (from the project directory, Elasticsearch with the index has to be running):
+
+    python src/tune_search.py --searcher hybrid --workers 4
+"""
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+
+import click
+import pandas as pd
+from loguru import logger
+
+import evaluate_retrieval
+
+
+DEFAULT_GRIDS: Dict[str, Dict[str, list]] = {
+    "semantic": {"num_candidates": [50, 100, 200, 500]},
+    "keyword": {"vague_boost": [1, 2, 3, 5]},
+    "hybrid": {"semantic_weight": [0.3, 0.5, 0.7], "fuzziness": ["AUTO", None]},
+    "numpy": {},
+}
+# constructor parameter of the number of results of every searcher
+RESULT_COUNT_PARAMETERS = {
+    "semantic": "k",
+    "keyword": "size",
+    "hybrid": "size",
+    "numpy": "k",
+}
+
+# set by the initializer of every worker process, so that the queries are sent to
+# each worker once instead of with every configuration
+_worker_state: Dict[str, Any] = {}
+
+
+def grid_configurations(grid: Dict[str, list]) -> List[Dict[str, Any]]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def pareto_frontier(
+    results: List[Dict[str, Any]], quality: str, latency: str = "p95"
+) -> List[Dict[str, Any]]:
+    """
+    Returns the results that no other result beats in both quality (higher is better)
+    and latency (lower is better), ordered by latency.
+    """
+    frontier = []
+    ordered = sorted(results, key=lambda r: (r["latency_ms"][latency], -r[quality]))
+    for result in ordered:
+        if not frontier or result[quality] > frontier[-1][quality]:
+            frontier.append(result)
+    return frontier
+
+
+def _init_worker(
+    ground_truth: pd.DataFrame,
+    input_arguments: list,
+    searcher_name: str,
+    index_name: str,
+    elastic_url: str,
+    batch_size: int,
+    concurrency: int,
+    k: int,
+) -> None:
+    _worker_state.update(
+        ground_truth=ground_truth,
+        input_arguments=input_arguments,
+        searcher_name=searcher_name,
+        index_name=index_name,
+        elastic_url=elastic_url,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        k=k,
+    )
+
+
+def _evaluate_configuration(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    searcher_kwargs = dict(parameters)
+    searcher_kwargs.setdefault(
+        RESULT_COUNT_PARAMETERS[_worker_state["searcher_name"]], _worker_state["k"]
+    )
+    if _worker_state["searcher_name"] == "hybrid":
+        # the statements come with their embeddings, no model in the workers
+        searcher_kwargs["model_name"] = None
+    searcher = evaluate_retrieval.create_searcher(
+        _worker_state["searcher_name"],
+        _worker_state["index_name"],
+        _worker_state["elastic_url"],
+        **searcher_kwargs,
+    )
+    result = evaluate_retrieval.evaluate(
+        searcher,
+        _worker_state["ground_truth"],
+        _worker_state["input_arguments"],
+        _worker_state["batch_size"],
+        _worker_state["concurrency"],
+        _worker_state["k"],
+    )
+    return {"parameters": parameters, **result}
+
+
+@click.command()
+@click.option(
+    "--searcher",
+    "searcher_name",
+    type=click.Choice(list(evaluate_retrieval.SEARCHERS)),
+    default="semantic",
+)
+@click.option("--grid", default=None, help="JSON grid or path to a JSON file")
+@click.option("--index_name", default=None, help="Defaults to the searcher's index")
+@click.option("--elastic_url", default="http://localhost:9200")
+@click.option("--model_name", default="all-mpnet-base-v2", help="Query encoder")
+@click.option(
+    "--ground_truth",
+    default=str(evaluate_retrieval.PROJECT_DIR / "data" / "ground_truth_data.csv"),
+)
+@click.option("--sample", default=0, help="Number of queries, 0 for all")
+@click.option("--batch_size", default=64, help="Queries per _msearch request")
+@click.option("--concurrency", default=4, help="_msearch requests in flight per worker")
+@click.option("--workers", default=min(4, os.cpu_count()), help="Worker processes")
+@click.option(
+    "--k",
+    type=click.IntRange(min=1),
+    default=5,
+    help="Cutoff of hit rate and MRR of every configuration",
+)
+@click.option("--quality", type=click.Choice(["mrr", "hit_rate"]), default="mrr")
+@click.option(
+    "--output",
+    default=None,
+    help="Defaults to evaluations/tuning_<searcher>_<commit>.json",
+)
+def main(
+    searcher_name,
+    grid,
+    index_name,
+    elastic_url,
+    model_name,
+    ground_truth,
+    sample,
+    batch_size,
+    concurrency,
+    workers,
+    k,
+    quality,
+    output,
+):
+    """Grid search of searcher parameters, with the Pareto frontier of the results."""
+    if grid is None:
+        grid = DEFAULT_GRIDS[searcher_name]
+    elif os.path.exists(grid):
+        with open(grid, "r") as f:
+            grid = json.load(f)
+    else:
+        grid = json.loads(grid)
+    for name in ["k", "size"]:
+        if any(value < 1 or value > k for value in grid.get(name, [])):
+            raise click.BadParameter(
+                f"{name} has to be between 1 and --k ({k}), the cutoff of every "
+                "configuration",
+                param_hint="grid",
+            )
+    configurations = grid_configurations(grid)
+
+    ground_truth_data = pd.read_csv(ground_truth)
+    if sample:
+        ground_truth_data = ground_truth_data.sample(
+            min(sample, len(ground_truth_data)), random_state=42
+        )
+    start = time.perf_counter()
+    input_arguments = evaluate_retrieval.embed_queries(
+        searcher_name, model_name, ground_truth_data["vague"].tolist()
+    )
+    logger.info(
+        f"Embedded {len(input_arguments)} queries in "
+        f"{time.perf_counter() - start:.1f}s, evaluating {len(configurations)} "
+        f"configurations in {workers} processes"
+    )
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            ground_truth_data,
+            input_arguments,
+            searcher_name,
+            index_name,
+            elastic_url,
+            batch_size,
+            concurrency,
+            k,
+        ),
+    ) as executor:
+        futures = [
+            executor.submit(_evaluate_configuration, parameters)
+            for parameters in configurations
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            logger.info(
+                f"{result['parameters']}: {quality}={result[quality]:.3f} "
+                f"p95={result['latency_ms']['p95']:.1f}ms"
+            )
+
+    frontier = pareto_frontier(results, quality)
+    commit = evaluate_retrieval.git_commit()
+    report = {
+        "searcher": searcher_name,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(),
+        "queries": len(input_arguments),
+        "grid": grid,
+        "k": k,
+        "quality": quality,
+        "results": sorted(results, key=lambda r: -r[quality]),
+        "pareto_frontier": frontier,
+    }
+    if output is None:
+        output = (
+            evaluate_retrieval.PROJECT_DIR
+            / "evaluations"
+            / f"tuning_{searcher_name}_{commit[:8]}.json"
+        )
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    click.echo(f"Pareto frontier ({quality}@{k} vs p95 latency):")
+    for result in frontier:
+        click.echo(
+            f"  {quality}={result[quality]:.3f} "
+            f"hit_rate={result['hit_rate']:.3f} "
+            f"p95={result['latency_ms']['p95']:.1f}ms {result['parameters']}"
+        )
+    click.echo(f"Written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Vectorized retrieval metrics, computed for every cutoff k = 1..K in one pass.
+
+The input is either
+
+* a relevance matrix of shape (queries, K), row i holding the relevance of the
+  ranked results of query i (lists of lists of booleans are accepted as well,
+  shorter rows are padded with non relevant results), or
+* a vector of first hit ranks, the 1-based rank of the relevant result of each
+  query and 0 if it was not retrieved; every query has exactly one relevant
+  document, as for the ground truth data.
+
+Each metric is returned as an array of length K, the value at index k - 1 being
+the metric@k, averaged over the queries.
+"""
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+
+
+def relevance_matrix(relevance_total, k: Optional[int] = None) -> np.ndarray:
+    """
+    Converts relevance judgments per query to a boolean matrix.
+    :param relevance_total: List of relevance judgments per query or a matrix.
+    :param k: Number of columns, defaults to the longest list.
+    :return: Boolean matrix of shape (queries, k).
+    """
+    if isinstance(relevance_total, np.ndarray):
+        matrix = relevance_total.astype(bool, copy=False)
+        return matrix if k is None else matrix[:, :k]
+    if k is None:
+        k = max((len(line) for line in relevance_total), default=0)
+    matrix = np.zeros((len(relevance_total), k), dtype=bool)
+    for i, line in enumerate(relevance_total):
+        line = line[:k]
+        matrix[i, : len(line)] = line
+    return matrix
+
+
+def first_hit_ranks(relevance: np.ndarray) -> np.ndarray:
+    """
+    Returns the 1-based rank of the first relevant result per query, 0 for misses.
+    :param relevance: Boolean relevance matrix of shape (queries, K).
+    """
+    hits = relevance.any(axis=1)
+    return np.where(hits, relevance.argmax(axis=1) + 1, 0)
+
+
+def _discounts(k: int) -> np.ndarray:
+    return 1.0 / np.log2(np.arange(2, k + 2))
+
+
+def metrics_from_first_hit_ranks(ranks, k: int) -> Dict[str, np.ndarray]:
+    """
+    Calculates hit rate, MRR, precision, recall and nDCG at 1..k from first hit
+    ranks, assuming one relevant document per query.
+    :param ranks: 1-based rank of the relevant document per query, 0 for misses.
+    :param k: Largest cutoff.
+    :return: Metric name to array of metric@1..k.
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    # ranks beyond k count as misses
+    counts = np.bincount(np.where(ranks > k, 0, ranks), minlength=k + 1)[1:]
+    n_queries = max(len(ranks), 1)
+    cutoffs = np.arange(1, k + 1)
+    hit_rate = np.cumsum(counts) / n_queries
+    return {
+        "hit_rate": hit_rate,
+        "mrr": np.cumsum(counts / cutoffs) / n_queries,
+        "precision": hit_rate / cutoffs,
+        "recall": hit_rate,
+        # the ideal DCG of a single relevant document is 1
+        "ndcg": np.cumsum(counts * _discounts(k)) / n_queries,
+    }
+
+
+def metrics_at_k(
+    relevance_total, k: Optional[int] = None, n_relevant=None
+) -> Dict[str, np.ndarray]:
+    """
+    Calculates hit rate, MRR, precision, recall and nDCG at 1..k.
+    :param relevance_total: Relevance matrix, lists of relevance judgments per
+    query or a vector of first hit ranks.
+    :param k: Largest cutoff, defaults to the number of ranked results.
+    :param n_relevant: Number of relevant documents per query (scalar or vector)
+    for recall and the ideal DCG, defaults to the relevant results retrieved.
+    :return: Metric name to array of metric@1..k.
+    """
+    if isinstance(relevance_total, np.ndarray) and relevance_total.ndim == 1:
+        if k is None:
+            k = int(relevance_total.max(initial=1))
+        return metrics_from_first_hit_ranks(relevance_total, k)
+
+    relevance = relevance_matrix(relevance_total, k)
+    n_queries, k = relevance.shape
+    metrics = metrics_from_first_hit_ranks(first_hit_ranks(relevance), k)
+
+    if n_relevant is None:
+        n_relevant = relevance.sum(axis=1)
+    n_relevant = np.broadcast_to(np.asarray(n_relevant, dtype=np.int64), (n_queries,))
+    # the ideal DCG of a query only depends on min(k, n_relevant), the relevant
+    # results per rank are summed per group instead of per query
+    groups = np.minimum(n_relevant, k)
+    group_counts = np.stack(
+        [
+            np.bincount(groups, weights=relevance[:, rank], minlength=k + 1)
+            for rank in range(k)
+        ],
+        axis=1,
+    )
+    weights = np.where(n_relevant > 0, 1 / np.maximum(n_relevant, 1), 0.0)
+
+    cutoffs = np.arange(1, k + 1)
+    discounts = _discounts(k)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal[np.minimum(cutoffs[None, :], np.arange(k + 1)[:, None])]
+    dcg = np.cumsum(group_counts * discounts, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndcg = np.where(idcg > 0, dcg / idcg, 0.0)
+
+    n_queries = max(n_queries, 1)
+    metrics["precision"] = np.cumsum(group_counts.sum(axis=0)) / n_queries / cutoffs
+    metrics["recall"] = np.cumsum(weights @ relevance) / n_queries
+    metrics["ndcg"] = ndcg.sum(axis=0) / n_queries
+    return metrics
@@ -1,6 +1,7 @@
 def mrr(relevance_total: list)-> float:
     """
-    Calculate the Mean Reciprocal Rank (MRR) for a list of relevance judgments.
+    Calculate the Mean Reciprocal Rank (MRR) for a list of relevance judgments,
+    only the first relevant item of a query counts.
     :param relevance_total: A list of lists, where each inner list represents a query's
     relevance judgments. Each judgment is a boolean value
     indicating whether the item at that rank is relevant (True)
@@ -14,6 +15,7 @@ def mrr(relevance_total: list)-> float:
         for rank in range(len(line)):
             if line[rank] is True:
                 total_score += 1 / (rank + 1)
+                break
     return total_score / len(relevance_total)
 
 def hit_rate(relevance_total: list) -> float:
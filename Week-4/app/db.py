@@ -56,11 +56,14 @@ def init_db():
         conn.close()
 
 
-def save_conversation(conversation_id, question, answer_data, course, timestamp=None):
+def save_conversation(conversation_id, question, answer_data, course, timestamp=None, conn=None):
+    # an open connection can be passed to avoid connecting for every row
     if timestamp is None:
         timestamp = datetime.now(tz)
     
-    conn = get_db_connection()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -92,14 +95,17 @@ def save_conversation(conversation_id, question, answer_data, course, timestamp=
             )
         conn.commit()
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
 
 
-def save_feedback(conversation_id, feedback, timestamp=None):
+def save_feedback(conversation_id, feedback, timestamp=None, conn=None):
     if timestamp is None:
         timestamp = datetime.now(tz)
 
-    conn = get_db_connection()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
@@ -108,7 +114,8 @@ def save_feedback(conversation_id, feedback, timestamp=None):
             )
         conn.commit()
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
 
 
 def get_recent_conversations(limit=5, relevance=None):
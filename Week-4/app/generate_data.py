@@ -1,5 +1,9 @@
-import time
+import argparse
+import csv
+import io
 import random
+import threading
+import time
 import uuid
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
@@ -29,125 +33,357 @@ COURSES = ["machine-learning-zoomcamp", "data-engineering-zoomcamp", "mlops-zoom
 MODELS = ["ollama/phi3", "openai/gpt-3.5-turbo", "openai/gpt-4o", "openai/gpt-4o-mini"]
 RELEVANCE = ["RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT"]
 
+CONVERSATION_COLUMNS = [
+    "id",
+    "question",
+    "answer",
+    "course",
+    "model_used",
+    "response_time",
+    "relevance",
+    "relevance_explanation",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "eval_prompt_tokens",
+    "eval_completion_tokens",
+    "eval_total_tokens",
+    "openai_cost",
+    "timestamp",
+]
+
+
+def generate_record():
+    """Returns a random (conversation_id, question, answer_data, course, feedback), feedback is None for 30% of the conversations."""
+    conversation_id = str(uuid.uuid4())
+    question = random.choice(SAMPLE_QUESTIONS)
+    answer = random.choice(SAMPLE_ANSWERS)
+    course = random.choice(COURSES)
+    model = random.choice(MODELS)
+    relevance = random.choice(RELEVANCE)
+
+    openai_cost = 0
+
+    if model.startswith("openai/"):
+        openai_cost = random.uniform(0.001, 0.1)
+
+    answer_data = {
+        "answer": answer,
+        "response_time": random.uniform(0.5, 5.0),
+        "relevance": relevance,
+        "relevance_explanation": f"This answer is {relevance.lower()} to the question.",
+        "model_used": model,
+        "prompt_tokens": random.randint(50, 200),
+        "completion_tokens": random.randint(50, 300),
+        "total_tokens": random.randint(100, 500),
+        "eval_prompt_tokens": random.randint(50, 150),
+        "eval_completion_tokens": random.randint(20, 100),
+        "eval_total_tokens": random.randint(70, 250),
+        "openai_cost": openai_cost,
+    }
+
+    feedback = None
+    if random.random() < 0.7:
+        feedback = 1 if random.random() < 0.8 else -1
+    return conversation_id, question, answer_data, course, feedback
+
+
+def _copy_chunk(conn, conversations, feedbacks):
+    with conn.cursor() as cur:
+        for table, columns, rows in [
+            ("conversations", CONVERSATION_COLUMNS, conversations),
+            ("feedback", ["conversation_id", "feedback", "timestamp"], feedbacks),
+        ]:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cur.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+    conn.commit()
+
 
-def generate_synthetic_data(start_time, end_time):
+def generate_synthetic_data(
+    start_time, end_time, min_step=60, max_step=900, chunk_size=10000
+):
+    """
+    Backfills conversations from start_time to end_time, one every min_step to max_step seconds.
+    The rows are streamed through COPY over one connection, chunk_size conversations per transaction.
+    """
     current_time = start_time
     conversation_count = 0
+    feedback_count = 0
+    conversations, feedbacks = [], []
+    started = time.perf_counter()
     print(f"Starting historical data generation from {start_time} to {end_time}")
-    while current_time < end_time:
-        conversation_id = str(uuid.uuid4())
-        question = random.choice(SAMPLE_QUESTIONS)
-        answer = random.choice(SAMPLE_ANSWERS)
-        course = random.choice(COURSES)
-        model = random.choice(MODELS)
-        relevance = random.choice(RELEVANCE)
-
-        openai_cost = 0
-
-        if model.startswith("openai/"):
-            openai_cost = random.uniform(0.001, 0.1)
-
-        answer_data = {
-            "answer": answer,
-            "response_time": random.uniform(0.5, 5.0),
-            "relevance": relevance,
-            "relevance_explanation": f"This answer is {relevance.lower()} to the question.",
-            "model_used": model,
-            "prompt_tokens": random.randint(50, 200),
-            "completion_tokens": random.randint(50, 300),
-            "total_tokens": random.randint(100, 500),
-            "eval_prompt_tokens": random.randint(50, 150),
-            "eval_completion_tokens": random.randint(20, 100),
-            "eval_total_tokens": random.randint(70, 250),
-            "openai_cost": openai_cost,
-        }
-
-        save_conversation(conversation_id, question, answer_data, course, current_time)
-        print(
-            f"Saved conversation: ID={conversation_id}, Time={current_time}, Course={course}, Model={model}"
-        )
-
-        if random.random() < 0.7:
-            feedback = 1 if random.random() < 0.8 else -1
-            save_feedback(conversation_id, feedback, current_time)
-            print(
-                f"Saved feedback for conversation {conversation_id}: {'Positive' if feedback > 0 else 'Negative'}"
+    conn = get_db_connection()
+    try:
+        while current_time < end_time:
+            conversation_id, question, answer_data, course, feedback = generate_record()
+            conversations.append(
+                [conversation_id, question, answer_data["answer"], course]
+                + [answer_data[column] for column in CONVERSATION_COLUMNS[4:-1]]
+                + [current_time.isoformat()]
             )
+            if feedback is not None:
+                feedbacks.append([conversation_id, feedback, current_time.isoformat()])
 
-        current_time += timedelta(minutes=random.randint(1, 15))
-        conversation_count += 1
-        if conversation_count % 10 == 0:
-            print(f"Generated {conversation_count} conversations so far...")
+            current_time += timedelta(seconds=random.uniform(min_step, max_step))
+            conversation_count += 1
+            if len(conversations) >= chunk_size:
+                _copy_chunk(conn, conversations, feedbacks)
+                feedback_count += len(feedbacks)
+                conversations, feedbacks = [], []
+                print(f"Generated {conversation_count} conversations so far...")
+        if conversations:
+            _copy_chunk(conn, conversations, feedbacks)
+            feedback_count += len(feedbacks)
+    finally:
+        conn.close()
 
+    elapsed = time.perf_counter() - started
     print(
-        f"Historical data generation complete. Total conversations: {conversation_count}"
+        f"Historical data generation complete. Total conversations: {conversation_count}, "
+        f"feedback: {feedback_count}, {conversation_count / max(elapsed, 1e-9):.0f} conversations/s"
     )
 
 
-def generate_live_data():
-    conversation_count = 0
-    print("Starting live data generation...")
-    while True:
-        current_time = datetime.now(tz)
-        # current_time = None
-        conversation_id = str(uuid.uuid4())
-        question = random.choice(SAMPLE_QUESTIONS)
-        answer = random.choice(SAMPLE_ANSWERS)
-        course = random.choice(COURSES)
-        model = random.choice(MODELS)
-        relevance = random.choice(RELEVANCE)
-
-        openai_cost = 0
-
-        if model.startswith("openai/"):
-            openai_cost = random.uniform(0.001, 0.1)
-
-        answer_data = {
-            "answer": answer,
-            "response_time": random.uniform(0.5, 5.0),
-            "relevance": relevance,
-            "relevance_explanation": f"This answer is {relevance.lower()} to the question.",
-            "model_used": model,
-            "prompt_tokens": random.randint(50, 200),
-            "completion_tokens": random.randint(50, 300),
-            "total_tokens": random.randint(100, 500),
-            "eval_prompt_tokens": random.randint(50, 150),
-            "eval_completion_tokens": random.randint(20, 100),
-            "eval_total_tokens": random.randint(70, 250),
-            "openai_cost": openai_cost,
-        }
-
-        save_conversation(conversation_id, question, answer_data, course, current_time)
-        print(
-            f"Saved live conversation: ID={conversation_id}, Time={current_time}, Course={course}, Model={model}"
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
         )
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 
-        if random.random() < 0.7:
-            feedback = 1 if random.random() < 0.8 else -1
-            save_feedback(conversation_id, feedback, current_time)
-            print(
-                f"Saved feedback for live conversation {conversation_id}: {'Positive' if feedback > 0 else 'Negative'}"
+def target_qps(elapsed, qps, burst_qps, burst_every, burst_duration):
+    """Target rate at `elapsed` seconds: qps, and burst_qps for burst_duration seconds every burst_every seconds."""
+    if burst_every and elapsed % burst_every < burst_duration:
+        return burst_qps
+    return qps
+
+
+def generate_live_data(
+    qps=1.0,
+    burst_qps=None,
+    burst_every=0,
+    burst_duration=0,
+    workers=1,
+    report_every=10,
+    duration=0,
+):
+    """
+    Inserts live conversations at the target rate, driven by a token bucket shared by `workers` threads
+    (one connection each), and reports the achieved throughput and insert latency every report_every seconds.
+    A failed insert is rolled back and counted, a broken connection is reopened.
+    """
+    burst_qps = burst_qps or qps
+    bucket = TokenBucket(qps, capacity=max(1.0, burst_qps))
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies = []
+    counts = {"conversations": 0, "feedback": 0, "errors": 0}
+    last_error = [None]
+
+    def record_error(e):
+        with lock:
+            counts["errors"] += 1
+            last_error[0] = f"{type(e).__name__}: {e}".strip()
+
+    def worker():
+        conn = None
+        try:
+            while not stop.is_set():
+                if conn is None or conn.closed:
+                    try:
+                        conn = get_db_connection()
+                    except Exception as e:
+                        record_error(e)
+                        stop.wait(1)
+                        continue
+                bucket.acquire()
+                if stop.is_set():
+                    break
+                current_time = datetime.now(tz)
+                conversation_id, question, answer_data, course, feedback = (
+                    generate_record()
+                )
+                started = time.perf_counter()
+                saved = 0
+                try:
+                    save_conversation(
+                        conversation_id,
+                        question,
+                        answer_data,
+                        course,
+                        current_time,
+                        conn=conn,
+                    )
+                    saved = 1
+                    if feedback is not None:
+                        save_feedback(
+                            conversation_id, feedback, current_time, conn=conn
+                        )
+                except Exception as e:
+                    record_error(e)
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        # the connection is broken, it is reopened on the next loop
+                        conn.close()
+                    with lock:
+                        counts["conversations"] += saved
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    counts["conversations"] += 1
+                    counts["feedback"] += feedback is not None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    print(
+        f"Starting live data generation at {qps} qps (bursts of {burst_qps} qps), {workers} workers..."
+    )
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    started = time.monotonic()
+    reported_at, reported_count = started, 0
+    try:
+        while not duration or time.monotonic() - started < duration:
+            time.sleep(0.1)
+            if not any(thread.is_alive() for thread in threads):
+                print("All live workers have stopped, ending the live data generation.")
+                break
+            now = time.monotonic()
+            bucket.set_rate(
+                target_qps(now - started, qps, burst_qps, burst_every, burst_duration)
             )
+            if now - reported_at >= report_every:
+                with lock:
+                    window, latencies[:] = sorted(latencies), []
+                    count, errors = counts["conversations"], counts["errors"]
+                    error, last_error[0] = last_error[0], None
+                latency = "no successful inserts"
+                if window:
+                    p50 = window[len(window) // 2] * 1000
+                    p95 = window[int(len(window) * 0.95)] * 1000
+                    latency = f"insert latency p50={p50:.1f}ms p95={p95:.1f}ms"
+                print(
+                    f"Generated {count} live conversations so far, "
+                    f"{(count - reported_count) / (now - reported_at):.1f} qps "
+                    f"(target {bucket.rate} qps), {latency}, {errors} errors"
+                    + (f", last error: {error}" if error else "")
+                )
+                reported_at, reported_count = now, count
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        elapsed = time.monotonic() - started
+        print(
+            f"Live data generation: {counts['conversations']} conversations and {counts['feedback']} feedback "
+            f"in {elapsed:.1f}s, {counts['conversations'] / elapsed:.1f} qps, {counts['errors']} failed inserts"
+        )
 
-        conversation_count += 1
-        if conversation_count % 10 == 0:
-            print(f"Generated {conversation_count} live conversations so far...")
 
-        time.sleep(1)
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Synthetic conversations and feedback for the Course Assistant"
+    )
+    parser.add_argument("--mode", choices=["backfill", "live", "both"], default="both")
+    parser.add_argument(
+        "--hours", type=float, default=6, help="history length of the backfill"
+    )
+    parser.add_argument(
+        "--min-step",
+        type=float,
+        default=60,
+        help="min seconds between backfilled conversations",
+    )
+    parser.add_argument(
+        "--max-step",
+        type=float,
+        default=900,
+        help="max seconds between backfilled conversations",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="conversations per COPY"
+    )
+    parser.add_argument("--qps", type=float, default=1.0, help="live target rate")
+    parser.add_argument(
+        "--burst-qps", type=float, default=None, help="live rate during bursts"
+    )
+    parser.add_argument(
+        "--burst-every",
+        type=float,
+        default=0,
+        help="seconds between bursts, 0 disables them",
+    )
+    parser.add_argument(
+        "--burst-duration", type=float, default=0, help="seconds a burst lasts"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="live writer threads")
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=0,
+        help="seconds of live generation, 0 runs until Ctrl+C",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     print(f"Script started at {datetime.now(tz)}")
-    end_time = datetime.now(tz)
-    start_time = end_time - timedelta(hours=6)
-    print(f"Generating historical data from {start_time} to {end_time}")
-    generate_synthetic_data(start_time, end_time)
-    print("Historical data generation complete.")
+    if args.mode in ["backfill", "both"]:
+        end_time = datetime.now(tz)
+        start_time = end_time - timedelta(hours=args.hours)
+        print(f"Generating historical data from {start_time} to {end_time}")
+        generate_synthetic_data(
+            start_time, end_time, args.min_step, args.max_step, args.chunk_size
+        )
+        print("Historical data generation complete.")
 
-    print("Starting live data generation... Press Ctrl+C to stop.")
-    try:
-        generate_live_data()
-    except KeyboardInterrupt:
-        print(f"Live data generation stopped at {datetime.now(tz)}.")
-    finally:
-        print(f"Script ended at {datetime.now(tz)}")
+    if args.mode in ["live", "both"]:
+        print("Starting live data generation... Press Ctrl+C to stop.")
+        try:
+            generate_live_data(
+                qps=args.qps,
+                burst_qps=args.burst_qps,
+                burst_every=args.burst_every,
+                burst_duration=args.burst_duration,
+                workers=args.workers,
+                duration=args.duration,
+            )
+        except KeyboardInterrupt:
+            print(f"Live data generation stopped at {datetime.now(tz)}.")
+    print(f"Script ended at {datetime.now(tz)}")